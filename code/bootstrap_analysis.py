@@ -0,0 +1,274 @@
+"""
+Bootstrap confidence intervals and paired significance tests for TactfulToM.
+
+`make_prettytable` reports point accuracies only. With ~100 conversations some
+categories (e.g. fact_truthQA, which only exists when truth_id == 1) have few
+items, so this module adds:
+
+  • cluster bootstrap CIs (clusters = set_id) for every model × category
+  • paired, cluster-level sign-flip permutation tests between every pair of models
+
+All resamples are drawn as one weight / sign matrix and applied to per-cluster
+sums with a single matrix product, so thousands of resamples take seconds.
+
+Usage (from the repository root, after `evaluate_non_freeform.py` has written results/clean):
+    python code/bootstrap_analysis.py --condition full_context --n_boot 10000
+"""
+
+import argparse
+import json
+import os
+from itertools import combinations
+from typing import Dict, List, Optional
+
+import numpy as np
+from prettytable import PrettyTable
+
+from evaluate_non_freeform import question_categories
+from result_table import RESULTS_DIR, encode, list_result_files, load_result_table
+
+
+def cluster_sums(table: Dict[str, np.ndarray], group_by: str = "model",
+                 categories: Optional[List[str]] = None):
+    """
+    Aggregate entry scores into per-cluster sums and counts.
+
+    Args:
+        table (dict): Table from `load_result_table`
+        group_by (str): Column identifying a "model" row ("model" or "file_name")
+        categories (list): Category order (default: `question_categories`)
+
+    Returns:
+        tuple: (groups, categories, clusters, S, N) where S and N have shape
+               (n_clusters, n_groups, n_categories) and hold score sums / counts.
+    """
+    categories = categories or question_categories
+    groups, group_idx = encode(table[group_by])
+    clusters, cluster_idx = encode(table["set_id"])
+    _, cat_idx = encode(table["category"], categories)
+    keep = cat_idx >= 0
+
+    K, M, C = len(clusters), len(groups), len(categories)
+    flat = (cluster_idx[keep] * M + group_idx[keep]) * C + cat_idx[keep]
+    S = np.bincount(flat, weights=table["score"][keep], minlength=K * M * C).reshape(K, M, C)
+    N = np.bincount(flat, minlength=K * M * C).reshape(K, M, C).astype(np.float64)
+    return groups, categories, clusters, S, N
+
+
+def bootstrap_ci(S: np.ndarray, N: np.ndarray, n_boot: int = 10000, alpha: float = 0.05,
+                 seed: int = 0, batch_size: int = 2000) -> Dict[str, np.ndarray]:
+    """
+    Cluster bootstrap of accuracy for every group × category at once.
+
+    Each resample draws clusters with replacement as a multinomial count vector;
+    a batch of resamples is a (batch, K) weight matrix, and W @ S gives the
+    resampled score sums of every group × category in one product.
+
+    Args:
+        S (np.ndarray): Per-cluster score sums, shape (K, ...)
+        N (np.ndarray): Per-cluster item counts, shape (K, ...)
+        n_boot (int): Number of bootstrap resamples
+        alpha (float): 1 - confidence level
+        seed (int): Random seed
+        batch_size (int): Resamples drawn per matrix product
+
+    Returns:
+        dict: "mean", "low", "high", "std" arrays with shape S.shape[1:]
+              (NaN where a group × category has no items)
+    """
+    rng = np.random.default_rng(seed)
+    K = S.shape[0]
+    S2, N2 = S.reshape(K, -1), N.reshape(K, -1)
+
+    boot_means = []
+    for start in range(0, n_boot, batch_size):
+        size = min(batch_size, n_boot - start)
+        W = rng.multinomial(K, np.full(K, 1.0 / K), size=size).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            boot_means.append((W @ S2) / (W @ N2))
+    boot_means = np.concatenate(boot_means, axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = S2.sum(0) / N2.sum(0)
+    # a resample that draws no cluster containing a category yields NaN and is ignored
+    empty = N2.sum(0) == 0
+    boot_means[:, empty] = 0.0
+    low, high = np.nanpercentile(boot_means, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    std = np.nanstd(boot_means, axis=0)
+    low[empty], high[empty], std[empty] = np.nan, np.nan, np.nan
+
+    shape = S.shape[1:]
+    return {"mean": mean.reshape(shape), "low": low.reshape(shape),
+            "high": high.reshape(shape), "std": std.reshape(shape)}
+
+
+def paired_permutation_test(table: Dict[str, np.ndarray], group_by: str = "model",
+                            categories: Optional[List[str]] = None, n_perm: int = 10000,
+                            seed: int = 0, batch_size: int = 2000) -> List[Dict]:
+    """
+    Paired permutation test between every pair of groups, per category.
+
+    Items are paired by (q_id, question_type, context_type); only items scored
+    for both groups count. Under the null the two labels are exchangeable within
+    each conversation, so each permutation flips the sign of the per-cluster sum
+    of paired differences. All pairs × categories share one sign matrix.
+
+    Args:
+        table (dict): Table from `load_result_table`
+        group_by (str): Column identifying a "model" row
+        categories (list): Category order (default: `question_categories`)
+        n_perm (int): Number of permutations
+        seed (int): Random seed
+        batch_size (int): Permutations drawn per matrix product
+
+    Returns:
+        list: One dict per (model_a, model_b, category) with accuracies on the
+              shared items, their difference, n_items and two-sided p_value.
+    """
+    categories = categories or question_categories
+    groups, group_idx = encode(table[group_by])
+    items, item_idx = encode(table["item_key"])
+    clusters, cluster_idx = encode(table["set_id"])
+    _, cat_idx = encode(table["category"], categories)
+
+    K, M, C = len(clusters), len(groups), len(categories)
+    X = np.full((len(items), M), np.nan)
+    X[item_idx, group_idx] = table["score"]
+    item_cluster = np.zeros(len(items), dtype=np.int64)
+    item_cat = np.full(len(items), -1, dtype=np.int64)
+    item_cluster[item_idx] = cluster_idx
+    item_cat[item_idx] = cat_idx
+
+    pairs = list(combinations(range(M), 2))
+    if not pairs:
+        return []
+    a_idx = np.array([a for a, _ in pairs])
+    b_idx = np.array([b for _, b in pairs])
+    A, B = X[:, a_idx], X[:, b_idx]
+    valid = ~np.isnan(A) & ~np.isnan(B) & (item_cat >= 0)[:, None]
+    D = np.where(valid, A - B, 0.0)
+
+    # per (cluster, category) sums of paired differences / counts / accuracies
+    g = item_cluster * C + np.where(item_cat >= 0, item_cat, 0)
+    Dg = np.zeros((K * C, len(pairs)))
+    Ng = np.zeros((K * C, len(pairs)))
+    Ag = np.zeros((K * C, len(pairs)))
+    Bg = np.zeros((K * C, len(pairs)))
+    np.add.at(Dg, g, D)
+    np.add.at(Ng, g, valid.astype(np.float64))
+    np.add.at(Ag, g, np.where(valid, A, 0.0))
+    np.add.at(Bg, g, np.where(valid, B, 0.0))
+    Dg, Ng = Dg.reshape(K, C * len(pairs)), Ng.reshape(K, C * len(pairs))
+    Ag, Bg = Ag.reshape(K, C * len(pairs)), Bg.reshape(K, C * len(pairs))
+
+    n = Ng.sum(0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observed = Dg.sum(0) / n
+    threshold = np.abs(observed) - 1e-12
+
+    rng = np.random.default_rng(seed)
+    exceed = np.zeros(C * len(pairs))
+    for start in range(0, n_perm, batch_size):
+        size = min(batch_size, n_perm - start)
+        signs = rng.choice(np.array([-1.0, 1.0]), size=(size, K))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            permuted = (signs @ Dg) / n
+        exceed += (np.abs(permuted) >= threshold).sum(0)
+    p_values = (exceed + 1) / (n_perm + 1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        acc_a, acc_b = Ag.sum(0) / n, Bg.sum(0) / n
+
+    tests = []
+    for c, category in enumerate(categories):
+        for p, (a, b) in enumerate(pairs):
+            col = c * len(pairs) + p
+            if n[col] == 0:
+                continue
+            tests.append({
+                "model_a": groups[a],
+                "model_b": groups[b],
+                "category": category,
+                "n_items": int(n[col]),
+                "acc_a": float(acc_a[col]),
+                "acc_b": float(acc_b[col]),
+                "diff": float(observed[col]),
+                "p_value": float(p_values[col])
+            })
+    return tests
+
+
+def make_ci_table(groups: List[str], categories: List[str], ci: Dict[str, np.ndarray]) -> PrettyTable:
+    table = PrettyTable()
+    table.field_names = ["model_type"] + categories
+    for m, group in enumerate(groups):
+        row = [group]
+        for c in range(len(categories)):
+            if np.isnan(ci["mean"][m, c]):
+                row.append("-")
+            else:
+                row.append("{:.2f} [{:.2f}, {:.2f}]".format(ci["mean"][m, c] * 100, ci["low"][m, c] * 100, ci["high"][m, c] * 100))
+        table.add_row(row)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bootstrap CIs and paired permutation tests for TactfulToM results")
+    parser.add_argument('--condition', type=str, default="full_context")
+    parser.add_argument('--file_names', type=str, default=None,
+                        help="Comma-separated result file names (default: every file in results/clean)")
+    parser.add_argument('--results_dir', type=str, default=RESULTS_DIR)
+    parser.add_argument('--by', type=str, default="model", choices=["model", "file_name"],
+                        help="Pool the five dataset types per model, or keep one row per result file")
+    parser.add_argument('--n_boot', type=int, default=10000)
+    parser.add_argument('--n_perm', type=int, default=10000)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output_dir', type=str, default="cases")
+    args = parser.parse_args()
+
+    if args.file_names:
+        file_names = [name.strip() for name in args.file_names.split(",")]
+    else:
+        file_names = list_result_files(args.results_dir)
+
+    table = load_result_table(file_names, args.condition, args.results_dir)
+    if not len(table["score"]):
+        print(f"No scored entries for condition {args.condition}")
+        return
+    groups, categories, clusters, S, N = cluster_sums(table, args.by)
+    ci = bootstrap_ci(S, N, args.n_boot, args.alpha, args.seed)
+    tests = paired_permutation_test(table, args.by, categories, args.n_perm, args.seed)
+
+    ci_table = make_ci_table(groups, categories, ci)
+    print(f"{int((1 - args.alpha) * 100)}% cluster bootstrap CIs ({len(clusters)} clusters, {args.n_boot} resamples)")
+    print(ci_table)
+
+    test_table = PrettyTable()
+    test_table.field_names = ["model_a", "model_b", "category", "n", "acc_a", "acc_b", "diff", "p_value"]
+    for test in tests:
+        if test["p_value"] < args.alpha:
+            test_table.add_row([test["model_a"], test["model_b"], test["category"], test["n_items"],
+                                "{:.2f}".format(test["acc_a"] * 100), "{:.2f}".format(test["acc_b"] * 100),
+                                "{:+.2f}".format(test["diff"] * 100), "{:.4f}".format(test["p_value"])])
+    print(f"Significant pairwise differences (p < {args.alpha}, {args.n_perm} permutations)")
+    print(test_table)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, f"bootstrap_ci_{args.condition}.txt"), "w") as f:
+        f.write(ci_table.get_string())
+    ci_json = {
+        group: {
+            category: {k: (None if np.isnan(v[m, c]) else float(v[m, c])) for k, v in ci.items()}
+            for c, category in enumerate(categories)
+        }
+        for m, group in enumerate(groups)
+    }
+    with open(os.path.join(args.output_dir, f"bootstrap_ci_{args.condition}.json"), "w") as f:
+        json.dump(ci_json, f, indent=3)
+    with open(os.path.join(args.output_dir, f"pairwise_tests_{args.condition}.json"), "w") as f:
+        json.dump(tests, f, indent=3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Shared helpers for the on-disk caches used across the TactfulToM scripts.
+
+Cache entries are keyed by content hashes so that a cached value is reused
+whenever the same text (or the same JSON-serializable input) is seen again,
+no matter which file, model or run it came from. Files are written through a
+temporary file and `os.replace`, so an interrupted run never leaves a
+half-written cache behind.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+
+
+CACHE_DIR = "cache"
+
+
+def text_hash(text: str) -> str:
+    """Hex digest identifying a string (128-bit BLAKE2b of its UTF-8 bytes)."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def content_hash(obj: Any) -> str:
+    """Hex digest identifying a JSON-serializable object, independent of dict key order."""
+    return text_hash(json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":")))
+
+
+def atomic_write_bytes(path: str, data: bytes):
+    """Write bytes to `path` via a temporary file in the same directory and `os.replace`."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file as 0600; give it the usual permissions
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path: str, obj: Any, indent: int = None):
+    """Dump `obj` as JSON to `path` atomically."""
+    atomic_write_bytes(path, json.dumps(obj, indent=indent, ensure_ascii=False).encode("utf-8"))
+
+
+def load_json(path: str, default: Any = None) -> Any:
+    """Load a JSON file, or return `default` if it does not exist."""
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
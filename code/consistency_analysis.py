@@ -0,0 +1,245 @@
+"""
+Cross-format consistency of TactfulToM answers.
+
+The same underlying question is asked in several formats, so a model can
+contradict itself without being caught by per-format accuracy:
+
+  • list ~ binary:      infoAccessibility / answerability / liedetectability ask
+                        "List all the characters who ..." and, for each of the four
+                        characters, "Does X ...?" about the same information or
+                        fact question. A character is consistent when the binary
+                        answer is "yes" exactly when the list answer names them.
+  • mcq ~ freeform:     belief / fact / lieability questions are asked as freeform
+                        and MCQ; the freeform answer's nearest option (by the
+                        `cos_similarity` or `token_f1` scores that
+                        `evaluate_freeform.py` writes to *_sim.json, see
+                        `freeform_scoring.py`) should be the option picked in the MCQ.
+  • binary ~ freeform:  comprehensionQA is asked as freeform and binary; the
+                        yes/no parsed from the freeform answer should match.
+
+Comparisons are collected in one pass over the entries and aggregated per
+model × pair type × category with a single bincount.
+
+Usage (from the repository root, after `evaluate_non_freeform.py` has written results/clean):
+    python code/consistency_analysis.py --condition full_context --export_cases
+"""
+
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from prettytable import PrettyTable
+
+from distractor_analysis import load_question_index, roles_in
+from evaluate_non_freeform import _clean
+from freeform_scoring import assign_options, list_sim_files, load_similarity_table
+from result_table import RESULTS_DIR, encode, list_result_files, load_result_table
+from slice_analysis import DATASET_DIR
+
+
+SHARED_QUESTION_KEYS = ["information", "fact_question_real_reason", "fact_question_truth", "comprehension_q"]
+
+# list and binary categories that ask the same thing
+LIST_BINARY_CATEGORIES = {
+    "infoAccessibilityQA_list": "infoAccessibilityQAs_binary",
+    "answerabilityQA_list": "answerabilityQAs_binary",
+    "liedetectabilityQAs_list": "liedetectabilityQAs_binary"
+}
+
+
+def shared_question(question: Dict) -> Optional[str]:
+    """The information / fact question a list or binary question is about."""
+    for key in SHARED_QUESTION_KEYS:
+        if key in question:
+            return question[key]
+    return None
+
+
+def nearest_option(entry: Dict, similarity: str = "cos_similarity") -> Optional[int]:
+    """Index (0 = correct) of the option most similar to a freeform answer, if scored."""
+    scores = entry.get(similarity)
+    if not scores:
+        return None
+    return int(np.argmax(scores))
+
+
+def _binary_character(question: Dict, characters: Dict[str, str]) -> Optional[str]:
+    roles, _ = roles_in([question["question"]], characters)
+    return next(iter(roles)) if len(roles) == 1 else None
+
+
+def load_nearest_options(file_names: List[str], condition: Optional[str] = "full_context",
+                         similarity: str = "cos_similarity") -> Dict:
+    """(file_name, q_id) -> nearest option of the freeform answer, from the *_sim.json files."""
+    available = set(list_sim_files())
+    sim_table = load_similarity_table([name for name in file_names if name in available], condition)
+    assignment = assign_options(sim_table, "cosine" if similarity == "cos_similarity" else "f1")
+    return {(file_name, q_id): int(assigned) for file_name, q_id, assigned
+            in zip(sim_table["file_name"], sim_table["q_id"], assignment["assigned"])}
+
+
+def collect_comparisons(table: Dict[str, np.ndarray], question_index: Dict[str, Dict],
+                        similarity: str = "cos_similarity", nearest_options: Optional[Dict] = None) -> List[Dict]:
+    """
+    Pair up answers to the same underlying question given in different formats.
+
+    Args:
+        table (dict): Result table loaded with include_freeform=True
+        question_index (dict): q_id -> question info from `load_question_index`
+        similarity (str): Entry field used for the freeform nearest option
+        nearest_options (dict): Precomputed (file_name, q_id) -> nearest option
+            (see `load_nearest_options`); entries not in it fall back to `similarity`
+
+    Returns:
+        list: One dict per comparison with model, file_name, category, pair_type,
+              key, left / right answers and agree (bool)
+    """
+    comparisons = []
+    by_item = {}
+    binary_answers = {}
+    for row in range(len(table["q_id"])):
+        file_name, q_id, fmt = table["file_name"][row], table["q_id"][row], table["question_type"][row]
+        by_item.setdefault((file_name, q_id), {})[fmt] = row
+        category = table["category"][row]
+        if fmt == "binary" and category in LIST_BINARY_CATEGORIES.values():
+            info = question_index.get(q_id)
+            if info is None:
+                continue
+            role = _binary_character(info["question"], info["characters"])
+            key = (file_name, table["set_id"][row], category, shared_question(info["question"]))
+            if role is not None:
+                binary_answers.setdefault(key, {})[role] = row
+
+    for (file_name, q_id), rows in by_item.items():
+        # mcq ~ freeform
+        if "mcq" in rows and "freeform" in rows:
+            mcq_entry, free_entry = table["entry"][rows["mcq"]], table["entry"][rows["freeform"]]
+            nearest = (nearest_options or {}).get((file_name, q_id))
+            if nearest is None:
+                nearest = nearest_option(free_entry, similarity)
+            if nearest is not None and isinstance(mcq_entry["clean_result"], int):
+                comparisons.append(_comparison(table, rows["mcq"], "mcq~freeform", q_id,
+                                               mcq_entry["clean_result"], nearest))
+        # binary ~ freeform
+        if "binary" in rows and "freeform" in rows and table["category"][rows["binary"]] == "comprehensionQA":
+            binary_answer = table["entry"][rows["binary"]]["clean_result"]
+            free_entry = dict(table["entry"][rows["freeform"]], question_type="binary")
+            free_entry["original_result"] = free_entry["original_result"].split("</think>")[-1].strip()
+            free_answer = _clean(free_entry, file_name)
+            if binary_answer != "NAN" and free_answer != "NAN":
+                comparisons.append(_comparison(table, rows["binary"], "binary~freeform", q_id,
+                                               binary_answer, free_answer))
+        # list ~ binary
+        if "list" in rows and table["category"][rows["list"]] in LIST_BINARY_CATEGORIES:
+            row = rows["list"]
+            info = question_index.get(q_id)
+            if info is None:
+                continue
+            key = (file_name, table["set_id"][row], LIST_BINARY_CATEGORIES[table["category"][row]],
+                   shared_question(info["question"]))
+            answer = table["entry"][row]["clean_result"]
+            named, _ = roles_in(answer if isinstance(answer, list) else [str(answer)], info["characters"])
+            for role, binary_row in binary_answers.get(key, {}).items():
+                binary_answer = table["entry"][binary_row]["clean_result"]
+                if binary_answer == "NAN":
+                    continue
+                comparisons.append(_comparison(table, row, "list~binary", f"{q_id}:{role}",
+                                               "yes" if role in named else "no", binary_answer,
+                                               right_q_id=table["q_id"][binary_row]))
+    return comparisons
+
+
+def _comparison(table, row, pair_type, key, left, right, right_q_id=None) -> Dict:
+    return {
+        "model": table["model"][row],
+        "file_name": table["file_name"][row],
+        "category": table["category"][row],
+        "pair_type": pair_type,
+        "key": key,
+        "right_q_id": right_q_id or table["q_id"][row],
+        "left": left,
+        "right": right,
+        "agree": left == right
+    }
+
+
+def agreement(comparisons: List[Dict], group_by: str = "model") -> Dict:
+    """
+    Agreement rate per group × pair type × category.
+
+    Returns:
+        dict: "groups", "pair_types", "categories" level lists and "agree" /
+              "count" / "rate" arrays of shape (n_groups, n_pair_types, n_categories)
+    """
+    groups = np.array([c[group_by] for c in comparisons], dtype=object)
+    pair_types = np.array([c["pair_type"] for c in comparisons], dtype=object)
+    categories = np.array([c["category"] for c in comparisons], dtype=object)
+    agree = np.array([c["agree"] for c in comparisons], dtype=np.float64)
+
+    group_levels, g = encode(groups)
+    pair_levels, p = encode(pair_types)
+    cat_levels, c = encode(categories)
+    dims = (max(len(group_levels), 1), max(len(pair_levels), 1), max(len(cat_levels), 1))
+    flat = np.ravel_multi_index((g, p, c), dims) if len(agree) else np.zeros(0, dtype=np.int64)
+    size = int(np.prod(dims))
+    agree_sum = np.bincount(flat, weights=agree, minlength=size).reshape(dims)
+    count = np.bincount(flat, minlength=size).reshape(dims)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = agree_sum / count
+    return {"groups": group_levels, "pair_types": pair_levels, "categories": cat_levels,
+            "agree": agree_sum, "count": count, "rate": rate}
+
+
+def make_agreement_table(result: Dict) -> PrettyTable:
+    columns = [(p, c) for p in range(len(result["pair_types"])) for c in range(len(result["categories"]))
+               if result["count"][:, p, c].sum()]
+    table = PrettyTable()
+    table.field_names = ["model_type"] + [f"{result['pair_types'][p]}:{result['categories'][c]}" for p, c in columns]
+    for g, group in enumerate(result["groups"]):
+        row = [group]
+        for p, c in columns:
+            count = result["count"][g, p, c]
+            row.append("-" if not count else "{:.2f} ({})".format(result["rate"][g, p, c] * 100, count))
+        table.add_row(row)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-format answer consistency for TactfulToM results")
+    parser.add_argument('--condition', type=str, default="full_context")
+    parser.add_argument('--file_names', type=str, default=None,
+                        help="Comma-separated result file names (default: every file in results/clean)")
+    parser.add_argument('--results_dir', type=str, default=RESULTS_DIR)
+    parser.add_argument('--dataset_dir', type=str, default=DATASET_DIR)
+    parser.add_argument('--by', type=str, default="model", choices=["model", "file_name"])
+    parser.add_argument('--similarity', type=str, default="cos_similarity", choices=["cos_similarity", "token_f1"],
+                        help="Freeform score used to find the nearest option")
+    parser.add_argument('--output_dir', type=str, default="cases")
+    parser.add_argument('--export_cases', action="store_true",
+                        help="Also write every inconsistent pair of answers")
+    args = parser.parse_args()
+
+    file_names = [name.strip() for name in args.file_names.split(",")] if args.file_names else list_result_files(args.results_dir)
+    table = load_result_table(file_names, args.condition, args.results_dir, include_freeform=True)
+    nearest_options = load_nearest_options(file_names, args.condition, args.similarity)
+    comparisons = collect_comparisons(table, load_question_index(args.dataset_dir), args.similarity, nearest_options)
+    result = agreement(comparisons, args.by)
+
+    pretty = make_agreement_table(result)
+    print("Cross-format agreement (%)")
+    print(pretty)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, f"consistency_{args.condition}.txt"), "w") as f:
+        f.write(pretty.get_string())
+    if args.export_cases:
+        inconsistent = [c for c in comparisons if not c["agree"]]
+        with open(os.path.join(args.output_dir, f"inconsistent_{args.condition}.json"), "w") as f:
+            json.dump(inconsistent, f, indent=3)
+        print(f"{len(inconsistent)} inconsistent pairs written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,19 @@ and data management for generated conversations.
 
 import os
 import json
-import re
+import threading
+
+from record_store import RecordStore
+from template_engine import character_names, compile_template, replace_characters
+
+
+# placeholders filled by populate_template
+TEMPLATE_VARIABLES = (
+    "Topic for the scenario", "relationship descriptor",
+    "A: the liar name", "B: the target name", "C: the accomplice name", "D: the observer name",
+    "leave reason B", "leave reason D_1", "leave reason D_2",
+    "real_reason_c", "truth_c", "the lie", "situation_topic", "situation", "lie_objective"
+)
 
 
 def populate_template(template, scenario, relationship, situation, lie_objective, 
@@ -15,6 +27,8 @@ def populate_template(template, scenario, relationship, situation, lie_objective
                      A_name, B_name, C_name, D_name):
     """
     Populate conversation template with provided variables.
+    The template is compiled once (see `template_engine.py`) and filled in a
+    single pass; placeholders other than the ones below raise TemplateError.
     
     Args:
         template: Template string with placeholders
@@ -37,28 +51,32 @@ def populate_template(template, scenario, relationship, situation, lie_objective
     Returns:
         str: Populated template string
     """
-    return template.replace("{{Topic for the scenario}}", scenario)\
-                   .replace("{{relationship descriptor}}", relationship)\
-                   .replace("{{A: the liar name}}", A_name)\
-                   .replace("{{B: the target name}}", B_name)\
-                   .replace("{{C: the accomplice name}}", C_name)\
-                   .replace("{{D: the observer name}}", D_name)\
-                   .replace("{{leave reason B}}", leave_reason_B)\
-                   .replace("{{leave reason D_1}}", leave_reason_D_1)\
-                   .replace("{{leave reason D_2}}", leave_reason_D_2)\
-                   .replace("{{real_reason_c}}", real_reason_c)\
-                   .replace("{{truth_c}}", truth_c if truth_c is not None else "")\
-                   .replace("{{the lie}}", lie_c)\
-                   .replace("{{situation_topic}}", situation_topic)\
-                   .replace("{{situation}}", situation)\
-                   .replace("{{lie_objective}}", lie_objective)
+    values = {
+        "Topic for the scenario": scenario,
+        "relationship descriptor": relationship,
+        "A: the liar name": A_name,
+        "B: the target name": B_name,
+        "C: the accomplice name": C_name,
+        "D: the observer name": D_name,
+        "leave reason B": leave_reason_B,
+        "leave reason D_1": leave_reason_D_1,
+        "leave reason D_2": leave_reason_D_2,
+        "real_reason_c": real_reason_c,
+        "truth_c": truth_c if truth_c is not None else "",
+        "the lie": lie_c,
+        "situation_topic": situation_topic,
+        "situation": situation,
+        "lie_objective": lie_objective
+    }
+    return compile_template(template, TEMPLATE_VARIABLES).render(values)
 
 
 def replace_ABCD_with_name(text, A_name, B_name, C_name, D_name):
     """
     Replace character placeholders (A, B, C, D) with actual names in text.
     Handles both regular names (e.g., "A") and possessive forms (e.g., "A's").
-    Uses one-pass replacement to avoid repeated substitutions.
+    Uses one-pass replacement with a precompiled pattern that only matches
+    standalone letters, so capitals inside words (e.g., "Alice") are kept.
     
     Args:
         text: Input text containing A, B, C, D placeholders
@@ -70,54 +88,68 @@ def replace_ABCD_with_name(text, A_name, B_name, C_name, D_name):
     Returns:
         str: Text with placeholders replaced by names
     """
-    mapping = {
-        "A": A_name,
-        "B": B_name,
-        "C": C_name,
-        "D": D_name
-    }
-    
-    pattern = re.compile(r"(A's|B's|C's|D's|A|B|C|D)")
-    
-    def replacer(match):
-        token = match.group(0)
-        if token.endswith("'s"):
-            letter = token[0]
-            return mapping[letter] + "'s"
-        else:
-            return mapping[token]
-    
-    return pattern.sub(replacer, text)
+    return replace_characters(text, character_names(A_name, B_name, C_name, D_name))
+
+
+# open conversation stores by .jsonl path (see `conversation_store`)
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def conversation_store(filename):
+    """
+    Append-only store backing a generated-conversation JSON file.
+
+    Records are kept in `filename` with a .jsonl extension, indexed by set_id.
+    When the store does not exist yet, the records of an existing JSON file
+    are imported into it. One store is opened per file and reused, so an
+    append only scans what other writers added since the last one.
+
+    Args:
+        filename: Path of the JSON file (e.g. dataset/elements/elements_0.json)
+
+    Returns:
+        RecordStore: The store for that file
+    """
+    path = os.path.abspath(os.path.splitext(filename)[0] + ".jsonl")
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = RecordStore(path, key="set_id")
+            store.import_json(filename)
+    return store
 
 
 def append_data_to_json(data_dict, filename):
     """
-    Append a data dictionary to a JSON file.
-    If the file doesn't exist, creates a new file.
-    If the file exists but is not valid JSON, initializes as empty list.
+    Append a data dictionary to the store of a JSON file.
+    The record is appended as one fsynced JSONL line next to `filename`
+    (see `conversation_store`) instead of rewriting the whole JSON list,
+    so concurrent writers and interrupted runs cannot lose earlier records.
+    Call `export_data_to_json` to write the JSON list itself.
     
     Args:
-        data_dict: Dictionary to append to the JSON file
+        data_dict: Dictionary to append
         filename: Path to the JSON file
         
     Returns:
         None
     """
-    if os.path.exists(filename):
-        with open(filename, "r", encoding="utf-8") as f:
-            try:
-                data_list = json.load(f)
-                if not isinstance(data_list, list):
-                    data_list = []
-            except json.JSONDecodeError:
-                data_list = []
-    else:
-        data_list = []
-    
-    data_list.append(data_dict)
+    conversation_store(filename).append(data_dict)
+
+
+def export_data_to_json(filename):
+    """
+    Write the records appended for `filename` as a JSON list (latest record per set_id),
+    in the layout of dataset/elements.
     
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data_list, f, ensure_ascii=False, indent=4)
+    Args:
+        filename: Path to the JSON file
+        
+    Returns:
+        None
+    """
+    conversation_store(filename).export_json(filename, indent=4)
 
 
 def get_leave_reasons():
@@ -0,0 +1,247 @@
+"""
+Headless batch runner for the four-step conversation generation pipeline.
+
+`conv_generation.ipynb` generates one scenario at a time: step 1 → step 4 are
+called one after another and the parts are concatenated into full_context /
+short_context. This runner reads scenario specs from dataset/elements-style
+files and runs the step chain of many scenarios concurrently with asyncio:
+
+  • each step's prompt is a compiled template (see `template_engine.py`) filled
+    with the scenario variables of `populate_template` plus the previous parts
+    ({{part_1}} ... {{part_3}})
+  • the output of every step is cached in an append-only store keyed by the
+    content hash of its inputs (model, step, messages), so a failed step 3
+    resumes from the cached steps 1–2
+  • prompt / completion token counts of every step and the full_context /
+    Short_context token counts of every conversation are recorded
+  • any OpenAI-compatible endpoint can be used (--base_url), and --stand_in
+    runs the whole pipeline offline with a deterministic local stand-in model
+
+The templates file is a JSON object {"step1": {"system": ..., "user": ...}, ...}
+(a plain string is taken as the user message).
+
+Usage (from the repository root):
+    python code/conv_pipeline.py --templates templates.json --elements dataset/elements/Tactful_conv_element_0.json \
+        --output dataset/elements/generated_0.json --base_url http://localhost:8000/v1 --model local-model
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import tiktoken
+from openai import AsyncOpenAI
+
+from cache_utils import CACHE_DIR, content_hash
+from conv_generation_utils import TEMPLATE_VARIABLES, conversation_store, extract_data_fields, load_conversation_elements
+from record_store import RecordStore
+from template_engine import CompiledTemplate
+
+
+STEPS = ["step1", "step2", "step3", "step4"]
+PART_VARIABLES = ("part_1", "part_2", "part_3")
+
+
+def scenario_values(spec: Dict) -> Dict[str, str]:
+    """Template variables of a scenario spec (an element of dataset/elements)."""
+    data = extract_data_fields(spec)
+    topic, lie, characters = data["topic"], data["lie"], data["characters"]
+    return {
+        "Topic for the scenario": topic["scenario"],
+        "relationship descriptor": data["relationship"],
+        "A: the liar name": characters["liar"],
+        "B: the target name": characters["target"],
+        "C: the accomplice name": characters["accomplice"],
+        "D: the observer name": characters["observer"],
+        "leave reason B": topic["leave_reason_B"],
+        "leave reason D_1": topic["leave_reason_D_1"],
+        "leave reason D_2": topic["leave_reason_D_2"],
+        "real_reason_c": lie["real_reason_c"],
+        "truth_c": lie["truth_c"] if lie["truth_c"] is not None else "",
+        "the lie": lie["lie_c"],
+        "situation_topic": topic["situation_topic"],
+        "situation": topic["situation"],
+        "lie_objective": topic["lie_objective"]
+    }
+
+
+def compile_step_templates(templates: Dict) -> Dict[str, Dict[str, CompiledTemplate]]:
+    """Compile and validate the system / user templates of every step."""
+    compiled = {}
+    for i, step in enumerate(STEPS):
+        if step not in templates:
+            raise ValueError(f"Missing template for {step}")
+        step_templates = templates[step] if isinstance(templates[step], dict) else {"user": templates[step]}
+        variables = TEMPLATE_VARIABLES + PART_VARIABLES[:i]
+        compiled[step] = {role: CompiledTemplate(text, variables) for role, text in step_templates.items()}
+    return compiled
+
+
+class StandInClient:
+    """Deterministic offline stand-in for an OpenAI-compatible chat endpoint."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.chat = self
+        self.completions = self
+
+    async def create(self, model: str, messages: List[Dict], **kwargs):
+        await asyncio.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        content = f"[{model} {content_hash(messages)[:8]}] " + " ".join(prompt.split()[:40])
+        message = type("Message", (), {"content": content})()
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})()], "usage": None})()
+
+
+class ConversationPipeline:
+    def __init__(self, templates: Dict, client, model: str, max_concurrency: int = 16,
+                 temperature: float = 0.7, max_retries: int = 3, cache_dir: str = CACHE_DIR,
+                 encoding: str = "cl100k_base"):
+        """
+        Args:
+            templates (dict): Step templates (see module docstring)
+            client: AsyncOpenAI-compatible client
+            model (str): Model name sent to the endpoint
+            max_concurrency (int): Maximum number of step calls in flight
+            temperature (float): Sampling temperature
+            max_retries (int): Attempts per step call
+            cache_dir (str): Root cache directory (step outputs go to conv_steps.jsonl)
+            encoding (str): tiktoken encoding used for token counts
+        """
+        self.templates = compile_step_templates(templates)
+        self.client = client
+        self.model = model
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.step_cache = RecordStore(f"{cache_dir}/conv_steps.jsonl", key="key")
+        self.encoding = tiktoken.get_encoding(encoding)
+        self.stats = {"calls": 0, "cached": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    async def run_step(self, step: str, values: Dict[str, str]) -> Dict:
+        messages = [{"role": role, "content": template.render(values)}
+                    for role, template in sorted(self.templates[step].items(), key=lambda kv: kv[0] != "system")]
+        key = content_hash([self.model, self.temperature, step, messages])
+        cached = self.step_cache.get(key)
+        if cached is not None:
+            self.stats["cached"] += 1
+            return cached
+
+        for attempt in range(self.max_retries):
+            try:
+                async with self.semaphore:
+                    response = await self.client.chat.completions.create(
+                        model=self.model, messages=messages, temperature=self.temperature)
+                break
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    self.stats["failed"] += 1
+                    raise
+                print(f"{step} failed ({e}), retrying")
+                await asyncio.sleep(2 ** attempt)
+        self.stats["calls"] += 1
+
+        content = response.choices[0].message.content
+        usage = getattr(response, "usage", None)
+        prompt_tokens = usage.prompt_tokens if usage else sum(self.count_tokens(m["content"]) for m in messages)
+        completion_tokens = usage.completion_tokens if usage else self.count_tokens(content)
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += completion_tokens
+        record = {"key": key, "step": step, "content": content,
+                  "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        self.step_cache.append(record)
+        return record
+
+    async def run_scenario(self, spec: Dict) -> Dict:
+        """Run step1 → step4 for one scenario and return the conversation record."""
+        values = scenario_values(spec)
+        parts, steps = [], {}
+        for i, step in enumerate(STEPS):
+            record = await self.run_step(step, values)
+            parts.append(record["content"])
+            steps[step] = {"prompt_tokens": record["prompt_tokens"], "completion_tokens": record["completion_tokens"]}
+            if i < len(PART_VARIABLES):
+                values[PART_VARIABLES[i]] = record["content"]
+
+        conversation = dict(spec)
+        conversation["full_context"] = "\n\n".join(parts)
+        conversation["short_context"] = "\n\n".join(parts[1:])
+        conversation["full_context_tokens"] = self.count_tokens(conversation["full_context"])
+        conversation["Short_context_tokens"] = self.count_tokens(conversation["short_context"])
+        conversation["generation_steps"] = steps
+        return conversation
+
+    async def run(self, specs: List[Dict], output: str, skip_done: bool = True) -> Dict:
+        """
+        Generate the conversations of many scenarios concurrently.
+
+        Finished conversations are appended to the store of `output` (see
+        `conversation_store`) as they complete, and `output` is exported at the end.
+
+        Returns:
+            dict: Run statistics
+        """
+        store = conversation_store(output)
+        if skip_done:
+            specs = [spec for spec in specs if spec["set_id"] not in store]
+        start = time.time()
+        failed = []
+
+        async def worker(spec):
+            try:
+                store.append(await self.run_scenario(spec))
+            except Exception as e:
+                failed.append(spec["set_id"])
+                print(f"Scenario {spec['set_id']} failed: {e}")
+
+        await asyncio.gather(*(worker(spec) for spec in specs))
+        store.export_json(output)
+        elapsed = time.time() - start
+        return dict(self.stats, scenarios=len(specs), failed_scenarios=failed, seconds=round(elapsed, 2),
+                    scenarios_per_second=round((len(specs) - len(failed)) / elapsed, 2) if elapsed else 0)
+
+
+def load_specs(paths: List[str], set_ids: Optional[List[str]] = None) -> List[Dict]:
+    specs = []
+    for path in paths:
+        specs.extend(load_conversation_elements(path))
+    if set_ids:
+        specs = [spec for spec in specs if spec["set_id"] in set(set_ids)]
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the four-step conversation generation for many scenarios")
+    parser.add_argument('--templates', type=str, required=True, help="JSON file with the step1-step4 templates")
+    parser.add_argument('--elements', type=str, required=True, help="Comma-separated scenario spec files")
+    parser.add_argument('--output', type=str, required=True, help="Output JSON file (dataset/elements layout)")
+    parser.add_argument('--set_ids', type=str, default=None, help="Comma-separated set_ids to run (default: all)")
+    parser.add_argument('--model', type=str, default="gpt-4o-2024-08-06")
+    parser.add_argument('--base_url', type=str, default=None, help="OpenAI-compatible endpoint, e.g. a local server")
+    parser.add_argument('--api_key', type=str, default=None)
+    parser.add_argument('--stand_in', action="store_true", help="Use the offline stand-in model instead of an endpoint")
+    parser.add_argument('--max_concurrency', type=int, default=16)
+    parser.add_argument('--temperature', type=float, default=0.7)
+    parser.add_argument('--rerun', action="store_true", help="Also regenerate scenarios already in the output")
+    args = parser.parse_args()
+
+    with open(args.templates, "r", encoding="utf-8") as f:
+        templates = json.load(f)
+    specs = load_specs([p.strip() for p in args.elements.split(",")],
+                       [s.strip() for s in args.set_ids.split(",")] if args.set_ids else None)
+    client = StandInClient() if args.stand_in else \
+        AsyncOpenAI(api_key=args.api_key or os.environ.get("OPENAI_API_KEY", "EMPTY"), base_url=args.base_url)
+
+    pipeline = ConversationPipeline(templates, client, args.model, args.max_concurrency, args.temperature)
+    stats = asyncio.run(pipeline.run(specs, args.output, skip_done=not args.rerun))
+    print(json.dumps(stats, indent=3))
+
+
+if __name__ == "__main__":
+    main()
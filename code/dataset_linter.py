@@ -0,0 +1,353 @@
+"""
+Consistency linter for the final_set files.
+
+Every question set of dataset/final_set is checked for the bugs the dataset
+has had so far (one rule each):
+
+  • schema: required set keys (set_id, characters with the four roles, the
+    _c lie fields, full_context, every question field) and question keys
+    (question, question_type, correct_answer, q_id)
+  • q_id: q_ids of the form {set_id}-{prefix}-{i} for their question field,
+    unique across all final_set files
+  • options: a set_id with no justification options, an options entry that
+    fails `validate_options`, or a justificationQA whose answers differ from
+    its options entry
+  • c_vs_q: _c content (lie_c, real_reason_c, truth_c) in a question where the
+    _q content was intended (see replace_c_with_q_content.py)
+  • wrong_answer_type: "wrong_answers" instead of "wrong_answer", nested
+    lists, or a single string where the question type takes a list (only
+    question types generated with a fixed string answer, e.g. comprehension,
+    take a string)
+  • duplicate_answer: the correct answer (or one of its names, for list
+    questions) among the wrong answers, or a wrong answer given twice
+  • name_leak: character placeholders ("A", "B", "C", "D") left in a question
+    or its answers
+
+The questions of the sets to check are flattened into one table (one row per
+question) and the per-question rules are evaluated as masks over its columns.
+Issues are cached per set in cache/lint/final_set.json, keyed by the content
+hash of the set and its options entry (the whole cache is dropped when this
+file changes), so a CI run only checks the sets that changed; q_id uniqueness
+spans sets and is recomputed every run.
+
+Usage (from the repository root):
+    python code/dataset_linter.py
+    python code/dataset_linter.py --rules name_leak c_vs_q --no_cache
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cache_utils import CACHE_DIR, atomic_write_json, content_hash, load_json, text_hash
+from generate_questions import FINAL_SET_DIR, SET_PREFIX
+from justification_options_schema import _canonical, normalize_options, validate_options
+from question_generation_utils import JUSTIFICATION_OPTIONS_DIR, flatten_wrong_answers, load_justification_index
+from question_specs import QUESTION_FIELDS, QUESTION_SPECS, ROLES
+from replace_c_with_q_content import ReplacementEngine
+from template_engine import CHARACTER_PATTERN
+
+
+LINT_CACHE_PATH = os.path.join(CACHE_DIR, "lint", "final_set.json")
+
+RULES = ("schema", "q_id", "options", "c_vs_q", "wrong_answer_type", "duplicate_answer", "name_leak")
+
+REQUIRED_SET_KEYS = ("set_id", "characters", "lie", "full_context") + tuple(field for field, _ in QUESTION_FIELDS)
+# the _q forms are optional (question generation falls back to the _c ones)
+REQUIRED_LIE_KEYS = ("real_reason_c", "lie_c", "truth_c")
+REQUIRED_QUESTION_KEYS = ("question", "question_type", "correct_answer", "q_id")
+# question keys that are labels, not text shown to the model
+META_KEYS = ("q_id", "question_type", "tom_type", "wrong_answer_types")
+
+# question types generated with a single fixed wrong answer string
+STRING_WRONG_ANSWER_TYPES = tuple(sorted({spec["fields"]["question_type"] for spec in QUESTION_SPECS
+                                          if isinstance(spec.get("fields", {}).get("wrong_answer"), str)}))
+
+Issue = Dict[str, str]
+
+
+def set_files(final_set_dir: str = FINAL_SET_DIR) -> List[str]:
+    """final_set files of a directory, sorted."""
+    return [os.path.join(final_set_dir, name) for name in sorted(os.listdir(final_set_dir))
+            if name.startswith(SET_PREFIX) and name.endswith(".json")]
+
+
+def rules_version() -> str:
+    """Hash of the linter source and CHARACTER_PATTERN; cached issues of another version are not reused."""
+    with open(os.path.abspath(__file__), "r", encoding="utf-8") as f:
+        return text_hash(f.read() + CHARACTER_PATTERN.pattern)
+
+
+def _issue(rule: str, set_id: str, field: str, message: str) -> Issue:
+    return {"rule": rule, "set_id": set_id, "field": field, "message": message}
+
+
+def wrong_answer_kind(question: Dict[str, Any]) -> str:
+    """Shape of the wrong answers of a question: none, str, list, nested, plural_key or other."""
+    if "wrong_answer" not in question:
+        return "plural_key" if "wrong_answers" in question else "none"
+    value = question["wrong_answer"]
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return "list"
+    if isinstance(value, list) and any(isinstance(v, list) for v in value):
+        return "nested"
+    return "other"
+
+
+def duplicate_answer(question: Dict[str, Any]) -> str:
+    """Problem with the answers of a question being duplicated, or "" if there is none."""
+    wrong_answers = [answer for answer in flatten_wrong_answers(question) if isinstance(answer, str)]
+    if not wrong_answers:
+        return ""
+    correct_answer = question.get("correct_answer")
+    if isinstance(correct_answer, list):
+        shared = [name for name in correct_answer if name in wrong_answers]
+        if shared:
+            return f"correct answer names among the wrong answers: {shared}"
+    elif isinstance(correct_answer, str) and _canonical(correct_answer) in map(_canonical, wrong_answers):
+        return "correct answer among the wrong answers"
+    counts = Counter(map(_canonical, wrong_answers))
+    if any(count > 1 for count in counts.values()):
+        return "wrong answer given twice"
+    return ""
+
+
+def name_leaks(question: Dict[str, Any], names: Tuple[str, ...]) -> List[str]:
+    """Character placeholders (A/B/C/D that are not character names) in the text of a question."""
+    leaks = []
+    for key, value in question.items():
+        if key in META_KEYS:
+            continue
+        for text in (value if isinstance(value, list) else [value]):
+            if not isinstance(text, str):
+                continue
+            for match in CHARACTER_PATTERN.finditer(text):
+                if match.group(1) not in names:
+                    leaks.append(f"{key}: ...{text[max(0, match.start() - 30):match.end() + 30]}...")
+    return leaks
+
+
+def question_table(entries: List[Dict[str, Any]]) -> Tuple[Dict[str, np.ndarray], List[Tuple[int, Issue]]]:
+    """
+    Flatten the questions of several sets into a column-oriented table.
+
+    Args:
+        entries (list): final_set entries
+
+    Returns:
+        tuple: (columns, issues). Columns are entry (index into `entries`),
+               set_id, field, prefix, q_id, question_type, missing_keys,
+               wrong_kind, duplicate and leaks, all of equal length; issues
+               (entry index, issue) are the questions that are not dicts at all
+    """
+    columns = {name: [] for name in ["entry", "set_id", "field", "prefix", "q_id", "question_type",
+                                     "missing_keys", "wrong_kind", "duplicate", "leaks"]}
+    issues = []
+    for index, entry in enumerate(entries):
+        set_id = str(entry.get("set_id"))
+        characters = entry.get("characters") if isinstance(entry.get("characters"), dict) else {}
+        names = tuple(name for name in characters.values() if isinstance(name, str))
+        for field, prefix in QUESTION_FIELDS:
+            questions = entry.get(field)
+            if not isinstance(questions, list):
+                continue
+            for i, question in enumerate(questions):
+                if not isinstance(question, dict):
+                    issues.append((index, _issue("schema", set_id, f"{field}[{i}]", "question is not an object")))
+                    continue
+                columns["entry"].append(index)
+                columns["set_id"].append(set_id)
+                columns["field"].append(f"{field}[{i}]")
+                columns["prefix"].append(f"{set_id}-{prefix}")
+                columns["q_id"].append(str(question.get("q_id", "")))
+                columns["question_type"].append(str(question.get("question_type", "")))
+                columns["missing_keys"].append(", ".join(key for key in REQUIRED_QUESTION_KEYS if key not in question))
+                columns["wrong_kind"].append(wrong_answer_kind(question))
+                columns["duplicate"].append(duplicate_answer(question))
+                columns["leaks"].append(" | ".join(name_leaks(question, names)))
+    table = {name: np.array(values, dtype=int if name == "entry" else str) for name, values in columns.items()}
+    return table, issues
+
+
+def table_issues(table: Dict[str, np.ndarray]) -> List[Tuple[int, Issue]]:
+    """Per-question rule violations of a question table, as (entry index, issue)."""
+    if not len(table["entry"]):
+        return []
+    head, _, tail = np.char.rpartition(table["q_id"], "-").T
+    is_mcq = table["wrong_kind"] != "none"
+    masks = [
+        ("schema", table["missing_keys"] != "",
+         lambda row: f"missing keys: {table['missing_keys'][row]}"),
+        ("q_id", (head != table["prefix"]) | ~np.char.isdigit(tail),
+         lambda row: f"q_id '{table['q_id'][row]}' is not {table['prefix'][row]}-<i>"),
+        ("wrong_answer_type", np.isin(table["wrong_kind"], ["nested", "plural_key", "other"])
+         | ((table["wrong_kind"] == "str") & ~np.isin(table["question_type"], STRING_WRONG_ANSWER_TYPES)),
+         lambda row: f"wrong_answer is {table['wrong_kind'][row]} for {table['question_type'][row]}"),
+        ("duplicate_answer", is_mcq & (table["duplicate"] != ""),
+         lambda row: table["duplicate"][row]),
+        ("name_leak", table["leaks"] != "",
+         lambda row: f"placeholder in {table['leaks'][row]}"),
+    ]
+    issues = []
+    for rule, mask, message in masks:
+        for row in np.flatnonzero(mask):
+            issues.append((int(table["entry"][row]),
+                           _issue(rule, str(table["set_id"][row]), str(table["field"][row]), message(row))))
+    return issues
+
+
+def set_issues(entry: Dict[str, Any], options: Optional[Dict[str, Any]]) -> List[Issue]:
+    """Set-level rule violations: schema of the set, and its justification options."""
+    set_id = str(entry.get("set_id"))
+    issues = [_issue("schema", set_id, key, "missing") for key in REQUIRED_SET_KEYS if key not in entry]
+    characters = entry.get("characters")
+    if isinstance(characters, dict):
+        issues += [_issue("schema", set_id, f"characters.{role}", "missing or empty")
+                   for role in ROLES if not characters.get(role)]
+    lie = entry.get("lie")
+    if isinstance(lie, dict):
+        issues += [_issue("schema", set_id, f"lie.{key}", "missing") for key in REQUIRED_LIE_KEYS if key not in lie]
+
+    if options is None:
+        issues.append(_issue("options", set_id, "justificationQA", "no justification options for this set_id"))
+        return issues
+    normalized, _ = normalize_options({set_id: options}, set_id)
+    if normalized is None:
+        issues.append(_issue("options", set_id, "justificationQA", "options entry has no usable structure"))
+        return issues
+    for field, problem in validate_options(normalized).items():
+        issues.append(_issue("options", set_id, f"options.{field}", problem))
+    truth = normalized["truth"]
+    for i, question in enumerate(entry.get("justificationQA") or []):
+        if not isinstance(question, dict):
+            continue
+        if question.get("correct_answer") != truth["correct_answer"] \
+                or flatten_wrong_answers(question) != truth["wrong_answers"]:
+            issues.append(_issue("options", set_id, f"justificationQA[{i}]",
+                                 "answers differ from the justification options entry"))
+    return issues
+
+
+def c_vs_q_issues(entries: List[Dict[str, Any]]) -> List[Tuple[int, Issue]]:
+    """_c content in the questions of several sets, as (entry index, issue)."""
+    engine = ReplacementEngine()
+    engine.add_items(entries)
+    issues = []
+    for index, entry in enumerate(entries):
+        questions = {"set_id": entry.get("set_id", "unknown")}
+        questions.update((field, entry[field]) for field, _ in QUESTION_FIELDS if field in entry)
+        _, matches = engine.replace_item(questions)
+        for match in matches:
+            issues.append((index, _issue("c_vs_q", str(entry.get("set_id")), match["field"],
+                                         f"_c content '{match['old']}' ({match['count']}x) instead of '{match['new']}'")))
+    return issues
+
+
+def check_sets(entries: List[Dict[str, Any]], options_index: Dict[str, Any]) -> List[List[Issue]]:
+    """
+    Check several sets (all rules except q_id uniqueness).
+
+    Returns:
+        list: Issues of every entry, in order
+    """
+    issues = [set_issues(entry, options_index.get(entry.get("set_id"))) for entry in entries]
+    table, unparsed = question_table(entries)
+    for index, issue in unparsed + table_issues(table) + c_vs_q_issues(entries):
+        issues[index].append(issue)
+    return issues
+
+
+def lint(files: List[str], options_dir: str = JUSTIFICATION_OPTIONS_DIR,
+         cache_path: Optional[str] = LINT_CACHE_PATH) -> Dict[str, Any]:
+    """
+    Lint final_set files, reusing the cached issues of unchanged sets.
+
+    Args:
+        files (list): final_set file paths
+        options_dir (str): Directory of the justification options files
+        cache_path (str): Issue cache (None: check every set)
+
+    Returns:
+        dict: {"issues": {file: [issue, ...]}, "checked": n sets checked,
+               "cached": n sets reused from the cache}
+    """
+    options_index = load_justification_index(options_dir)
+    version = rules_version()
+    cache = load_json(cache_path, {}) if cache_path else {}
+    if cache.get("version") != version:
+        cache = {"version": version, "sets": {}}
+
+    located, keys, pending = [], [], []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            key = content_hash([entry, options_index.get(entry.get("set_id"))])
+            located.append((path, entry))
+            keys.append(key)
+            if key not in cache["sets"]:
+                pending.append(len(located) - 1)
+
+    for index, issues in zip(pending, check_sets([located[i][1] for i in pending], options_index)):
+        cache["sets"][keys[index]] = issues
+    if cache_path:
+        # drop the entries of sets that no longer exist
+        cache["sets"] = {key: cache["sets"][key] for key in keys}
+        atomic_write_json(cache_path, cache)
+
+    report = {path: [] for path in files}
+    # q_id -> every place it is used
+    places: Dict[str, List[Tuple[str, str, str]]] = {}
+    for (path, entry), key in zip(located, keys):
+        report[path].extend(cache["sets"][key])
+        for field, _ in QUESTION_FIELDS:
+            for i, question in enumerate(entry.get(field) or []):
+                if isinstance(question, dict) and question.get("q_id"):
+                    places.setdefault(question["q_id"], []).append((path, str(entry.get("set_id")), f"{field}[{i}]"))
+    for q_id, used in places.items():
+        for path, set_id, field in used if len(used) > 1 else []:
+            others = [f"{os.path.basename(p)}:{s} {f}" for p, s, f in used if (p, s, f) != (path, set_id, field)]
+            report[path].append(_issue("q_id", set_id, field, f"q_id '{q_id}' also used by {', '.join(others)}"))
+    return {"issues": report, "checked": len(pending), "cached": len(located) - len(pending)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check final_set files for consistency problems")
+    parser.add_argument('--final_set_dir', type=str, default=FINAL_SET_DIR, help="Directory of the final_set files")
+    parser.add_argument('--files', type=str, nargs="+", default=None,
+                        help="final_set files to check (default: all files in --final_set_dir)")
+    parser.add_argument('--options_dir', type=str, default=JUSTIFICATION_OPTIONS_DIR,
+                        help="Directory of the justification options files")
+    parser.add_argument('--rules', type=str, nargs="+", choices=RULES, default=list(RULES),
+                        help="Rules to report")
+    parser.add_argument('--no_cache', action='store_true', help="Check every set, ignoring cached results")
+    parser.add_argument('--output', type=str, default=None, help="Also write the issues as JSON to this path")
+    args = parser.parse_args()
+
+    files = args.files or set_files(args.final_set_dir)
+    result = lint(files, args.options_dir, None if args.no_cache else LINT_CACHE_PATH)
+    issues = {path: [issue for issue in file_issues if issue["rule"] in args.rules]
+              for path, file_issues in result["issues"].items()}
+
+    rule_counts = Counter()
+    for path, file_issues in issues.items():
+        print(f"{path}: {len(file_issues)} issues")
+        for issue in file_issues:
+            rule_counts[issue["rule"]] += 1
+            print(f"  {issue['set_id']} {issue['field']} [{issue['rule']}] {issue['message']}")
+    print(f"\n{result['checked']} sets checked, {result['cached']} unchanged sets from cache")
+    for rule in args.rules:
+        print(f"  {rule}: {rule_counts[rule]}")
+    if args.output:
+        atomic_write_json(args.output, issues, indent=2)
+    return 1 if sum(rule_counts.values()) else 0
+
+
+if __name__ == "__main__":
+    exit(main())
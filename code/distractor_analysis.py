@@ -0,0 +1,276 @@
+"""
+Distractor-level error attribution for TactfulToM MCQ and list questions.
+
+For MCQ answers, every wrong choice is mapped back through `mcq_mapping` (already
+applied by `evaluate_non_freeform.clean`) to the wrong option it selected and its
+distractor type: the recorded `wrong_answer_types` of the question, or, for sets
+generated before types were recorded, `classify_distractor` on the option text.
+For list answers, every answer is split into the characters it wrongly includes
+and the characters it omits, by role (liar / target / accomplice / observer).
+
+Option types and character patterns are computed once per question; per-entry
+work is a lookup, and the model × category × type counts are one bincount.
+
+Usage (from the repository root, after `evaluate_non_freeform.py` has written results/clean):
+    python code/distractor_analysis.py --condition full_context --export_cases
+"""
+
+import argparse
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+from prettytable import PrettyTable
+
+from question_generation_utils import JUSTIFICATION_DISTRACTOR_TYPES, classify_distractor, flatten_wrong_answers
+from result_table import RESULTS_DIR, encode, file_mtime, list_result_files, load_result_table
+from slice_analysis import DATASET_DIR
+
+
+ROLES = ["liar", "target", "accomplice", "observer"]
+INVALID_ANSWER = "invalid_answer"
+
+
+@lru_cache(maxsize=None)
+def _load_question_index(path: str, mtime: float) -> Dict[str, Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    index = {}
+    for item in data:
+        characters = item["characters"]
+        for value in item.values():
+            if not isinstance(value, list):
+                continue
+            for question in value:
+                if not (isinstance(question, dict) and "q_id" in question):
+                    continue
+                wrong_answers = flatten_wrong_answers(question)
+                types = question.get("wrong_answer_types")
+                if not types or len(types) != len(wrong_answers):
+                    if question.get("question_type", "").startswith("justification"):
+                        types = (JUSTIFICATION_DISTRACTOR_TYPES + ["unparsed"] * len(wrong_answers))[:len(wrong_answers)]
+                    else:
+                        types = [classify_distractor(option, question["correct_answer"], characters,
+                                                     question.get("question_type", ""), question.get("tom_type"))
+                                 for option in wrong_answers]
+                index[question["q_id"]] = {
+                    "question": question,
+                    "characters": characters,
+                    "options": [question["correct_answer"]] + wrong_answers,
+                    "types": types
+                }
+    return index
+
+
+def load_question_index(dataset_dir: str = DATASET_DIR) -> Dict[str, Dict]:
+    """
+    Map every q_id in dataset/final_set to its question, characters, options and
+    distractor types. Cached on file mtimes.
+    """
+    index = {}
+    for name in sorted(os.listdir(dataset_dir)):
+        if name.startswith("Tactful_conv_set_") and name.endswith(".json"):
+            path = os.path.join(dataset_dir, name)
+            index.update(_load_question_index(path, file_mtime(path)))
+    return index
+
+
+@lru_cache(maxsize=4096)
+def _role_patterns(names: Tuple[Tuple[str, str], ...]) -> List[Tuple[str, "re.Pattern"]]:
+    return [(role, re.compile(rf"\b{re.escape(name)}\b", re.IGNORECASE)) for role, name in names if name]
+
+
+def roles_in(items: List[str], characters: Dict[str, str]) -> Tuple[set, int]:
+    """Roles named anywhere in a list answer, and the number of items naming nobody."""
+    patterns = _role_patterns(tuple(sorted(characters.items())))
+    roles, unknown = set(), 0
+    for item in items:
+        found = {role for role, pattern in patterns if pattern.search(item)}
+        if not found and item.strip():
+            unknown += 1
+        roles |= found
+    return roles, unknown
+
+
+def mcq_errors(table: Dict[str, np.ndarray], question_index: Dict[str, Dict]) -> Dict[str, np.ndarray]:
+    """
+    Distractor type of every wrong MCQ answer in a result table.
+
+    Returns:
+        dict: Column arrays (row indices into `table`, distractor_type, option)
+              for every MCQ entry that did not pick the correct option. Answers
+              that could not be parsed ("NAN") get type "invalid_answer".
+    """
+    rows, types, options = [], [], []
+    for row in np.nonzero(table["question_type"] == "mcq")[0]:
+        entry = table["entry"][row]
+        answer = entry["clean_result"]
+        try:
+            answer = int(answer)
+        except (TypeError, ValueError):
+            rows.append(row)
+            types.append(INVALID_ANSWER)
+            options.append(str(answer))
+            continue
+        if answer == 0:
+            continue
+        info = question_index.get(table["q_id"][row])
+        rows.append(row)
+        if info is None or answer - 1 >= len(info["types"]):
+            types.append("unparsed")
+            options.append("")
+        else:
+            types.append(info["types"][answer - 1])
+            options.append(info["options"][answer])
+    distractor_type = np.empty(len(types), dtype=object)
+    distractor_type[:] = types
+    option = np.empty(len(options), dtype=object)
+    option[:] = options
+    return {"row": np.asarray(rows, dtype=np.int64), "distractor_type": distractor_type, "option": option}
+
+
+def list_errors(table: Dict[str, np.ndarray], question_index: Dict[str, Dict]) -> Dict[str, np.ndarray]:
+    """
+    Characters wrongly included in / omitted from every list answer.
+
+    Returns:
+        dict: Column arrays with one row per (entry, role, kind) event, where kind
+              is "included" (named but not in the correct answer), "omitted"
+              (in the correct answer but not named) or "unknown" (an answer item
+              naming no character; role is "").
+    """
+    rows, roles, kinds = [], [], []
+    for row in np.nonzero(table["question_type"] == "list")[0]:
+        info = question_index.get(table["q_id"][row])
+        if info is None:
+            continue
+        entry = table["entry"][row]
+        answer = entry["clean_result"] if isinstance(entry["clean_result"], list) else [str(entry["clean_result"])]
+        named, unknown = roles_in(answer, info["characters"])
+        correct, _ = roles_in(entry["correct_answer"], info["characters"])
+        events = [(role, "included") for role in ROLES if role in named and role not in correct]
+        events += [(role, "omitted") for role in ROLES if role in correct and role not in named]
+        events += [("", "unknown")] * unknown
+        for role, kind in events:
+            rows.append(row)
+            roles.append(role)
+            kinds.append(kind)
+    role_array, kind_array = np.empty(len(roles), dtype=object), np.empty(len(kinds), dtype=object)
+    role_array[:], kind_array[:] = roles, kinds
+    return {"row": np.asarray(rows, dtype=np.int64), "role": role_array, "kind": kind_array}
+
+
+def error_proportions(groups: np.ndarray, categories: np.ndarray, labels: np.ndarray) -> Dict:
+    """
+    Counts and within-(group, category) proportions of error labels.
+
+    Args:
+        groups (np.ndarray): Group (model) of every error
+        categories (np.ndarray): Category of every error
+        labels (np.ndarray): Error label (distractor type, role:kind, ...) of every error
+
+    Returns:
+        dict: "groups", "categories", "labels" level lists and "count" /
+              "proportion" arrays of shape (n_groups, n_categories, n_labels)
+    """
+    group_levels, g = encode(groups)
+    cat_levels, c = encode(categories)
+    label_levels, l = encode(labels)
+    dims = (max(len(group_levels), 1), max(len(cat_levels), 1), max(len(label_levels), 1))
+    flat = np.ravel_multi_index((g, c, l), dims) if len(labels) else np.zeros(0, dtype=np.int64)
+    count = np.bincount(flat, minlength=int(np.prod(dims))).reshape(dims)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        proportion = count / count.sum(axis=2, keepdims=True)
+    return {"groups": group_levels, "categories": cat_levels, "labels": label_levels,
+            "count": count, "proportion": proportion}
+
+
+def make_proportion_tables(result: Dict) -> Dict[str, PrettyTable]:
+    tables = {}
+    for c, category in enumerate(result["categories"]):
+        labels = [i for i, _ in enumerate(result["labels"]) if result["count"][:, c, i].sum()]
+        if not labels:
+            continue
+        table = PrettyTable()
+        table.field_names = ["model_type", "n_errors"] + [result["labels"][i] for i in labels]
+        for g, group in enumerate(result["groups"]):
+            total = result["count"][g, c].sum()
+            if not total:
+                continue
+            table.add_row([group, total] + ["{:.2f}".format(result["proportion"][g, c, i] * 100) for i in labels])
+        tables[category] = table
+    return tables
+
+
+def _to_json(result: Dict) -> Dict:
+    out = {}
+    for g, group in enumerate(result["groups"]):
+        for c, category in enumerate(result["categories"]):
+            total = int(result["count"][g, c].sum())
+            if not total:
+                continue
+            out.setdefault(group, {})[category] = {
+                label: {"count": int(result["count"][g, c, i]), "proportion": float(result["proportion"][g, c, i])}
+                for i, label in enumerate(result["labels"]) if result["count"][g, c, i]
+            }
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attribute TactfulToM MCQ and list errors to distractor types and characters")
+    parser.add_argument('--condition', type=str, default="full_context")
+    parser.add_argument('--file_names', type=str, default=None,
+                        help="Comma-separated result file names (default: every file in results/clean)")
+    parser.add_argument('--results_dir', type=str, default=RESULTS_DIR)
+    parser.add_argument('--dataset_dir', type=str, default=DATASET_DIR)
+    parser.add_argument('--by', type=str, default="model", choices=["model", "file_name"])
+    parser.add_argument('--output_dir', type=str, default="cases")
+    parser.add_argument('--export_cases', action="store_true",
+                        help="Also write every wrong MCQ answer with its distractor type")
+    args = parser.parse_args()
+
+    file_names = [name.strip() for name in args.file_names.split(",")] if args.file_names else list_result_files(args.results_dir)
+    table = load_result_table(file_names, args.condition, args.results_dir)
+    question_index = load_question_index(args.dataset_dir)
+
+    mcq = mcq_errors(table, question_index)
+    mcq_result = error_proportions(table[args.by][mcq["row"]], table["category"][mcq["row"]], mcq["distractor_type"])
+    lists = list_errors(table, question_index)
+    list_labels = np.array([f"{kind}:{role}" if role else kind for role, kind in zip(lists["role"], lists["kind"])], dtype=object)
+    list_result = error_proportions(table[args.by][lists["row"]], table["category"][lists["row"]], list_labels)
+
+    for category, pretty in make_proportion_tables(mcq_result).items():
+        print(f"MCQ error proportions (%) by distractor type: {category}")
+        print(pretty)
+    for category, pretty in make_proportion_tables(list_result).items():
+        print(f"List error proportions (%) by character role: {category}")
+        print(pretty)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, f"distractor_errors_{args.condition}.json"), "w") as f:
+        json.dump({"mcq": _to_json(mcq_result), "list": _to_json(list_result)}, f, indent=3)
+
+    if args.export_cases:
+        cases = []
+        for row, distractor_type, option in zip(mcq["row"], mcq["distractor_type"], mcq["option"]):
+            info = question_index.get(table["q_id"][row], {})
+            cases.append({
+                "model": table[args.by][row],
+                "question_id": table["q_id"][row],
+                "question": table["entry"][row]["question"],
+                "llm_answer": table["entry"][row]["clean_result"],
+                "chosen_option": option,
+                "distractor_type": distractor_type,
+                "options": info.get("options", []),
+                "category": table["category"][row]
+            })
+        with open(os.path.join(args.output_dir, "wrong_mcq.json"), "w") as f:
+            json.dump(cases, f, indent=3)
+
+
+if __name__ == "__main__":
+    main()
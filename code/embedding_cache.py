@@ -0,0 +1,269 @@
+"""
+Persistent embedding cache shared by every script that embeds text.
+
+Each encoder (name + version + storage dtype) gets its own directory under
+cache/embeddings holding
+
+  • rows-{generation}.bin: an append-only float32 / float16 matrix, read
+                           through np.memmap
+  • index.json:            {"dim", "dtype", "generation", "n_rows",
+                            "rows": {text_hash: row}}
+
+New embeddings are appended to the matrix before the index is atomically
+replaced, so an interrupted run at worst leaves unindexed rows at the end of
+the file, which are truncated on the next open. `compact` writes the rows
+still in use to the next generation's file and only then switches the index
+over to it.
+
+Runs sharing a cache serialize their appends (and compactions) with an fcntl
+lock on a sidecar .lock file, and reload the index when another writer has
+replaced it, so rows are never appended against a stale row count.
+
+Usage:
+    cache = EmbeddingCache("all-MiniLM-L6-v2")
+    embeddings = cache.get_or_encode(texts, lambda batch: model.encode(batch, normalize_embeddings=True))
+
+    python code/embedding_cache.py list
+    python code/embedding_cache.py compact --keep_current
+"""
+
+import argparse
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from cache_utils import CACHE_DIR, atomic_write_json, load_json, text_hash
+
+
+DTYPES = ["float32", "float16"]
+EMBEDDINGS_DIR = os.path.join(CACHE_DIR, "embeddings")
+
+
+class EmbeddingCache:
+    def __init__(self, encoder_name: str, version: str = "1", cache_dir: str = CACHE_DIR, dtype: str = "float32"):
+        """
+        Args:
+            encoder_name (str): Name of the encoder (e.g. "all-MiniLM-L6-v2")
+            version (str): Encoder / backend version; a new version starts a new cache
+            cache_dir (str): Root cache directory
+            dtype (str): Storage dtype, "float32" or "float16" (half the disk size);
+                embeddings are always returned as float32
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype '{dtype}', expected one of {DTYPES}")
+        safe_name = re.sub(r"[^\w.@-]", "_", f"{encoder_name}@{version}")
+        self._open(os.path.join(cache_dir, "embeddings", f"{safe_name}-{dtype}"), dtype)
+
+    @classmethod
+    def from_path(cls, path: str) -> "EmbeddingCache":
+        """Open an existing cache directory (e.g. one listed by `list_caches`)."""
+        cache = cls.__new__(cls)
+        cache._open(path, path.rsplit("-", 1)[-1])
+        return cache
+
+    def _open(self, path: str, dtype: str):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.index_path = os.path.join(self.path, "index.json")
+        self.lock_path = os.path.join(self.path, "index.lock")
+        os.makedirs(self.path, exist_ok=True)
+        with self._locked():
+            self._load_index()
+            # drop rows appended by an interrupted run that never made it into the index
+            if os.path.exists(self.data_path) and self.dim:
+                size = self.n_rows * self.dim * self.dtype.itemsize
+                if os.path.getsize(self.data_path) > size:
+                    with open(self.data_path, "r+b") as f:
+                        f.truncate(size)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _index_version(self) -> Optional[int]:
+        return os.stat(self.index_path).st_mtime_ns if os.path.exists(self.index_path) else None
+
+    def _load_index(self):
+        index = load_json(self.index_path, {"dim": None, "dtype": self.dtype.name, "generation": 0, "n_rows": 0,
+                                            "rows": {}})
+        self._loaded_version = self._index_version()
+        self.dim: Optional[int] = index["dim"]
+        self.generation: int = index["generation"]
+        self.data_path = self._data_path(self.generation)
+        self.rows: Dict[str, int] = index["rows"]
+        self.n_rows: int = index["n_rows"]
+        self._matrix = None
+
+    def refresh(self):
+        """Reload the index if another run has replaced it since it was loaded."""
+        if self._index_version() != self._loaded_version:
+            self._load_index()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, text: str) -> bool:
+        return text_hash(text) in self.rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Read-only memmap of all cached rows, shape (n_rows, dim)."""
+        if self._matrix is None:
+            if not self.n_rows:
+                return np.zeros((0, self.dim or 0), dtype=self.dtype)
+            self._matrix = np.memmap(self.data_path, dtype=self.dtype, mode="r", shape=(self.n_rows, self.dim))
+        return self._matrix
+
+    def _data_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"rows-{generation}.bin")
+
+    def _save_index(self):
+        atomic_write_json(self.index_path, {"dim": self.dim, "dtype": self.dtype.name, "generation": self.generation,
+                                            "n_rows": self.n_rows, "rows": self.rows})
+        self._loaded_version = self._index_version()
+
+    def add(self, texts: List[str], embeddings: np.ndarray):
+        """Append embeddings of texts not in the cache yet."""
+        embeddings = np.asarray(embeddings)
+        if not len(texts):
+            return
+        with self._locked():
+            # rows appended by other runs since the index was loaded
+            self.refresh()
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {embeddings.shape[1]} does not match cache dim {self.dim}")
+
+            new_rows = []
+            for text, embedding in zip(texts, embeddings):
+                key = text_hash(text)
+                if key not in self.rows:
+                    self.rows[key] = self.n_rows + len(new_rows)
+                    new_rows.append(embedding)
+            if not new_rows:
+                return
+            with open(self.data_path, "ab") as f:
+                f.write(np.asarray(new_rows, dtype=self.dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.n_rows += len(new_rows)
+            self._matrix = None
+            self._save_index()
+
+    def get(self, texts: List[str]) -> np.ndarray:
+        """Cached embeddings of `texts` as float32; raises KeyError for a missing text."""
+        rows = np.fromiter((self.rows[text_hash(text)] for text in texts), dtype=np.int64, count=len(texts))
+        return np.asarray(self.matrix[rows], dtype=np.float32)
+
+    def get_or_encode(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings of `texts`, encoding (once) only the texts that are not cached.
+
+        Args:
+            texts (list): Strings to embed
+            encode (callable): Maps a list of strings to an (n, dim) array
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dim)
+        """
+        self.refresh()
+        missing = list(dict.fromkeys(text for text in texts if text_hash(text) not in self.rows))
+        if missing:
+            self.add(missing, encode(missing))
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return self.get(texts)
+
+    def compact(self, keep: Optional[Iterable[str]] = None):
+        """
+        Rewrite the matrix without unused rows.
+
+        Args:
+            keep (iterable): Texts whose embeddings are kept; None keeps every
+                indexed row (only drops unindexed rows)
+
+        Returns:
+            tuple: (rows before, rows after)
+        """
+        keep_keys = None if keep is None else list(dict.fromkeys(text_hash(text) for text in keep))
+        with self._locked():
+            self.refresh()
+            n_before = self.n_rows
+            keys = list(self.rows) if keep_keys is None else [key for key in keep_keys if key in self.rows]
+            old_rows = np.fromiter((self.rows[key] for key in keys), dtype=np.int64, count=len(keys))
+            data = np.asarray(self.matrix[old_rows], dtype=self.dtype) if len(keys) else np.zeros(0, dtype=self.dtype)
+
+            old_path, new_path = self.data_path, self._data_path(self.generation + 1)
+            with open(new_path, "wb") as f:
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._matrix = None
+            self.rows = {key: row for row, key in enumerate(keys)}
+            self.n_rows = len(keys)
+            self.generation += 1
+            self.data_path = new_path
+            self._save_index()
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        return n_before, self.n_rows
+
+
+def list_caches(embeddings_dir: str = EMBEDDINGS_DIR) -> List[str]:
+    """Directories of the embedding caches under `embeddings_dir`."""
+    if not os.path.isdir(embeddings_dir):
+        return []
+    return [os.path.join(embeddings_dir, name) for name in sorted(os.listdir(embeddings_dir))
+            if os.path.exists(os.path.join(embeddings_dir, name, "index.json"))]
+
+
+def current_texts(type_nums=("0", "1", "2", "3", "4")) -> List[str]:
+    """Every question, option and freeform answer embedded for the current dataset and result files."""
+    # imported here: evaluate_freeform loads the encoder stack
+    from evaluate_freeform import collect_freeform_items, dataset_items
+
+    texts = []
+    for _, text, options in dataset_items(type_nums) + collect_freeform_items(type_nums)[1]:
+        texts.append(text)
+        texts.extend(options)
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compact the shared embedding caches")
+    parser.add_argument('command', choices=["list", "compact"])
+    parser.add_argument('--embeddings_dir', type=str, default=EMBEDDINGS_DIR)
+    parser.add_argument('--caches', type=str, nargs="*", default=None,
+                        help="Cache directory names to compact (default: all)")
+    parser.add_argument('--keep_current', action="store_true",
+                        help="Only keep the embeddings of the current dataset and result files "
+                             "(default: keep every indexed row)")
+    parser.add_argument('--type_nums', type=str, default="0,1,2,3,4", help="Dataset files for --keep_current")
+    args = parser.parse_args()
+
+    paths = list_caches(args.embeddings_dir)
+    if args.caches:
+        paths = [path for path in paths if os.path.basename(path) in args.caches]
+    keep = current_texts([t.strip() for t in args.type_nums.split(",")]) if args.keep_current else None
+    for path in paths:
+        cache = EmbeddingCache.from_path(path)
+        if args.command == "compact":
+            n_before, n_after = cache.compact(keep)
+            print(f"{os.path.basename(path)}: {n_before} -> {n_after} rows")
+        else:
+            size = os.path.getsize(cache.data_path) if os.path.exists(cache.data_path) else 0
+            print(f"{os.path.basename(path)}: {cache.n_rows} rows, dim {cache.dim}, {size / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,21 @@
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 from nltk.tokenize import word_tokenize
+import argparse
 import json
 import os
-from tqdm import tqdm
 
 import numpy as np
 
 import re
 
+from cache_utils import CACHE_DIR
+from embedding_cache import DTYPES, EmbeddingCache
+from onnx_encoder import OnnxEncoder, validate_backend
+from sparse_f1 import TokenCache, batch_token_f1, f1_parity
+
+ENCODER_NAME = "all-MiniLM-L6-v2"
+
 question_categories = ["comprehensionQA", "justificationQA", "fact_reasonQA", "fact_truthQA", "beliefQAs", "infoAccessibilityQA_list", "infoAccessibilityQAs_binary", "answerabilityQA_list", "answerabilityQAs_binary", "lieabilityQAs","liedetectabilityQAs_list", "liedetectabilityQAs_binary"]
 
 def simple_tokenize(text):
@@ -48,6 +55,12 @@ def token_f1_score(s1, s2, tokenizer=word_tokenize):
     f1 = 2 * precision * recall / (precision + recall)
     return f1
 
+TOKENIZERS = {
+    "nltk": word_tokenize,
+    "simple": simple_tokenize,
+    "whitespace": str.split
+}
+
 def sentence_cosine_similarity(sent1, sent2, model):
     embeddings = model.encode([sent1, sent2])
     sim = cosine_similarity(
@@ -56,43 +69,226 @@ def sentence_cosine_similarity(sent1, sent2, model):
     )
     return sim[0][0].item()
 
-def get_similarity_score(type_num="0"):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    dataset_name = f"dataset/final_set/Tactful_conv_set_{type_num}.json"
-    result_file_names = os.listdir("results/original/")
-    type_files = []
-    for name in result_file_names:
-        if name.endswith(f"{type_num}.json"):
-            type_files.append(name)
-    # type_files = [os.path.join("results/original/", name) for name in type_files]
-
-    with open(dataset_name) as f:
-        original_dataset = json.load(f)
-    for name in tqdm(type_files):
-        result_file = os.path.join("results/original/", name)
-        with open(result_file) as f:
-            result = json.load(f)
-        
-        # print(len(result), len(original_dataset))
-        for i, question_set in enumerate(tqdm(result)):
+def _freeform_options(original):
+    if type(original["wrong_answer"]) == str:
+        return [original["correct_answer"]] + [original["wrong_answer"]]
+    return [original["correct_answer"]] + original["wrong_answer"]
+
+
+def collect_freeform_items(type_nums=("0", "1", "2", "3", "4"), results_dir="results/original/",
+                           dataset_dir="dataset/final_set"):
+    """
+    Gather every freeform entry of every result file together with its options.
+
+    Args:
+        type_nums (tuple): Dataset types whose result files are scored
+        results_dir (str): Directory holding the original result files
+        dataset_dir (str): Directory holding Tactful_conv_set_{type_num}.json
+
+    Returns:
+        tuple: (results, items) where results maps result file name -> loaded
+               result list, and items is a list of (entry, answer, options); the
+               entries are the dicts inside `results`, so scores written to them
+               are saved with the results
+    """
+    results, items = {}, []
+    for type_num in type_nums:
+        with open(os.path.join(dataset_dir, f"Tactful_conv_set_{type_num}.json")) as f:
+            original_dataset = json.load(f)
+        type_files = sorted(name for name in os.listdir(results_dir)
+                            if name.endswith(f"{type_num}.json"))
+        for name in type_files:
+            with open(os.path.join(results_dir, name)) as f:
+                result = json.load(f)
+            results[name] = result
+            for i, question_set in enumerate(result):
+                for category in question_categories:
+                    for j, cat_result in enumerate(question_set.get(category, [])):
+                        for entry in cat_result:
+                            if not entry["question_type"] == "freeform":
+                                continue
+                            answer = entry["original_result"].split("</think>")[-1]
+                            items.append((entry, answer, _freeform_options(original_dataset[i][category][j])))
+    return results, items
+
+
+def encode_unique(texts, model, batch_size=256, cache=None):
+    """
+    Encode a list of strings with every distinct string embedded only once.
+
+    With an `EmbeddingCache`, only strings that are not cached yet are sent
+    to the model.
+
+    Returns:
+        tuple: (index, embeddings) where index maps text -> row of the
+               L2-normalized float32 embedding matrix
+    """
+    index = {}
+    for text in texts:
+        if text not in index:
+            index[text] = len(index)
+    if not index:
+        return index, np.zeros((0, 0), dtype=np.float32)
+    def encode(batch):
+        return model.encode(batch, batch_size=batch_size, convert_to_numpy=True,
+                            normalize_embeddings=True, show_progress_bar=True)
+    if cache is None:
+        embeddings = encode(list(index))
+    else:
+        embeddings = cache.get_or_encode(list(index), encode)
+    return index, embeddings.astype(np.float32, copy=False)
+
+
+def batch_cosine_similarity(items, index, embeddings):
+    """
+    Cosine similarity of every answer to each of its options.
+
+    Options are padded to the longest option list and the answer × option dot
+    products of all items are computed as one batched matrix product over the
+    normalized embeddings.
+
+    Returns:
+        list: One list of similarities (in option order) per item
+    """
+    if not items:
+        return []
+    n_options = [len(options) for _, _, options in items]
+    answer_rows = np.fromiter((index[answer] for _, answer, _ in items), dtype=np.int64, count=len(items))
+    option_rows = np.zeros((len(items), max(n_options)), dtype=np.int64)
+    for row, (_, _, options) in enumerate(items):
+        option_rows[row, :len(options)] = [index[option] for option in options]
+    sims = np.einsum("nd,nmd->nm", embeddings[answer_rows], embeddings[option_rows])
+    return [sims[row, :n].tolist() for row, n in enumerate(n_options)]
+
+
+def dataset_items(type_nums=("0", "1", "2", "3", "4"), dataset_dir="dataset/final_set"):
+    """
+    (None, question, options) for every question with options in the shipped
+    dataset; used to validate encoder backends without any result files.
+    """
+    items = []
+    for type_num in type_nums:
+        with open(os.path.join(dataset_dir, f"Tactful_conv_set_{type_num}.json")) as f:
+            original_dataset = json.load(f)
+        for question_set in original_dataset:
             for category in question_categories:
-                for j, cat_result in enumerate(question_set[category]):
-                    for k, entry in enumerate(cat_result):
-                        if not entry["question_type"]=="freeform":
-                            continue
-                        answer = result[i][category][j][k]["original_result"].split("</think>")[-1]
-                        original = original_dataset[i][category][j]
-                        if type(original["wrong_answer"]) == str:
-                            options = [original["correct_answer"]] + [original["wrong_answer"]]
-                        else:
-                            options = [original["correct_answer"]] + original["wrong_answer"]
-                            
-                        result[i][category][j][k]["token_f1"] = [token_f1_score(answer, option) for option in options]
-                        result[i][category][j][k]["cos_similarity"] = [sentence_cosine_similarity(answer, option, model) for option in options]
+                for question in question_set.get(category, []):
+                    if "wrong_answer" not in question:
+                        continue
+                    options = _freeform_options(question)
+                    if all(type(option) == str for option in options):
+                        items.append((None, question["question"], options))
+    return items
+
+
+def item_similarities(items, model, batch_size=256, cache=None):
+    """Cosine similarities of (entry, answer, options) items, embedding each unique string once."""
+    texts = []
+    for _, answer, options in items:
+        texts.append(answer)
+        texts.extend(options)
+    index, embeddings = encode_unique(texts, model, batch_size, cache)
+    return batch_cosine_similarity(items, index, embeddings)
+
+
+def load_encoder(backend="torch", num_threads=None):
+    """
+    Sentence encoder for the given backend: "torch" (the reference
+    SentenceTransformer), "onnx" (int8 quantized ONNX on CPU) or "onnx-fp32".
+    """
+    if backend == "torch":
+        return SentenceTransformer(ENCODER_NAME)
+    return OnnxEncoder(ENCODER_NAME, quantize=backend == "onnx", num_threads=num_threads)
+
+
+def encoder_version(model):
+    """Version used to key the embedding cache; the reference model is version "1"."""
+    return getattr(model, "version", "1")
+
+
+def get_similarity_score(type_nums=("0", "1", "2", "3", "4"), model=None, batch_size=256, cache=None,
+                         tokenizer="nltk", token_cache=None):
+    """
+    Add token_f1 and cos_similarity scores to every freeform entry of the result files.
+
+    All freeform answers and options across the result files of `type_nums`
+    are collected first, every unique string is embedded (or read from
+    `cache`) and tokenized (or read from `token_cache`) once, and both scores
+    are computed in one batch.
+    """
+    if model is None:
+        model = SentenceTransformer(ENCODER_NAME)
+    results, items = collect_freeform_items(type_nums)
+    cos_similarities = item_similarities(items, model, batch_size, cache)
+    token_f1s = batch_token_f1(items, TOKENIZERS[tokenizer], token_cache)
+
+    for (entry, _, _), cos_similarity, token_f1 in zip(items, cos_similarities, token_f1s):
+        entry["token_f1"] = token_f1
+        entry["cos_similarity"] = cos_similarity
+
+    for name, result in results.items():
         to_file = os.path.join("results/original/", name[:-5]+"_sim.json")
-        with open(result_file, "w") as f:
+        with open(to_file, "w") as f:
             json.dump(result, f, indent=3)
 
+def main():
+    parser = argparse.ArgumentParser(description="Score freeform answers against their options")
+    parser.add_argument('--type_nums', type=str, default="0,1,2,3,4")
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--cache_dir', type=str, default=CACHE_DIR)
+    parser.add_argument('--cache_dtype', type=str, default="float32", choices=DTYPES)
+    parser.add_argument('--no_cache', action="store_true", help="Do not read or write the embedding cache")
+    parser.add_argument('--backend', type=str, default="torch", choices=["torch", "onnx", "onnx-fp32"],
+                        help="Encoder backend; onnx runs the int8 quantized model on CPU")
+    parser.add_argument('--num_threads', type=int, default=None, help="CPU threads for the onnx backends")
+    parser.add_argument('--validate_backend', action="store_true",
+                        help="Compare --backend with the torch backend on the dataset and result files instead of scoring")
+    parser.add_argument('--tokenizer', type=str, default="nltk", choices=list(TOKENIZERS),
+                        help="Tokenizer for token_f1")
+    parser.add_argument('--f1_parity', action="store_true",
+                        help="Check the batch token_f1 against per-pair token_f1_score with nltk instead of scoring")
+    parser.add_argument('--output_dir', type=str, default="cases")
+    args = parser.parse_args()
+
+    def make_cache(model):
+        if args.no_cache:
+            return None
+        return EmbeddingCache(ENCODER_NAME, encoder_version(model), cache_dir=args.cache_dir, dtype=args.cache_dtype)
+
+    type_nums = [t.strip() for t in args.type_nums.split(",")]
+    token_cache = None if args.no_cache else TokenCache(args.tokenizer, args.cache_dir)
+    if args.f1_parity:
+        items = dataset_items(type_nums) + collect_freeform_items(type_nums)[1]
+        report = f1_parity(items, batch_token_f1(items, TOKENIZERS[args.tokenizer], token_cache), token_f1_score)
+        print(f"{args.tokenizer} batch token_f1 vs nltk token_f1_score on {report['n_pairs']} pairs: "
+              f"max |diff| {report['max_abs_diff']:.2e}, {len(report['mismatches'])} mismatches")
+        os.makedirs(args.output_dir, exist_ok=True)
+        with open(os.path.join(args.output_dir, f"f1_parity_{args.tokenizer}.json"), "w") as f:
+            json.dump(report, f, indent=3)
+        return
+
+    model = load_encoder(args.backend, args.num_threads)
+    if not args.validate_backend:
+        get_similarity_score(type_nums, model, batch_size=args.batch_size, cache=make_cache(model),
+                             tokenizer=args.tokenizer, token_cache=token_cache)
+        return
+
+    reference = load_encoder("torch")
+    items = dataset_items(type_nums) + collect_freeform_items(type_nums)[1]
+    reference_sims = item_similarities(items, reference, args.batch_size, make_cache(reference))
+    candidate_sims = item_similarities(items, model, args.batch_size, make_cache(model))
+    report = validate_backend(reference_sims, candidate_sims)
+    report["backend"] = args.backend
+    report["changed_items"] = [{"answer": items[i][1], "options": items[i][2],
+                                "reference": reference_sims[i], "candidate": candidate_sims[i]}
+                               for i in report["changed_items"]]
+    print(f"{args.backend} vs torch on {report['n_items']} items: "
+          f"mean |drift| {report['mean_abs_drift']:.2e}, p99 {report['p99_abs_drift']:.2e}, "
+          f"max {report['max_abs_drift']:.2e}, nearest option changed for {report['top1_changed']} items, "
+          f"{report['pair_flips']:.2%} option pairs flipped")
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, f"backend_validation_{args.backend}.json"), "w") as f:
+        json.dump(report, f, indent=3)
+
 if __name__ == "__main__":
-    for type_num in ["0", "1", "2", "3", "4"]:
-        get_similarity_score(type_num)
\ No newline at end of file
+    main()
@@ -91,6 +91,30 @@ def clean(file_name):
     with open(f"results/clean/{file_name}.json", "w") as f:
         json.dump(original_result, f, indent=3)
 
+def score_entry(entry):
+    if entry["question_type"] == "binary":
+        performance = (entry["clean_result"].lower()==entry["correct_answer"].lower())
+    elif entry["question_type"] == "mcq":
+        try:
+            performance = 1 if (int(entry["clean_result"])==0) else 0
+        except:
+            performance = 0
+    elif entry["question_type"] == "list":
+        clean, correct = set(entry["clean_result"]), set(entry["correct_answer"])
+        inter = clean & correct
+        try:
+            prec, recall = len(inter)/len(correct), len(inter)/len(clean)
+            # performance = 2 * prec * recall/ (prec + recall) # f1
+            if prec==1 and recall==1:
+                performance = 1
+            else:
+                performance = 0
+        except:
+            performance = 0
+    else:
+        performance = None
+    return performance
+
 def _main_result(file_name, condition="full_context"):
     performance_list = {cat:[] for cat in question_categories}
     with open(f"results/clean/{file_name}.json") as f:
@@ -104,25 +128,7 @@ def _main_result(file_name, condition="full_context"):
                 for k, entry in enumerate(cat_result):
                     if not filter_entry(entry, condition) or entry["question_type"]=="freeform":
                         continue
-                    if entry["question_type"] == "binary":
-                        performance = (entry["clean_result"].lower()==entry["correct_answer"].lower())
-                    elif entry["question_type"] == "mcq":
-                        try:
-                            performance = 1 if (int(entry["clean_result"])==0) else 0
-                        except:
-                            performance = 0
-                    elif entry["question_type"] == "list":
-                        clean, correct = set(entry["clean_result"]), set(entry["correct_answer"])
-                        inter = clean & correct
-                        try:
-                            prec, recall = len(inter)/len(correct), len(inter)/len(clean)
-                            # performance = 2 * prec * recall/ (prec + recall) # f1
-                            if prec==1 and recall==1:
-                                performance = 1
-                            else:
-                                performance = 0
-                        except:
-                            performance = 0
+                    performance = score_entry(entry)
                     performance_list[category].append(performance)
     for k, v in performance_list.items():
         if not len(v):
@@ -153,7 +159,8 @@ def main():
 
     if not args.file_name:
         file_names = os.listdir("results/original/")
-        file_names = [name[:-5] for name in file_names]
+        # skip the *_sim.json similarity files written by evaluate_freeform.py (and any non-JSON file)
+        file_names = [name[:-5] for name in file_names if name.endswith(".json") and not name.endswith("_sim.json")]
     else:
         file_names = [args.file_name]
     file_names.sort()
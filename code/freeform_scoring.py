@@ -0,0 +1,241 @@
+"""
+Freeform answer scoring for TactfulToM.
+
+`evaluate_freeform.py` writes, for every freeform entry, the `cos_similarity`
+and `token_f1` of the answer to each option (index 0 = correct answer) into
+results/original/{file_name}_sim.json. This module assigns each answer to its
+nearest option under a configurable rule and reports freeform accuracy per
+model × category in the same layout as the non-freeform table:
+
+  • cosine:   nearest option by cos_similarity
+  • f1:       nearest option by token_f1
+  • combined: nearest option by weight * cos_similarity + (1 - weight) * token_f1
+
+With `margin > 0`, an answer is only assigned when its best score beats the
+second best by at least the margin; otherwise it is left unassigned and
+counted as wrong (the abstain rate is reported).
+
+The similarity lists of each _sim.json file are converted once into padded
+(n_entries, n_options) arrays and cached as .npz files keyed on the file mtime,
+so changing the rule rescans the arrays without re-embedding or re-reading the
+JSON. All files are scored in one vectorized pass.
+
+Usage (from the repository root, after `evaluate_freeform.py`):
+    python code/freeform_scoring.py --rule combined --weight 0.7 --margin 0.05
+"""
+
+import argparse
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+from prettytable import PrettyTable
+
+from evaluate_non_freeform import question_categories
+from result_table import encode, file_mtime, model_name, set_id_from_qid
+
+
+ORIGINAL_DIR = "results/original"
+SIM_SUFFIX = "_sim"
+SIMILARITY_CACHE_DIR = "cache/similarity"
+RULES = ["cosine", "f1", "combined"]
+
+
+def list_sim_files(results_dir: str = ORIGINAL_DIR) -> List[str]:
+    """Result file names (without "_sim.json") that have freeform similarity scores."""
+    suffix = f"{SIM_SUFFIX}.json"
+    return sorted(name[:-len(suffix)] for name in os.listdir(results_dir) if name.endswith(suffix))
+
+
+def _parse_sim_file(path: str) -> Dict[str, np.ndarray]:
+    with open(path) as f:
+        result = json.load(f)
+    keys = {name: [] for name in ["q_id", "category", "context_type", "set_index"]}
+    cos, f1 = [], []
+    for i, question_set in enumerate(result):
+        for category in question_categories:
+            for cat_result in question_set.get(category, []):
+                for entry in cat_result:
+                    if entry["question_type"] != "freeform" or "cos_similarity" not in entry:
+                        continue
+                    if entry["original_result"] == "ERROR":
+                        continue
+                    keys["q_id"].append(entry.get("question_id") or f"{i}-{category}")
+                    keys["category"].append(category)
+                    keys["context_type"].append(entry["context_type"])
+                    keys["set_index"].append(i)
+                    cos.append(entry["cos_similarity"])
+                    f1.append(entry["token_f1"])
+
+    n_options = max((len(c) for c in cos), default=1)
+    arrays = {name: np.asarray(values, dtype=str) for name, values in keys.items() if name != "set_index"}
+    arrays["set_index"] = np.asarray(keys["set_index"], dtype=np.int64)
+    for name, values in [("cos", cos), ("f1", f1)]:
+        padded = np.full((len(values), n_options), np.nan)
+        for row, scores in enumerate(values):
+            padded[row, :len(scores)] = scores
+        arrays[name] = padded
+    return arrays
+
+
+@lru_cache(maxsize=None)
+def _load_sim_arrays(path: str, mtime: float, cache_dir: str) -> Dict[str, np.ndarray]:
+    cache_path = os.path.join(cache_dir, os.path.basename(path)[:-5] + ".npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if float(cached["mtime"]) == mtime:
+                return {name: cached[name] for name in cached.files if name != "mtime"}
+    arrays = _parse_sim_file(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, mtime=mtime, **arrays)
+    os.replace(tmp_path, cache_path)
+    return arrays
+
+
+def load_similarity_table(file_names: Optional[List[str]] = None, condition: Optional[str] = "full_context",
+                          results_dir: str = ORIGINAL_DIR,
+                          cache_dir: str = SIMILARITY_CACHE_DIR) -> Dict[str, np.ndarray]:
+    """
+    Concatenate the freeform similarity arrays of several result files.
+
+    Returns:
+        dict: Columns file_name, model, set_id, q_id, category, context_type
+              (object arrays) and cos / f1 (float arrays of shape
+              (n_entries, max_options), NaN-padded)
+    """
+    if file_names is None:
+        file_names = list_sim_files(results_dir)
+    parts = []
+    for file_name in file_names:
+        path = os.path.join(results_dir, f"{file_name}{SIM_SUFFIX}.json")
+        arrays = dict(_load_sim_arrays(path, file_mtime(path), cache_dir))
+        arrays["file_name"] = np.full(len(arrays["q_id"]), file_name, dtype=object)
+        arrays["model"] = np.full(len(arrays["q_id"]), model_name(file_name), dtype=object)
+        parts.append(arrays)
+
+    n_options = max([p["cos"].shape[1] for p in parts], default=1)
+    table = {}
+    for name in ["file_name", "model", "q_id", "category", "context_type"]:
+        table[name] = np.concatenate([p[name].astype(object) for p in parts]) if parts else np.empty(0, dtype=object)
+    table["set_id"] = np.array([set_id_from_qid(q_id) for q_id in table["q_id"]], dtype=object)
+    for name in ["cos", "f1"]:
+        padded = [np.pad(p[name], ((0, 0), (0, n_options - p[name].shape[1])), constant_values=np.nan) for p in parts]
+        table[name] = np.concatenate(padded) if parts else np.zeros((0, n_options))
+
+    if condition and "context" in condition:
+        mask = table["context_type"] == condition
+        table = {name: values[mask] for name, values in table.items()}
+    return table
+
+
+def assign_options(table: Dict[str, np.ndarray], rule: str = "cosine", weight: float = 0.5,
+                   margin: float = 0.0) -> Dict[str, np.ndarray]:
+    """
+    Assign every freeform answer to its nearest option.
+
+    Args:
+        table (dict): Similarity table from `load_similarity_table`
+        rule (str): "cosine", "f1" or "combined"
+        weight (float): Weight of cos_similarity for the combined rule
+        margin (float): Minimum gap between the best and second-best score
+
+    Returns:
+        dict: "assigned" (option index, 0 = correct, -1 = unassigned), "margin"
+              (best minus second-best score) and "correct" (float 0/1)
+    """
+    if rule == "cosine":
+        scores = table["cos"]
+    elif rule == "f1":
+        scores = table["f1"]
+    elif rule == "combined":
+        scores = weight * table["cos"] + (1 - weight) * table["f1"]
+    else:
+        raise ValueError(f"Unknown rule '{rule}', expected one of {RULES}")
+
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+    assigned = np.argmax(scores, axis=1) if len(scores) else np.zeros(0, dtype=np.int64)
+    if scores.shape[1] > 1:
+        top2 = -np.partition(-scores, 1, axis=1)[:, :2]
+        gap = top2[:, 0] - top2[:, 1]
+    else:
+        gap = np.full(len(scores), np.inf)
+    gap = np.where(np.isfinite(gap), gap, np.inf)
+    assigned = np.where(gap >= margin, assigned, -1)
+    return {"assigned": assigned, "margin": gap, "correct": (assigned == 0).astype(np.float64)}
+
+
+def freeform_accuracy(table: Dict[str, np.ndarray], assignment: Dict[str, np.ndarray],
+                      group_by: str = "file_name") -> Dict:
+    """
+    Accuracy and abstain rate per group × category.
+
+    Returns:
+        dict: "groups", "categories" level lists and "accuracy", "abstain",
+              "count" arrays of shape (n_groups, n_categories)
+    """
+    group_levels, g = encode(table[group_by])
+    cat_levels, c = encode(table["category"], [cat for cat in question_categories if cat in set(table["category"])])
+    dims = (max(len(group_levels), 1), max(len(cat_levels), 1))
+    flat = np.ravel_multi_index((g, c), dims) if len(g) else np.zeros(0, dtype=np.int64)
+    size = int(np.prod(dims))
+    count = np.bincount(flat, minlength=size).reshape(dims)
+    correct = np.bincount(flat, weights=assignment["correct"], minlength=size).reshape(dims)
+    abstain = np.bincount(flat, weights=(assignment["assigned"] < 0).astype(np.float64), minlength=size).reshape(dims)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {"groups": group_levels, "categories": cat_levels, "count": count,
+                "accuracy": correct / count, "abstain": abstain / count}
+
+
+def make_accuracy_table(result: Dict) -> PrettyTable:
+    """Freeform accuracy (%) in the layout of `evaluate_non_freeform.make_prettytable`."""
+    table = PrettyTable()
+    table.field_names = ["model_type"] + result["categories"]
+    for g, group in enumerate(result["groups"]):
+        table.add_row([group] + ["-" if not result["count"][g, c] else "{:.2f}".format(result["accuracy"][g, c] * 100)
+                                 for c in range(len(result["categories"]))])
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign freeform answers to options and score them")
+    parser.add_argument('--condition', type=str, default="full_context")
+    parser.add_argument('--file_names', type=str, default=None,
+                        help="Comma-separated result file names (default: every *_sim.json in results/original)")
+    parser.add_argument('--results_dir', type=str, default=ORIGINAL_DIR)
+    parser.add_argument('--cache_dir', type=str, default=SIMILARITY_CACHE_DIR)
+    parser.add_argument('--rule', type=str, default="cosine", choices=RULES)
+    parser.add_argument('--weight', type=float, default=0.5, help="cos_similarity weight for the combined rule")
+    parser.add_argument('--margin', type=float, default=0.0,
+                        help="Leave answers unassigned unless the best option wins by this margin")
+    parser.add_argument('--output_dir', type=str, default="cases")
+    args = parser.parse_args()
+
+    file_names = [name.strip() for name in args.file_names.split(",")] if args.file_names else None
+    table = load_similarity_table(file_names, args.condition, args.results_dir, args.cache_dir)
+    assignment = assign_options(table, args.rule, args.weight, args.margin)
+    result = freeform_accuracy(table, assignment)
+
+    pretty = make_accuracy_table(result)
+    print(f"Freeform accuracy (%), rule={args.rule}, margin={args.margin}")
+    print(pretty)
+    total = result["count"].sum()
+    if total:
+        print(f"Unassigned: {(assignment['assigned'] < 0).sum()} / {total}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, f"freeform_prettytable_{args.rule}.txt"), "w") as f:
+        f.write(pretty.get_string())
+    summary = {}
+    for g, group in enumerate(result["groups"]):
+        summary[group] = {cat: {"accuracy": float(result["accuracy"][g, c]), "abstain": float(result["abstain"][g, c]),
+                                "count": int(result["count"][g, c])}
+                          for c, cat in enumerate(result["categories"]) if result["count"][g, c]}
+    with open(os.path.join(args.output_dir, f"freeform_accuracy_{args.rule}.json"), "w") as f:
+        json.dump({"rule": args.rule, "weight": args.weight, "margin": args.margin, "results": summary}, f, indent=3)
+
+
+if __name__ == "__main__":
+    main()
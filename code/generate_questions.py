@@ -0,0 +1,198 @@
+"""
+Parallel batch question generation for TactfulToM.
+
+Runs the full generator suite (comprehension → lieability, with q_ids) over
+every dataset/elements file and writes the matching dataset/final_set file:
+
+  • the justification options of all dataset/justification_options/*.json
+    files are merged once into a set_id index and shipped to each worker once
+  • sets are generated in a process pool by the compiled spec generator of
+    `question_specs.py` (--reference uses the hand-written generators of
+    `question_generation_utils.py`; both give the same output); distractors
+    are drawn from a random generator seeded per set from crc32(seed:set_id),
+    so the output does not depend on the number of workers or the scheduling order
+  • each final_set file is written atomically, in the order of its elements file
+  • sets that fail (e.g. no justification options) are reported and left out
+
+The files are written to dataset/generated_set by default. The shipped
+dataset/final_set files carry manual fixes (e.g. the _c→_q replacements) that
+a regeneration discards, so they are only overwritten with --force.
+
+Usage (from the repository root):
+    python code/generate_questions.py --workers 8 --seed 0
+    python code/generate_questions.py --output_dir dataset/final_set --force
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from cache_utils import atomic_write_bytes
+from question_generation_utils import JUSTIFICATION_OPTIONS_DIR, generate_all_questions, load_justification_index
+from question_specs import QUESTION_FIELDS, QuestionGenerator
+
+
+ELEMENTS_DIR = "dataset/elements"
+FINAL_SET_DIR = "dataset/final_set"
+# default output: a scratch copy, so a bare run never replaces the curated final_set
+GENERATED_SET_DIR = "dataset/generated_set"
+ELEMENT_PREFIX = "Tactful_conv_element_"
+SET_PREFIX = "Tactful_conv_set_"
+
+QA_FIELDS = [field for field, _ in QUESTION_FIELDS]
+
+_options_map: Optional[dict] = None
+_generator: Optional[QuestionGenerator] = None
+
+
+def set_seed(seed: int, set_id: str) -> int:
+    """Deterministic per-set seed."""
+    return zlib.crc32(f"{seed}:{set_id}".encode("utf-8"))
+
+
+def _init_worker(options_map: dict):
+    global _options_map
+    _options_map = options_map
+
+
+def generate_set(spec: Dict, seed: int, options_map: Optional[dict] = None,
+                 reference: bool = False) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Generate the questions of one set.
+
+    Returns:
+        tuple: (final_set entry, None) or (None, error message)
+    """
+    global _generator
+    options_map = options_map if options_map is not None else _options_map
+    try:
+        if reference:
+            random.seed(set_seed(seed, spec["set_id"]))
+            questions = generate_all_questions(spec, options_map, verbose=False)
+        else:
+            if _generator is None:
+                _generator = QuestionGenerator()
+            questions = _generator.generate(spec, options_map, random.Random(set_seed(seed, spec["set_id"])))
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    entry = dict(spec)
+    entry.update(questions)
+    return entry, None
+
+
+def _generate_task(task: Tuple[Dict, int, bool]) -> Tuple[Optional[Dict], Optional[str]]:
+    spec, seed, reference = task
+    return generate_set(spec, seed, reference=reference)
+
+
+def output_name(elements_file: str) -> str:
+    """Tactful_conv_element_N.json -> Tactful_conv_set_N.json"""
+    return elements_file.replace(ELEMENT_PREFIX, SET_PREFIX, 1)
+
+
+def generate_questions(elements_files: List[str], output_dir: str = GENERATED_SET_DIR,
+                       options_dir: str = JUSTIFICATION_OPTIONS_DIR, workers: int = 1, seed: int = 0,
+                       chunksize: int = 4, reference: bool = False, force: bool = False) -> Dict:
+    """
+    Generate the final_set files of several elements files.
+
+    Args:
+        elements_files (list): Paths of dataset/elements files
+        output_dir (str): Directory of the final_set files
+        options_dir (str): Directory of the justification options files
+        workers (int): Number of worker processes (1 runs in-process)
+        seed (int): Base seed of the per-set seeds
+        chunksize (int): Sets per task sent to a worker
+        reference (bool): Use the hand-written generators instead of the compiled specs
+        force (bool): Allow overwriting existing files in FINAL_SET_DIR (discards manual edits)
+
+    Returns:
+        dict: Run statistics
+
+    Raises:
+        FileExistsError: If a curated final_set file would be overwritten without `force`
+    """
+    outputs = [os.path.join(output_dir, output_name(os.path.basename(path))) for path in elements_files]
+    if not force and os.path.abspath(output_dir) == os.path.abspath(FINAL_SET_DIR):
+        existing = [output for output in outputs if os.path.exists(output)]
+        if existing:
+            raise FileExistsError(f"Refusing to overwrite the curated {', '.join(existing)} "
+                                  f"(manual edits would be lost); pass --force to regenerate them")
+    start = time.time()
+    options_map = load_justification_index(options_dir)
+    specs = {}
+    for path in elements_files:
+        with open(path, "r", encoding="utf-8") as f:
+            specs[path] = json.load(f)
+    tasks = [(spec, seed, reference) for path in elements_files for spec in specs[path]]
+    load_seconds = time.time() - start
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(options_map,)) as executor:
+            results = list(executor.map(_generate_task, tasks, chunksize=chunksize))
+    else:
+        results = [generate_set(spec, seed, options_map, reference) for spec, seed, reference in tasks]
+    generate_seconds = time.time() - start - load_seconds
+
+    stats = {"files": {}, "failed": {}}
+    position = 0
+    n_questions = 0
+    for path, output in zip(elements_files, outputs):
+        entries = []
+        for spec in specs[path]:
+            entry, error = results[position]
+            position += 1
+            if error is not None:
+                stats["failed"][spec["set_id"]] = error
+                continue
+            entries.append(entry)
+            n_questions += sum(len(entry.get(field, [])) for field in QA_FIELDS)
+        atomic_write_bytes(output, json.dumps(entries, ensure_ascii=False, indent=4).encode("utf-8"))
+        stats["files"][output] = len(entries)
+
+    elapsed = time.time() - start
+    stats.update({
+        "sets": len(tasks), "questions": n_questions, "workers": workers,
+        "load_seconds": round(load_seconds, 3), "generate_seconds": round(generate_seconds, 3),
+        "seconds": round(elapsed, 3),
+        "sets_per_second": round(len(tasks) / generate_seconds, 1) if generate_seconds else None,
+        "questions_per_second": round(n_questions / generate_seconds, 1) if generate_seconds else None,
+    })
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the final_set questions of every elements file in parallel")
+    parser.add_argument('--elements_dir', type=str, default=ELEMENTS_DIR)
+    parser.add_argument('--files', type=str, default=None,
+                        help="Comma-separated elements file names (default: every Tactful_conv_element_*.json)")
+    parser.add_argument('--output_dir', type=str, default=GENERATED_SET_DIR)
+    parser.add_argument('--options_dir', type=str, default=JUSTIFICATION_OPTIONS_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reference', action="store_true",
+                        help="Use the hand-written generators of question_generation_utils.py")
+    parser.add_argument('--force', action="store_true",
+                        help=f"Overwrite existing {FINAL_SET_DIR} files (discards their manual edits)")
+    args = parser.parse_args()
+
+    if args.files:
+        names = [name.strip() for name in args.files.split(",")]
+    else:
+        names = sorted(name for name in os.listdir(args.elements_dir)
+                       if name.startswith(ELEMENT_PREFIX) and name.endswith(".json"))
+    stats = generate_questions([os.path.join(args.elements_dir, name) for name in names], args.output_dir,
+                               args.options_dir, args.workers, args.seed, reference=args.reference,
+                               force=args.force)
+    for set_id, error in stats["failed"].items():
+        print(f"Set {set_id} failed: {error}")
+    print(json.dumps({key: value for key, value in stats.items() if key != "failed"}, indent=3))
+
+
+if __name__ == "__main__":
+    main()
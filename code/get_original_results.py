@@ -4,8 +4,19 @@ import random
 from openai import OpenAI
 import json
 import time
+import copy
 from tqdm import tqdm
-import concurrent
+import concurrent.futures
+from online_evaluator import OnlineEvaluator
+from record_store import RecordStore
+
+# todo: liability
+# question_categories = ["comprehensionQA", "justificationQA", "fact_reasonQA", "fact_truthQA", "beliefQAs", "infoAccessibilityQA_list", "infoAccessibilityQAs_binary", "answerabilityQA_list", "answerabilityQAs_binary", "lieability","liedetectabilityQAs_list", "liedetectabilityQAs_binary"]
+MAX_TOKENS = 8192
+# append-only stores of augmented runs (exported to results/original/{file_name}.json for the scorers)
+AUGMENTED_DIR = "results/augmented"
+
+question_categories = ["comprehensionQA","fact_reasonQA", "fact_truthQA", "beliefQAs", "infoAccessibilityQA_list", "infoAccessibilityQAs_binary", "answerabilityQA_list", "answerabilityQAs_binary", "lieabilityQAs","liedetectabilityQAs_list", "liedetectabilityQAs_binary"]
 
 
 class LLM:
@@ -33,7 +44,7 @@ class LLM:
                 model=llm_name,
                 messages=single_input,
                 temperature=0.2,
-                max_tokens=8192
+                max_tokens=MAX_TOKENS
             )
         return response.choices[0].message.content
     
@@ -45,18 +56,43 @@ class LLM:
             return "ERROR"
         
     
-    def generate_set(self, set_inputs, cot=False):
+    def generate_set(self, set_inputs, cot=False, on_result=None, should_stop=None, order=None):
+        """
+        Generate responses for a set of inputs, streaming them as they complete.
+
+        Args:
+            set_inputs (list): LLM inputs
+            cot (bool): Whether to run the two-phase chain-of-thought generation
+            on_result (callable): Called as on_result(index, response) for every final
+                response as soon as it arrives (only for the last phase with cot)
+            should_stop (callable): Checked after every response; when it returns True
+                the pending requests are cancelled and left as "ABORTED"
+            order (list): Order in which the requests are submitted (e.g. longest prompt
+                first, so the slowest requests do not start last); default: input order
+        """
+        responses = ["ABORTED"] * len(set_inputs)
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            tasks = zip(set_inputs, [self.llm_name] * len(set_inputs))
-            responses = list(tqdm(executor.map(self.generate_helper, tasks), total=len(set_inputs)))
+            futures = {executor.submit(self.generate_helper, (set_inputs[i], self.llm_name)): i
+                       for i in (order if order is not None else range(len(set_inputs)))}
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(set_inputs)):
+                i = futures[future]
+                responses[i] = future.result()
+                if on_result is not None and not cot:
+                    on_result(i, responses[i])
+                if should_stop is not None and should_stop():
+                    for pending in futures:
+                        pending.cancel()
+                    break
         if not cot:
             return responses
         else:
+            if should_stop is not None and should_stop():
+                return responses
             # print("COT GENERATING")
             for i, single_input in enumerate(set_inputs):
                 set_inputs[i][1]["content"] += responses[i] + "\n\nTherefore, the final answer is: "
             # time.sleep(2)
-            return self.generate_set(set_inputs)
+            return self.generate_set(set_inputs, on_result=on_result, should_stop=should_stop, order=order)
             
 def get_user_prompt(question_type, context, question, options=None, information_prompt=None, cot=None):
     context_prompt = f"# Context:\n{context}\n\n"
@@ -108,7 +144,7 @@ def get_system_prompt(question_type, cot):
             system_prompt = "You are an expert in social reasoning. Think step by step, list the required items and split them with commas."
     return system_prompt
 
-def get_llm_input(question, question_type, context, cot):
+def get_llm_input(question, question_type, context, cot, mapping=None):
     # print(question)
     question_text = question["question"]
     system_prompt = get_system_prompt(question_type, cot)
@@ -138,8 +174,10 @@ def get_llm_input(question, question_type, context, cot):
         while type(wrong_answer_list[0]) == list:
             wrong_answer_list = wrong_answer_list[0]
         options = [question["correct_answer"]] + wrong_answer_list
-        mapping = [i for i in range(len(options))]
-        random.shuffle(mapping)
+        # a given mapping (e.g. the one of an earlier run) reproduces the same prompt
+        if mapping is None or sorted(mapping) != list(range(len(options))):
+            mapping = [i for i in range(len(options))]
+            random.shuffle(mapping)
         # print(len(options))
         # try:
         #     assert len(options) == 4
@@ -173,69 +211,131 @@ def get_llm_input(question, question_type, context, cot):
     #         clean_result = "NAN"
     # return original_result, clean_result
 
-def get_results(data_path, llm_name, cot, max_workers):
-    # load data
-    df = load_TactfulToM_dataset(data_path)
+def get_question_types(cat):
+    # question_type for different question_category
+    # one question could have multiple answers, depending on the number of question_type and context_type
+    if "list" in cat:
+        return ["list"]
+    elif "binary" in cat:
+        return ["binary"]
+    elif cat == "comprehensionQA":
+        return ["freeform", "binary"]
+    elif cat == "lieability":
+        return ["mcq"]
+    else:
+        return ["freeform", "mcq"]
+
+def get_set_inputs(questions_set, cot, mapping_for=None):
+    """
+    Build the LLM inputs of one question set and the result entries they fill.
+
+    Args:
+        questions_set: One set of the dataset (dict or DataFrame row)
+        cot (bool): Chain-of-thought prompting
+        mapping_for (callable): Optional (question, question_type) -> mcq option mapping;
+            None (or a returned None) shuffles the options randomly
+
+    Returns:
+        tuple: (set_results {category: [[entry, ...], ...]}, LLM inputs, (category, entry) of every input)
+    """
+    set_results = {cat: [] for cat in question_categories}
+    set_inputs = []
+    # (category, entry) of every input, for streaming evaluation
+    input_entries = []
+    for cat in question_categories:
+        if not cat in questions_set.keys():
+            print(f"No such category: {cat}")
+            continue
+        cat_questions = questions_set[cat]
+        for question in cat_questions:
+            question_types = get_question_types(cat)
+
+            results_question = []
+            for question_type in question_types:
+                for context_type in ["full_context"]:
+                    context = questions_set[context_type]
+                    mapping = mapping_for(question, question_type) if mapping_for is not None else None
+                    llm_input, mcq_mapping = get_llm_input(question, question_type, context, cot, mapping)
+                    set_inputs.append(llm_input)
+                    # original_result, clean_result = get_result(question, question_type, context, llm)
+                    entry = {
+                        "question": question["question"],
+                        "correct_answer": question["correct_answer"],
+                        "original_result": "",
+                        "clean_result": "",
+                        "question_type": question_type,
+                        "context_type": context_type,
+                        "mcq_mapping": mcq_mapping,
+                        "question_id": question["q_id"]
+                    }
+                    results_question.append(entry)
+                    input_entries.append((cat, entry))
+            set_results[cat].append(results_question)
+    return set_results, set_inputs, input_entries
 
+def get_results(data_path, llm_name, cot, max_workers, evaluator=None, augmenter=None, max_variants=None,
+                token_counter=None):
+    if token_counter is not None:
+        from token_counter import longest_first
     llm = LLM(llm_name, max_workers)
 
-    # todo: liability
-    # question_categories = ["comprehensionQA", "justificationQA", "fact_reasonQA", "fact_truthQA", "beliefQAs", "infoAccessibilityQA_list", "infoAccessibilityQAs_binary", "answerabilityQA_list", "answerabilityQAs_binary", "lieability","liedetectabilityQAs_list", "liedetectabilityQAs_binary"]
-    question_categories = ["comprehensionQA","fact_reasonQA", "fact_truthQA", "beliefQAs", "infoAccessibilityQA_list", "infoAccessibilityQAs_binary", "answerabilityQA_list", "answerabilityQAs_binary", "lieabilityQAs","liedetectabilityQAs_list", "liedetectabilityQAs_binary"]
+    file_name = llm_name.split("/")[-1]
+    if cot:
+        file_name += "-cot"
+    question_type = data_path.split(".")[0].split("_")[-1]
+    file_name += f"-{question_type}"
+
+    # load data; augmented variants are streamed one set at a time and every
+    # finished set is appended to results/augmented/{file_name}.jsonl
+    store = None
+    if augmenter is None:
+        df = load_TactfulToM_dataset(data_path)
+        question_sets, n_sets = df.iterrows(), df.shape[0]
+    else:
+        from scenario_augmentation import iter_records
+        from slice_analysis import METADATA_KEY, record_metadata
+        file_name += "-aug"
+        question_sets = enumerate(augmenter.variants(iter_records([data_path]), max_variants))
+        n_sets = max_variants if max_variants is not None else "?"
+        store = RecordStore(f"{AUGMENTED_DIR}/{file_name}.jsonl", key="set_id")
 
     results = []
-    for idx, questions_set in df.iterrows():
+    for idx, questions_set in question_sets:
         if not idx % 10:
-            print(f"Progress: {idx} / {df.shape[0]}")
-        set_results = {cat: [] for cat in question_categories}
-        set_inputs = []
-
+            print(f"Progress: {idx} / {n_sets}")
+        if evaluator is not None and not evaluator.wait_if_paused(file_name):
+            print(f"Stopping {file_name} after {idx} sets")
+            break
         # mapping for mcq questions in this set
         # mcq_mapping[llm_generated_answer] == 0 means that llm_generated_answer is correct
         # mcq_mapping = [i for i in range(4)]
         # random.shuffle(mcq_mapping)
 
         '''Step 1: Initialize the result list'''
-        for cat in question_categories:
-            if not cat in questions_set.keys():
-                print(f"No such category: {cat}")
-                continue
-            cat_questions = questions_set[cat]
-            for question in cat_questions:
-                # question_type for different question_category
-                # one question could have multiple answers, depending on the number of question_type and context_type
-                if "list" in cat:
-                    question_types = ["list"]
-                elif "binary" in cat:
-                    question_types = ["binary"]
-                elif cat == "comprehensionQA":
-                    question_types = ["freeform", "binary"]
-                elif cat == "lieability":
-                    question_types = ["mcq"]
-                else:
-                    question_types = ["freeform", "mcq"]
-                
-                results_question = []
-                for question_type in question_types:
-                    for context_type in ["full_context"]:
-                        context = questions_set[context_type]
-                        llm_input, mcq_mapping = get_llm_input(question, question_type, context, cot)
-                        set_inputs.append(llm_input)
-                        # original_result, clean_result = get_result(question, question_type, context, llm)
-                        results_question.append({
-                            "question": question["question"],
-                            "correct_answer": question["correct_answer"],
-                            "original_result": "",
-                            "clean_result": "",
-                            "question_type": question_type,
-                            "context_type": context_type,
-                            "mcq_mapping": mcq_mapping,
-                            "question_id": question["q_id"]
-                        })
-                set_results[cat].append(results_question)
+        set_results, set_inputs, input_entries = get_set_inputs(questions_set, cot)
+        order = longest_first(token_counter.count_messages(set_inputs)) if token_counter is not None else None
 
         '''Step 2: Use LLM to generate the results'''
-        set_outputs = llm.generate_set(set_inputs, cot)
+        if evaluator is None:
+            set_outputs = llm.generate_set(set_inputs, cot, order=order)
+        else:
+            def on_result(index, response):
+                cat, entry = input_entries[index]
+                evaluator.observe(file_name, cat, dict(entry, original_result=response))
+            # cot generation extends the inputs in place, so keep a copy for re-running a paused set
+            fresh_inputs = copy.deepcopy(set_inputs)
+            set_stats = evaluator.snapshot(file_name)
+            set_outputs = llm.generate_set(set_inputs, cot, on_result=on_result,
+                                           should_stop=lambda: evaluator.should_stop(file_name), order=order)
+            if evaluator.should_stop(file_name):
+                print(evaluator.make_table())
+                # the set is incomplete: resume it from scratch, or keep only the finished sets on disk
+                if not evaluator.wait_if_paused(file_name):
+                    print(f"Stopping {file_name} after {idx} sets")
+                    break
+                # the set is scored again from scratch
+                evaluator.restore(file_name, set_stats)
+                set_outputs = llm.generate_set(fresh_inputs, cot, on_result=on_result, order=order)
         print(f"Error times: {llm.error_times}")
 
         '''Step 3: Update the result list'''
@@ -254,15 +354,22 @@ def get_results(data_path, llm_name, cot, max_workers):
                     set_results[cat][i][j]["original_result"] = original_output
                     # set_results[cat][i][j]["clean_result"] = clean_output
                     pointer += 1
+        if store is not None:
+            # variant set_ids / q_ids are not in final_set, so the slice metadata travels with the results
+            set_meta, question_meta = record_metadata(questions_set)
+            store.append(dict(set_results, set_id=questions_set["set_id"],
+                              **{METADATA_KEY: {"set": set_meta, "questions": question_meta}}))
+            continue
         results.append(set_results)
-        file_name = llm_name.split("/")[-1]
-        if cot:
-            file_name += "-cot"
-        question_type = data_path.split(".")[0].split("_")[-1]
-        file_name += f"-{question_type}"
         # print(file_name)
         with open(f"results/original/{file_name}.json", "w") as f:
             json.dump(results, f, indent=3)
+    if store is not None:
+        # same layout as the other result files (plus the variant set_id and slice metadata), so evaluate_non_freeform.py scores it
+        store.export_json(f"results/original/{file_name}.json", indent=3)
+        results = store.latest()
+    if evaluator is not None:
+        print(evaluator.make_table())
     return results
 
 def main():
@@ -271,8 +378,35 @@ def main():
     parser.add_argument('--llms', type=str, default="Qwen/Qwen2.5-72B-Instruct,Qwen/QwQ-32B,deepseek-ai/DeepSeek-V3-0324,deepseek-ai/DeepSeek-R1-Turbo,meta-llama/Llama-3.3-70B-Instruct,gpt-4o-2024-08-06,o1-2024-12-17,o3-mini-2025-01-31")
     parser.add_argument('--max_workers', type=int, default=64)
     parser.add_argument('--cot', default=None)
+    parser.add_argument('--online_eval', action="store_true",
+                        help="Score answers as they arrive and report running accuracy / parse-failure rates")
+    parser.add_argument('--max_parse_failure_rate', type=float, default=None,
+                        help="Stop a model once its parse-failure rate exceeds this value (requires --online_eval)")
+    parser.add_argument('--min_entries', type=int, default=50,
+                        help="Scored answers needed before --max_parse_failure_rate is applied")
+    parser.add_argument('--on_parse_failure', type=str, default="abort", choices=["abort", "pause"],
+                        help="pause: wait for a cache/online_eval/<file_name>.resume (or .abort) file")
+    parser.add_argument('--augment_axes', type=str, default=None,
+                        help="Evaluate streamed variants instead of the sets, e.g. names,roles,leave,truth")
+    parser.add_argument('--names_per_set', type=int, default=2)
+    parser.add_argument('--roles_per_set', type=int, default=2)
+    parser.add_argument('--leave_per_set', type=int, default=2)
+    parser.add_argument('--augment_seed', type=int, default=0)
+    parser.add_argument('--max_variants', type=int, default=None, help="Variants per dataset file")
+    parser.add_argument('--longest_first', action="store_true",
+                        help="Submit the prompts of each set longest first (token counts from token_counter.py)")
     args = parser.parse_args()
 
+    evaluator = None
+    if args.online_eval:
+        evaluator = OnlineEvaluator(args.max_parse_failure_rate, args.min_entries, args.on_parse_failure)
+
+    augmenter = None
+    if args.augment_axes:
+        from scenario_augmentation import ScenarioAugmenter
+        augmenter = ScenarioAugmenter([axis.strip() for axis in args.augment_axes.split(",")], args.names_per_set,
+                                      args.roles_per_set, args.leave_per_set, args.augment_seed)
+
     llm_list = args.llms.split(",")
     llm_list = [llm.strip() for llm in llm_list]
 
@@ -281,6 +415,10 @@ def main():
 
     for path in path_list:
         for llm in llm_list:
+            token_counter = None
+            if args.longest_first:
+                from token_counter import TokenCounter, tokenizer_for
+                token_counter = TokenCounter(tokenizer_for(llm))
             if not args.cot is None:
                 cot_list = [bool(args.cot)]
             elif llm in ["Qwen/QwQ-32B", "deepseek-ai/DeepSeek-R1-Turbo", "o1-2024-12-17", "o3-2025-04-16", "o3-mini-2025-01-31"]:
@@ -288,7 +426,10 @@ def main():
             else:
                 cot_list = [True, False]
             for cot in cot_list:
-                get_results(path, llm, cot, max_workers=args.max_workers)
+                get_results(path, llm, cot, max_workers=args.max_workers, evaluator=evaluator,
+                            augmenter=augmenter, max_variants=args.max_variants, token_counter=token_counter)
+            if token_counter is not None:
+                token_counter.save()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
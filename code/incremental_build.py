@@ -0,0 +1,393 @@
+"""
+Incremental, content-hashed rebuilds of the TactfulToM pipeline.
+
+    elements → justification options → final_set questions → prompts
+             → raw results → clean results → scores
+
+Every build records in a manifest (cache/build/manifest.json) the content
+hash of each node and the hashes of the inputs it was built from, and only
+rebuilds the nodes whose inputs changed:
+
+  • options: one node per set_id, built from the justification prompt of its
+    element; an element change that alters the prompt marks the options stale
+    (re-generated for just those set_ids with --regenerate_options)
+  • questions: one node per set_id, built from its element, its options and
+    the generation seed, with one hash per q_id; edits made directly to
+    final_set (e.g. a _c→_q fix) show up as changed q_ids. New sets are
+    generated into their final_set file; stale sets that already exist are
+    only re-generated in place with --overwrite_questions, which discards
+    their manual edits (otherwise they are reported and kept)
+  • prompts: one node per (q_id, question_type, context_type) and results
+    file, hashed over the exact messages sent to the model
+  • raw results: responses are cached by content_hash([model, cot, messages])
+    in cache/build/llm_results.jsonl, so only new or changed prompts are sent
+    to the API; failed responses are not cached and are retried next build
+  • clean results and scores: one node per results file, re-run only when
+    its raw results changed
+
+The first build adopts the current state as its baseline: nothing is
+re-generated, and the responses of existing results/original files are reused
+for prompts whose question and answer are unchanged (MCQ prompts are rebuilt
+with the recorded option mapping; new MCQ prompts shuffle the options with a
+seed derived from the q_id, so prompts stay stable across builds).
+
+Usage (from the repository root):
+    python code/incremental_build.py status --llms gpt-4o-2024-08-06
+    python code/incremental_build.py build --llms gpt-4o-2024-08-06 --max_workers 16
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+from typing import Dict, List, Tuple
+
+from cache_utils import CACHE_DIR, atomic_write_json, content_hash, load_json, text_hash
+from evaluate_non_freeform import _main_result, clean
+from generate_questions import ELEMENT_PREFIX, ELEMENTS_DIR, FINAL_SET_DIR, QA_FIELDS, SET_PREFIX, generate_set
+from get_original_results import LLM, get_set_inputs
+from justification_option_generator import build_justification_prompt, init_openai_client, \
+    process_all_conversations
+from question_generation_utils import JUSTIFICATION_OPTIONS_DIR, flatten_wrong_answers, load_justification_index, \
+    load_justification_options
+from record_store import RecordStore
+
+
+BUILD_DIR = os.path.join(CACHE_DIR, "build")
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+RESULTS_CACHE_PATH = os.path.join(BUILD_DIR, "llm_results.jsonl")
+ORIGINAL_DIR = "results/original"
+CLEAN_DIR = "results/clean"
+TYPE_NUMS = ("0", "1", "2", "3", "4")
+FAILED_RESPONSES = ("ERROR", "ABORTED")
+MANIFEST_SECTIONS = ("options", "questions", "prompts", "clean")
+
+
+def elements_path(type_num: str) -> str:
+    return os.path.join(ELEMENTS_DIR, f"{ELEMENT_PREFIX}{type_num}.json")
+
+
+def options_path(type_num: str) -> str:
+    return os.path.join(JUSTIFICATION_OPTIONS_DIR, f"justification_option_{type_num}.json")
+
+
+def final_set_path(type_num: str) -> str:
+    return os.path.join(FINAL_SET_DIR, f"{SET_PREFIX}{type_num}.json")
+
+
+def result_file_name(llm_name: str, cot: bool, type_num: str) -> str:
+    """Results file name used by `get_original_results.get_results`."""
+    return llm_name.split("/")[-1] + ("-cot" if cot else "") + f"-{type_num}"
+
+
+def question_hashes(entry: Dict) -> Dict[str, str]:
+    """q_id -> content hash of every question of a final_set entry."""
+    return {question["q_id"]: content_hash(question)
+            for field in QA_FIELDS for question in entry.get(field, []) if question.get("q_id")}
+
+
+def prompt_mapping(q_id: str, question_type: str, n_options: int) -> List[int]:
+    """MCQ option order of a new prompt, seeded by the q_id so it is the same in every build."""
+    mapping = list(range(n_options))
+    random.Random(f"{q_id}:{question_type}").shuffle(mapping)
+    return mapping
+
+
+def diff_hashes(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, List[str]]:
+    """Keys added, removed and changed between two hash maps."""
+    return {"added": [key for key in new if key not in old],
+            "removed": [key for key in old if key not in new],
+            "changed": [key for key in new if key in old and old[key] != new[key]]}
+
+
+class IncrementalBuild:
+    def __init__(self, type_nums=TYPE_NUMS, seed: int = 0, manifest_path: str = MANIFEST_PATH,
+                 results_cache_path: str = RESULTS_CACHE_PATH, dry_run: bool = False,
+                 overwrite_questions: bool = False):
+        """
+        Args:
+            type_nums (list): Dataset files to build ("0"-"4")
+            seed (int): Question generation seed (see `generate_questions.set_seed`)
+            manifest_path (str): Build manifest
+            results_cache_path (str): Model response cache
+            dry_run (bool): Only report what would be rebuilt; no API calls, no writes
+            overwrite_questions (bool): Re-generate stale sets that exist in final_set in
+                place, discarding their manual edits
+        """
+        self.type_nums = list(type_nums)
+        self.seed = seed
+        self.manifest_path = manifest_path
+        self.dry_run = dry_run
+        self.overwrite_questions = overwrite_questions
+        self.manifest = load_json(manifest_path, default={})
+        for section in MANIFEST_SECTIONS:
+            self.manifest.setdefault(section, {})
+        self.results_cache = RecordStore(results_cache_path, key="key")
+        self.report: Dict[str, Dict] = {}
+
+        self.elements = {n: load_json(elements_path(n), default=[]) for n in self.type_nums}
+        self.options = {n: load_justification_options(options_path(n)) if os.path.exists(options_path(n)) else {}
+                        for n in self.type_nums}
+        self.final_sets = {n: load_json(final_set_path(n), default=[]) for n in self.type_nums}
+
+    def save(self):
+        if not self.dry_run:
+            atomic_write_json(self.manifest_path, self.manifest)
+
+    def options_inputs(self, spec: Dict) -> str:
+        """Input hash of the options of a set: the justification prompt built from its element."""
+        return content_hash(build_justification_prompt(spec))
+
+    def build_options(self, regenerate: bool = False, **generator_kwargs) -> Dict:
+        """
+        Find the options whose element changed since they were generated and,
+        with `regenerate`, generate them again (one API call per stale set_id).
+
+        Args:
+            regenerate (bool): Call the justification option generator for stale set_ids
+            **generator_kwargs: Options of `process_all_conversations` (model, max_concurrency, ...)
+        """
+        records = self.manifest["options"]
+        stale: Dict[str, List[str]] = {}
+        for n in self.type_nums:
+            for spec in self.elements[n]:
+                set_id = spec["set_id"]
+                inputs = self.options_inputs(spec)
+                record = records.get(set_id)
+                if record is not None and record["inputs"] != inputs:
+                    stale.setdefault(n, []).append(set_id)
+                    continue
+                # first build (baseline) or unchanged inputs; options may have been edited by hand
+                records[set_id] = {"inputs": inputs, "hash": content_hash(self.options[n].get(set_id))}
+
+        regenerated = []
+        if regenerate and stale and not self.dry_run:
+            for n, set_ids in stale.items():
+                results = process_all_conversations(elements_path(n), options_path(n), skip_existing=False,
+                                                    set_ids=set_ids, **generator_kwargs)
+                self.options[n] = load_justification_options(options_path(n))
+                specs = {spec["set_id"]: spec for spec in self.elements[n]}
+                for set_id, success in results.items():
+                    if success:
+                        records[set_id] = {"inputs": self.options_inputs(specs[set_id]),
+                                           "hash": content_hash(self.options[n].get(set_id))}
+                        regenerated.append(set_id)
+            load_justification_index.cache_clear()
+        report = {"stale": sorted(set_id for set_ids in stale.values() for set_id in set_ids),
+                  "regenerated": regenerated}
+        self.report["options"] = report
+        self.save()
+        return report
+
+    def build_questions(self) -> Dict:
+        """
+        Re-generate the questions of the sets whose element, options or seed
+        changed, and diff every set's q_id hashes against the last build.
+        Stale sets already in final_set are kept (and reported) unless
+        `overwrite_questions` is set, since re-generating discards manual edits.
+        """
+        records = self.manifest["questions"]
+        options_map = {set_id: options for n in self.type_nums for set_id, options in self.options[n].items()}
+        regenerated, kept, failed = [], [], {}
+        q_ids = {"added": [], "removed": [], "changed": []}
+        for n in self.type_nums:
+            entries = self.final_sets[n]
+            positions = {entry["set_id"]: i for i, entry in enumerate(entries)}
+            modified = False
+            for spec in self.elements[n]:
+                set_id = spec["set_id"]
+                inputs = content_hash([content_hash(spec), content_hash(options_map.get(set_id)), self.seed])
+                record = records.get(set_id)
+                stale = set_id not in positions or (record is not None and record["inputs"] != inputs)
+                if stale and set_id in positions and not self.overwrite_questions:
+                    # keep the curated questions; the set stays stale until it is overwritten
+                    kept.append(set_id)
+                    inputs = record["inputs"]
+                elif stale:
+                    # also in a dry run (in memory only), so the prompt report covers the new questions
+                    entry, error = generate_set(spec, self.seed, options_map)
+                    if error is not None:
+                        failed[set_id] = error
+                        continue
+                    if set_id in positions:
+                        entries[positions[set_id]] = entry
+                    else:
+                        positions[set_id] = len(entries)
+                        entries.append(entry)
+                    regenerated.append(set_id)
+                    modified = True
+                hashes = question_hashes(entries[positions[set_id]])
+                if record is not None:
+                    for kind, keys in diff_hashes(record["q_ids"], hashes).items():
+                        q_ids[kind].extend(keys)
+                records[set_id] = {"inputs": inputs, "q_ids": hashes}
+            if modified and not self.dry_run:
+                atomic_write_json(final_set_path(n), entries, indent=4)
+        if kept:
+            print(f"{len(kept)} stale sets kept as they are in final_set; pass --overwrite_questions to "
+                  f"re-generate them (discards their manual edits)")
+        report = {"regenerated_sets": regenerated, "stale_kept_sets": kept, "failed_sets": failed,
+                  **{f"{kind}_q_ids": keys for kind, keys in q_ids.items()}}
+        self.report["questions"] = report
+        self.save()
+        return report
+
+    def _previous_entries(self, file_name: str) -> Dict[Tuple[str, str, str], Dict]:
+        """(q_id, question_type, context_type) -> entry of an existing results/original file."""
+        previous = {}
+        for set_results in load_json(os.path.join(ORIGINAL_DIR, f"{file_name}.json"), default=[]):
+            for category_results in set_results.values():
+                if not isinstance(category_results, list):
+                    continue
+                for question_results in category_results:
+                    for entry in question_results:
+                        previous[entry["question_id"], entry["question_type"], entry["context_type"]] = entry
+        return previous
+
+    def build_results(self, llm_name: str, cot: bool = False, max_workers: int = 16) -> Dict:
+        """
+        Rebuild the results/original files of one model, calling the API only
+        for prompts without a cached response.
+
+        Returns:
+            dict: Per results file: prompt changes, API calls, and whether the file changed
+        """
+        report = {}
+        for n in self.type_nums:
+            file_name = result_file_name(llm_name, cot, n)
+            path = os.path.join(ORIGINAL_DIR, f"{file_name}.json")
+            baseline = file_name not in self.manifest["prompts"]
+            previous = self._previous_entries(file_name)
+
+            def mapping_for(question, question_type):
+                n_options = 1 + len(flatten_wrong_answers(question))
+                entry = previous.get((question["q_id"], question_type, "full_context"))
+                if entry is not None and sorted(entry["mcq_mapping"]) == list(range(n_options)):
+                    return entry["mcq_mapping"]
+                return prompt_mapping(question["q_id"], question_type, n_options)
+
+            results, hashes, missing, adopted = [], {}, [], []
+            for questions_set in self.final_sets[n]:
+                set_results, set_inputs, input_entries = get_set_inputs(questions_set, cot, mapping_for)
+                for llm_input, (_, entry) in zip(set_inputs, input_entries):
+                    node = f"{entry['question_id']}|{entry['question_type']}|{entry['context_type']}"
+                    key = content_hash([llm_name, bool(cot), llm_input])
+                    hashes[node] = key
+                    cached = self.results_cache.get(key)
+                    old = previous.get((entry["question_id"], entry["question_type"], entry["context_type"]))
+                    if cached is not None:
+                        entry["original_result"] = cached["response"]
+                    elif baseline and old is not None and old["original_result"] not in FAILED_RESPONSES \
+                            and old["question"] == entry["question"] \
+                            and old["correct_answer"] == entry["correct_answer"]:
+                        entry["original_result"] = old["original_result"]
+                        adopted.append({"key": key, "model": llm_name, "response": old["original_result"]})
+                    else:
+                        missing.append((entry, llm_input, key))
+                results.append(set_results)
+
+            prompts = diff_hashes(self.manifest["prompts"].get(file_name, {}), hashes)
+            file_report = {"prompts": len(hashes), "baseline": baseline, "adopted": len(adopted),
+                           "api_calls": len(missing), **{f"{kind}_prompts": len(keys) for kind, keys in prompts.items()}}
+            report[file_name] = file_report
+            if self.dry_run:
+                continue
+
+            self.results_cache.extend(adopted)
+            if missing:
+                llm = LLM(llm_name, max_workers)
+                # cot generation extends the inputs in place
+                responses = llm.generate_set([copy.deepcopy(llm_input) for _, llm_input, _ in missing], cot)
+                new_records = []
+                for (entry, _, key), response in zip(missing, responses):
+                    entry["original_result"] = response
+                    if response not in FAILED_RESPONSES:
+                        new_records.append({"key": key, "model": llm_name, "response": response})
+                self.results_cache.extend(new_records)
+                file_report["failed_calls"] = len(missing) - len(new_records)
+
+            file_report["changed"] = load_json(path) != results if os.path.exists(path) else True
+            if file_report["changed"]:
+                atomic_write_json(path, results, indent=3)
+            self.manifest["prompts"][file_name] = hashes
+            self.save()
+        self.report.setdefault("results", {}).update(report)
+        return report
+
+    def build_scores(self, file_names: List[str]) -> Dict:
+        """Clean and score the results files whose raw results changed since the last build."""
+        report = {}
+        for file_name in file_names:
+            path = os.path.join(ORIGINAL_DIR, f"{file_name}.json")
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                inputs = text_hash(f.read())
+            record = self.manifest["clean"].get(file_name)
+            # in a dry run the results files are not rewritten; go by the results report
+            pending = self.report.get("results", {}).get(file_name, {})
+            unchanged = not (self.dry_run and (pending.get("api_calls") or pending.get("changed_prompts")
+                                               or pending.get("added_prompts")))
+            if unchanged and record is not None and record["inputs"] == inputs \
+                    and os.path.exists(os.path.join(CLEAN_DIR, f"{file_name}.json")):
+                report[file_name] = {"rebuilt": False, "scores": record["scores"]}
+                continue
+            if self.dry_run:
+                report[file_name] = {"rebuilt": True}
+                continue
+            os.makedirs(CLEAN_DIR, exist_ok=True)
+            clean(file_name)
+            scores = _main_result(file_name)
+            self.manifest["clean"][file_name] = {"inputs": inputs, "scores": scores}
+            # freeform similarities (evaluate_freeform.py) are not rebuilt here
+            report[file_name] = {"rebuilt": True, "scores": scores,
+                                 "stale_similarities": os.path.join(ORIGINAL_DIR, f"{file_name}_sim.json")}
+            self.save()
+        self.report["scores"] = report
+        return report
+
+    def build(self, llms: List[str], cot: bool = False, max_workers: int = 16, regenerate_options: bool = False,
+              **generator_kwargs) -> Dict:
+        """Run every stage; returns the per-stage report."""
+        self.build_options(regenerate_options, **generator_kwargs)
+        self.build_questions()
+        file_names = []
+        for llm_name in llms:
+            self.build_results(llm_name, cot, max_workers)
+            file_names.extend(result_file_name(llm_name, cot, n) for n in self.type_nums)
+        self.build_scores(file_names)
+        return self.report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally rebuild options, questions, results and scores")
+    parser.add_argument('command', choices=["status", "build"],
+                        help="status: report what a build would redo (no API calls, no writes)")
+    parser.add_argument('--llms', type=str, default="", help="Comma-separated models whose results are rebuilt")
+    parser.add_argument('--type_nums', type=str, default=",".join(TYPE_NUMS))
+    parser.add_argument('--cot', action="store_true")
+    parser.add_argument('--max_workers', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0, help="Question generation seed")
+    parser.add_argument('--manifest', type=str, default=MANIFEST_PATH)
+    parser.add_argument('--regenerate_options', action="store_true",
+                        help="Re-generate stale justification options (OpenAI API)")
+    parser.add_argument('--overwrite_questions', action="store_true",
+                        help="Re-generate stale sets in place in final_set (discards their manual edits)")
+    parser.add_argument('--options_model', type=str, default="gpt-4")
+    parser.add_argument('--api_key', type=str, default=None, help="API key of the justification option generator")
+    args = parser.parse_args()
+
+    build = IncrementalBuild(args.type_nums.split(","), args.seed, args.manifest, dry_run=args.command == "status",
+                             overwrite_questions=args.overwrite_questions)
+    generator_kwargs = {}
+    if args.regenerate_options:
+        init_openai_client(args.api_key or os.environ.get("OPENAI_API_KEY"))
+        generator_kwargs["model"] = args.options_model
+    llms = [llm.strip() for llm in args.llms.split(",") if llm.strip()]
+    report = build.build(llms, args.cot, args.max_workers, args.regenerate_options, **generator_kwargs)
+    print(json.dumps(report, indent=3))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,22 @@ Dataset Justification Option Generator
 
 This script generates justification options for the TactfulToM dataset using OpenAI API.
 It processes conversation data and creates multiple-choice question options for justification questions.
+
+Processing all conversations of a file:
+  • the input JSON is loaded once into a set_id index
+  • requests run concurrently (--max-concurrency) and are paced by a shared
+    token-bucket rate limiter (--requests-per-minute)
+  • generated options are appended, in batches of --flush-every, to an
+    append-only log next to the output (output.jsonl, see `record_store.py`)
+  • the log is compacted and the output JSON is rewritten atomically at the
+    end of the run, so an interrupted run never leaves a half-written file
+  • with --skip-existing, set_ids already in the log are skipped; an existing
+    output JSON without a log is imported into the log once
+  • every reply is checked against the options schema (see
+    `justification_options_schema.py`) and repaired cheapest first: local JSON
+    and layout repair, a structured-output request (when the endpoint supports
+    it), a follow-up asking only for the invalid fields, and a full
+    re-generation as the last resort; the rate of each path is reported
 """
 
 import openai
@@ -11,19 +27,103 @@ import os
 import json
 import re
 import time
+import asyncio
 import textwrap
 import argparse
 from typing import Dict, List, Any, Optional
 
+from cache_utils import atomic_write_json
+from justification_options_schema import (RepairReport, apply_follow_up, follow_up_prompt, normalize_options,
+                                          repair_json, structured_response_format, validate_options)
+from record_store import RecordStore
+
 
-# Global OpenAI client
+# Global OpenAI clients
 client = None
+async_client = None
+
+
+def init_openai_client(api_key: str, base_url: Optional[str] = None):
+    """Initialize the OpenAI clients with API key."""
+    global client, async_client
+    client = openai.OpenAI(api_key=api_key, base_url=base_url)
+    async_client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+
+class RateLimiter:
+    """Token-bucket limiter shared by concurrent requests."""
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        """
+        Args:
+            requests_per_minute (float): Sustained request rate; 0 disables the limiter
+            burst (int): Requests that may be sent back to back
+        """
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be sent."""
+        if not self.interval:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.interval)
+
+
+def load_conversation_index(json_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Load a conversation data JSON file into a set_id index.
+
+    Args:
+        json_path (str): Path to conversation data JSON file
+
+    Returns:
+        dict: set_id -> conversation record, in file order
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {item["set_id"]: item for item in data if item.get("set_id") is not None}
+
+
+def options_store(output_path: str) -> RecordStore:
+    """
+    Append-only log backing a justification options JSON file.
+
+    Records are {"set_id": ..., "options": ...} lines kept in `output_path`
+    with a .jsonl extension. When the log does not exist yet, the entries of an
+    existing output JSON are imported into it.
+
+    Args:
+        output_path (str): Path to output JSON file
 
+    Returns:
+        RecordStore: The log for that file
+    """
+    store = RecordStore(os.path.splitext(output_path)[0] + ".jsonl", key="set_id")
+    if not len(store) and os.path.exists(output_path):
+        try:
+            with open(output_path, "r", encoding="utf-8") as f:
+                existing_data = json.load(f)
+        except json.JSONDecodeError:
+            existing_data = {}
+        store.extend([{"set_id": set_id, "options": options} for set_id, options in existing_data.items()])
+    return store
 
-def init_openai_client(api_key: str):
-    """Initialize OpenAI client with API key."""
-    global client
-    client = openai.OpenAI(api_key=api_key)
+
+def export_options(store: RecordStore, output_path: str):
+    """Compact the log and atomically write the latest options per set_id to the output JSON."""
+    store.compact()
+    atomic_write_json(output_path, {record["set_id"]: record["options"] for record in store.latest()}, indent=2)
 
 
 def clean_json_str(raw: str) -> str:
@@ -65,13 +165,11 @@ def safe_parse_gpt_output(s: str) -> Dict[str, Any]:
     Returns:
         dict: Parsed JSON object
     """
-    try:
-        cleaned = clean_json_str(s)
-        return json.loads(cleaned)
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
-        print(f"Cleaned string: {cleaned}")
+    value, _ = repair_json(s)
+    if not isinstance(value, dict):
+        print(f"JSON parsing error: {s!r}")
         return {}
+    return value
 
 
 def generate_prompt_for_justification_options(json_path: str, set_id: str) -> str:
@@ -85,13 +183,23 @@ def generate_prompt_for_justification_options(json_path: str, set_id: str) -> st
     Returns:
         str: Formatted prompt for GPT
     """
-    # Load JSON and find conversation by set_id
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    conversation_data = next((item for item in data if item.get("set_id") == set_id), None)
+    conversation_data = load_conversation_index(json_path).get(set_id)
     if conversation_data is None:
         raise ValueError(f"Set ID '{set_id}' not found in the JSON file")
+    return build_justification_prompt(conversation_data)
+
+
+def build_justification_prompt(conversation_data: Dict[str, Any]) -> str:
+    """
+    Build the justification options prompt of one conversation record.
+
+    Args:
+        conversation_data (dict): Conversation record (an element of the input JSON)
+
+    Returns:
+        str: Formatted prompt for GPT
+    """
+    set_id = conversation_data["set_id"]
 
     # Extract required fields
     extracted_data = {
@@ -155,47 +263,197 @@ def generate_prompt_for_justification_options(json_path: str, set_id: str) -> st
     return formatted_prompt
 
 
-def call_gpt_for_options(prompt: str, model: str = "gpt-4", max_retries: int = 3) -> Optional[Dict[str, Any]]:
+def _option_messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "You are a helpful assistant that generates multiple-choice question options."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _ask(request: Dict[str, Any]):
+    """Yield one request to the driver; returns (content, None) or (None, exception)."""
+    try:
+        return (yield request), None
+    except Exception as e:
+        return None, e
+
+
+def _check_options(content: Optional[str], set_id: str):
+    """Parse, normalize and validate a reply: (entry or None, invalid fields, repairs applied)."""
+    value, repairs = repair_json(content)
+    entry, layout_repairs = normalize_options(value, set_id)
+    if entry is None:
+        return None, None, repairs
+    return entry, validate_options(entry), repairs + layout_repairs
+
+
+def _options_ladder(prompt: str, set_id: str, report: RepairReport, max_retries: int = 3):
+    """
+    Request, validate and repair the options of one set_id, cheapest path first:
+    local repair → structured-output request → follow-up for the invalid
+    fields → full re-generation.
+
+    A generator that yields request keyword arguments (messages, optionally
+    response_format) and is sent the content of each reply; the drivers in
+    `call_gpt_for_options` / `call_gpt_for_options_async` make the calls, so
+    the sync and async paths share the same logic. Returns {set_id: options}
+    or None.
+    """
+    messages = _option_messages(prompt)
+
+    content, error = yield from _ask({"messages": messages})
+    if error is not None:
+        print(f"[{set_id}] API call failed - {error}")
+        report.add("failed")
+        return None
+    entry, errors, repairs = _check_options(content, set_id)
+    if entry is not None and not errors:
+        report.add("local_repair" if repairs else "valid", repairs)
+        return {set_id: entry}
+
+    # Structured output, unless the endpoint already rejected it
+    if report.structured_supported is not False:
+        structured, error = yield from _ask({"messages": messages,
+                                             "response_format": structured_response_format(set_id)})
+        if isinstance(error, openai.BadRequestError):
+            print(f"[{set_id}] Structured output not supported - {error}")
+            report.structured_supported = False
+        elif error is None:
+            report.structured_supported = True
+            candidate, candidate_errors, candidate_repairs = _check_options(structured, set_id)
+            if candidate is not None and not candidate_errors:
+                report.add("structured", candidate_repairs)
+                return {set_id: candidate}
+            if candidate is not None and (entry is None or len(candidate_errors) < len(errors)):
+                content, entry, errors = structured, candidate, candidate_errors
+
+    # Follow-up for just the invalid fields
+    if entry is not None:
+        reply, error = yield from _ask({"messages": messages + [
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": follow_up_prompt(set_id, entry, errors)}
+        ]})
+        if error is None:
+            merged = apply_follow_up(entry, repair_json(reply)[0], list(errors))
+            if not validate_options(merged):
+                report.add("follow_up")
+                return {set_id: merged}
+
+    # Full re-generation as the last resort
+    for attempt in range(max_retries):
+        content, error = yield from _ask({"messages": messages})
+        if error is not None:
+            print(f"[{set_id}] Re-generation {attempt + 1}: API call failed - {error}")
+            continue
+        entry, errors, repairs = _check_options(content, set_id)
+        if entry is not None and not errors:
+            report.add("regenerated", repairs)
+            return {set_id: entry}
+        print(f"[{set_id}] Re-generation {attempt + 1}: invalid options {errors or 'unparseable output'}")
+
+    report.add("failed")
+    return None
+
+
+def _create(request: Dict[str, Any], model: str, max_retries: int) -> str:
+    """One chat completion, with exponential backoff on transient errors."""
+    for attempt in range(max_retries):
+        try:
+            response = client.chat.completions.create(model=model, temperature=0.7, max_tokens=1000, **request)
+            return response.choices[0].message.content
+        except openai.BadRequestError:
+            raise
+        except Exception as e:
+            print(f"Attempt {attempt + 1}: API call failed - {e}")
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(2 ** attempt)  # Exponential backoff
+
+
+async def _create_async(request: Dict[str, Any], model: str, max_retries: int,
+                        limiter: Optional[RateLimiter], semaphore: asyncio.Semaphore) -> str:
+    """Async counterpart of `_create`, paced by the rate limiter."""
+    for attempt in range(max_retries):
+        try:
+            async with semaphore:
+                if limiter is not None:
+                    await limiter.acquire()
+                response = await async_client.chat.completions.create(
+                    model=model, temperature=0.7, max_tokens=1000, **request)
+            return response.choices[0].message.content
+        except openai.BadRequestError:
+            raise
+        except Exception as e:
+            print(f"Attempt {attempt + 1}: API call failed - {e}")
+            if attempt == max_retries - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)  # Exponential backoff
+
+
+def call_gpt_for_options(prompt: str, set_id: str, model: str = "gpt-4", max_retries: int = 3,
+                         report: Optional[RepairReport] = None) -> Optional[Dict[str, Any]]:
     """
     Call GPT API to generate justification options.
     
     Args:
         prompt (str): Formatted prompt for GPT
+        set_id (str): Set ID the options are generated for
         model (str): GPT model to use
         max_retries (int): Maximum number of retry attempts
+        report (RepairReport): Collects the repair path of the options
         
     Returns:
-        dict: Generated options or None if failed
+        dict: Validated options {set_id: options} or None if failed
     """
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that generates multiple-choice question options."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            content = response.choices[0].message.content
-            result = safe_parse_gpt_output(content)
-            
-            if result:
-                return result
+    ladder = _options_ladder(prompt, set_id, report if report is not None else RepairReport(), max_retries)
+    try:
+        request = next(ladder)
+        while True:
+            try:
+                content = _create(request, model, max_retries)
+            except Exception as e:
+                request = ladder.throw(e)
             else:
-                print(f"Attempt {attempt + 1}: Failed to parse GPT output")
-                
-        except Exception as e:
-            print(f"Attempt {attempt + 1}: API call failed - {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
-    
-    return None
+                request = ladder.send(content)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def call_gpt_for_options_async(prompt: str, set_id: str, model: str = "gpt-4", max_retries: int = 3,
+                                     report: Optional[RepairReport] = None, limiter: Optional[RateLimiter] = None,
+                                     semaphore: Optional[asyncio.Semaphore] = None) -> Optional[Dict[str, Any]]:
+    """
+    Async counterpart of `call_gpt_for_options`.
+
+    Args:
+        prompt (str): Formatted prompt for GPT
+        set_id (str): Set ID the options are generated for
+        model (str): GPT model to use
+        max_retries (int): Maximum number of retry attempts
+        report (RepairReport): Collects the repair path of the options
+        limiter (RateLimiter): Shared rate limiter, acquired before every request
+        semaphore (asyncio.Semaphore): Bounds the number of requests in flight
+
+    Returns:
+        dict: Validated options {set_id: options} or None if failed
+    """
+    semaphore = semaphore or asyncio.Semaphore(1)
+    ladder = _options_ladder(prompt, set_id, report if report is not None else RepairReport(), max_retries)
+    try:
+        request = next(ladder)
+        while True:
+            try:
+                content = await _create_async(request, model, max_retries, limiter, semaphore)
+            except Exception as e:
+                request = ladder.throw(e)
+            else:
+                request = ladder.send(content)
+    except StopIteration as stop:
+        return stop.value
 
 
-def process_single_conversation(json_path: str, set_id: str, output_path: str) -> bool:
+def process_single_conversation(json_path: str, set_id: str, output_path: str, model: str = "gpt-4",
+                                report: Optional[RepairReport] = None) -> bool:
     """
     Process a single conversation and generate justification options.
     
@@ -203,6 +461,8 @@ def process_single_conversation(json_path: str, set_id: str, output_path: str) -
         json_path (str): Path to conversation data JSON file
         set_id (str): Conversation set ID to process
         output_path (str): Path to output JSON file
+        model (str): GPT model to use
+        report (RepairReport): Collects the repair path of the options
         
     Returns:
         bool: True if successful, False otherwise
@@ -214,25 +474,16 @@ def process_single_conversation(json_path: str, set_id: str, output_path: str) -
         prompt = generate_prompt_for_justification_options(json_path, set_id)
         
         # Call GPT API
-        result = call_gpt_for_options(prompt)
+        result = call_gpt_for_options(prompt, set_id, model, report=report)
         
         if not result:
             print(f"[FAILED] {set_id} - Could not generate options")
             return False
         
-        # Load existing output data
-        try:
-            with open(output_path, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            existing_data = {}
-        
-        # Merge new result
-        existing_data.update(result)
-        
-        # Save updated data
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(existing_data, f, indent=2, ensure_ascii=False)
+        # Append to the log and rewrite the output atomically
+        store = options_store(output_path)
+        store.extend([{"set_id": key, "options": options} for key, options in result.items()])
+        export_options(store, output_path)
         
         print(f"[OK] {set_id} written to {output_path}")
         return True
@@ -242,50 +493,100 @@ def process_single_conversation(json_path: str, set_id: str, output_path: str) -
         return False
 
 
-def process_all_conversations(json_path: str, output_path: str, skip_existing: bool = True) -> Dict[str, bool]:
+async def process_all_conversations_async(json_path: str, output_path: str, skip_existing: bool = True,
+                                          model: str = "gpt-4", max_concurrency: int = 8,
+                                          requests_per_minute: float = 60, flush_every: int = 10,
+                                          set_ids: Optional[List[str]] = None,
+                                          report: Optional[RepairReport] = None) -> Dict[str, bool]:
     """
-    Process all conversations in the dataset.
-    
+    Process many conversations concurrently.
+
     Args:
         json_path (str): Path to conversation data JSON file
         output_path (str): Path to output JSON file
-        skip_existing (bool): Whether to skip already processed conversations
-        
+        skip_existing (bool): Whether to skip set_ids already in the log
+        model (str): GPT model to use
+        max_concurrency (int): Maximum number of requests in flight
+        requests_per_minute (float): Request rate limit (0 disables it)
+        flush_every (int): Number of results appended to the log per write
+        set_ids (list): Only process these set_ids (default: all)
+        report (RepairReport): Collects the repair path of every generated entry
+
     Returns:
         dict: Results for each set_id (True=success, False=failed)
     """
-    # Load conversation data
-    with open(json_path, "r", encoding="utf-8") as f:
-        conv_data = json.load(f)
-    
-    all_set_ids = [rec["set_id"] for rec in conv_data]
-    
-    # Load existing results if skipping
-    processed_set_ids = set()
-    if skip_existing and os.path.exists(output_path):
-        try:
-            with open(output_path, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-            processed_set_ids = set(existing_data.keys())
-            print(f"Found {len(processed_set_ids)} already processed conversations")
-        except (FileNotFoundError, json.JSONDecodeError):
-            pass
-    
+    conversations = load_conversation_index(json_path)
+    all_set_ids = list(conversations) if set_ids is None else list(set_ids)
+
+    store = options_store(output_path)
+    if skip_existing and len(store):
+        print(f"Found {len(store.keys())} already processed conversations")
+
     results = {}
-    
+    pending = []
     for set_id in all_set_ids:
-        if skip_existing and set_id in processed_set_ids:
-            print(f"[SKIP] {set_id} - already processed")
+        if set_id not in conversations:
+            print(f"[ERROR] {set_id} - Set ID '{set_id}' not found in the JSON file")
+            results[set_id] = False
+        elif skip_existing and set_id in store:
             results[set_id] = True
-            continue
-        
-        success = process_single_conversation(json_path, set_id, output_path)
-        results[set_id] = success
-        
-        # Add delay to avoid rate limiting
-        time.sleep(1)
+        else:
+            pending.append(set_id)
+    print(f"Processing {len(pending)} conversations ({len(all_set_ids) - len(pending)} skipped)")
+
+    report = report if report is not None else RepairReport()
+    limiter = RateLimiter(requests_per_minute, burst=max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    batch = []
+
+    def flush():
+        store.extend(batch)
+        batch.clear()
+
+    async def worker(set_id: str):
+        try:
+            prompt = build_justification_prompt(conversations[set_id])
+            result = await call_gpt_for_options_async(prompt, set_id, model, report=report,
+                                                      limiter=limiter, semaphore=semaphore)
+        except Exception as e:
+            print(f"[ERROR] {set_id} - {e}")
+            results[set_id] = False
+            return
+        if not result:
+            print(f"[FAILED] {set_id} - Could not generate options")
+            results[set_id] = False
+            return
+        batch.extend({"set_id": key, "options": options} for key, options in result.items())
+        results[set_id] = True
+        print(f"[OK] {set_id}")
+        if len(batch) >= flush_every:
+            flush()
+
+    try:
+        await asyncio.gather(*(worker(set_id) for set_id in pending))
+    finally:
+        flush()
+        export_options(store, output_path)
+        print(f"Options written to {output_path}")
+
+    return {set_id: results[set_id] for set_id in all_set_ids}
+
+
+def process_all_conversations(json_path: str, output_path: str, skip_existing: bool = True,
+                              **kwargs) -> Dict[str, bool]:
+    """
+    Process all conversations in the dataset.
     
-    return results
+    Args:
+        json_path (str): Path to conversation data JSON file
+        output_path (str): Path to output JSON file
+        skip_existing (bool): Whether to skip already processed conversations
+        **kwargs: Options of `process_all_conversations_async`
+        
+    Returns:
+        dict: Results for each set_id (True=success, False=failed)
+    """
+    return asyncio.run(process_all_conversations_async(json_path, output_path, skip_existing, **kwargs))
 
 
 def main():
@@ -297,22 +598,31 @@ def main():
                        help="Path to output justification options JSON file")
     parser.add_argument("--api-key", required=True,
                        help="OpenAI API key")
+    parser.add_argument("--base-url", default=None,
+                       help="OpenAI-compatible endpoint (optional)")
     parser.add_argument("--set-id", 
                        help="Process only specific set_id (optional)")
     parser.add_argument("--skip-existing", action="store_true", default=True,
                        help="Skip already processed conversations")
     parser.add_argument("--model", default="gpt-4",
                        help="GPT model to use (default: gpt-4)")
+    parser.add_argument("--max-concurrency", type=int, default=8,
+                       help="Maximum number of requests in flight (default: 8)")
+    parser.add_argument("--requests-per-minute", type=float, default=60,
+                       help="Request rate limit, 0 to disable (default: 60)")
+    parser.add_argument("--flush-every", type=int, default=10,
+                       help="Results appended to the log per write (default: 10)")
     
     args = parser.parse_args()
     
     # Initialize OpenAI client
-    init_openai_client(args.api_key)
+    init_openai_client(args.api_key, args.base_url)
+    report = RepairReport()
     
     if args.set_id:
         # Process single conversation
         success = process_single_conversation(
-            args.input, args.set_id, args.output
+            args.input, args.set_id, args.output, args.model, report
         )
         if success:
             print(f"✅ Successfully processed {args.set_id}")
@@ -323,7 +633,9 @@ def main():
         # Process all conversations
         print(f"Processing all conversations from {args.input}")
         results = process_all_conversations(
-            args.input, args.output, args.skip_existing
+            args.input, args.output, args.skip_existing, model=args.model,
+            max_concurrency=args.max_concurrency, requests_per_minute=args.requests_per_minute,
+            flush_every=args.flush_every, report=report
         )
         
         # Print summary
@@ -335,9 +647,10 @@ def main():
         print(f"✅ Successful: {successful}/{total}")
         if failed_ids:
             print(f"❌ Failed: {', '.join(failed_ids)}")
+        print(f"🔧 Repair paths: {json.dumps(report.summary(), indent=2)}")
         
         return 0 if successful == total else 1
 
 
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    exit(main())
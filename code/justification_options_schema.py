@@ -0,0 +1,438 @@
+"""
+Schema, validation and local repair of justification options.
+
+A justification options file maps each set_id to
+
+    {"truth": {"correct_answer": "<sentence>",
+               "wrong_answers": ["<Type-1>", "<Type-2>", "<Type-3>"]}}
+
+(see OPTIONS_FILE_SCHEMA). Model output is brought into this shape in steps,
+cheapest first; `justification_option_generator.py` only goes back to the
+model for what cannot be fixed locally:
+
+  • `repair_json` parses the raw output incrementally: fences, leading and
+    trailing prose, comments and trailing commas are dropped, and a truncated
+    reply is closed (open string, dangling key, open brackets in stack order)
+  • `normalize_options` fixes the layout: a missing or wrong top-level set_id
+    key, "wrong_answer" instead of "wrong_answers", nested or extra answers,
+    extra keys
+  • `validate_options` checks the content field by field: non-empty sentences
+    of at most MAX_WORDS words, exactly three wrong answers, no duplicates and
+    no wrong answer equal to the correct answer
+  • `follow_up_prompt` asks for just the invalid fields, and `apply_follow_up`
+    merges the reply
+  • `RepairReport` counts which path produced every accepted entry
+
+Usage (from the repository root):
+    python code/justification_options_schema.py dataset/justification_options
+"""
+
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from question_generation_utils import JUSTIFICATION_OPTIONS_DIR, flatten_wrong_answers, load_justification_options
+
+
+MAX_WORDS = 30
+N_WRONG_ANSWERS = 3
+
+# Wrong answer descriptions, in the Type-1/2/3 order of JUSTIFICATION_DISTRACTOR_TYPES
+WRONG_ANSWER_TYPES = [
+    "Type-1 Literal Reason — simply restates the spoken lie as if it were true",
+    "Type-2 Negative Feeling — blames dislike, annoyance, etc.",
+    "Type-3 Random Excuse — plausible but unrelated",
+]
+
+
+def entry_schema(item_counts: bool = True) -> Dict[str, Any]:
+    """
+    JSON Schema of the options of one set_id.
+
+    Args:
+        item_counts (bool): Include minItems / maxItems (not accepted by every
+            structured-output endpoint; `validate_options` checks the count anyway)
+    """
+    wrong_answers = {"type": "array", "items": {"type": "string"}}
+    if item_counts:
+        wrong_answers.update(minItems=N_WRONG_ANSWERS, maxItems=N_WRONG_ANSWERS)
+    truth = {
+        "type": "object",
+        "properties": {"correct_answer": {"type": "string"}, "wrong_answers": wrong_answers},
+        "required": ["correct_answer", "wrong_answers"],
+        "additionalProperties": False,
+    }
+    return {"type": "object", "properties": {"truth": truth}, "required": ["truth"], "additionalProperties": False}
+
+
+OPTIONS_FILE_SCHEMA = {"type": "object", "additionalProperties": entry_schema()}
+
+
+def structured_response_format(set_id: str) -> Dict[str, Any]:
+    """`response_format` of a structured-output request for one set_id."""
+    schema = {"type": "object", "properties": {set_id: entry_schema(item_counts=False)},
+              "required": [set_id], "additionalProperties": False}
+    return {"type": "json_schema", "json_schema": {"name": "justification_options", "strict": True, "schema": schema}}
+
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.S)
+_DANGLING_KEY = re.compile(r'([,{])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+
+def _close_truncated(text: str, repairs: List[str]) -> str:
+    """Drop comments and trailing commas, and close what a truncated reply left open."""
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = escaped = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            i += 1
+            continue
+        if text.startswith("//", i):
+            end = text.find("\n", i)
+            i = len(text) if end == -1 else end
+            repairs.append("comments")
+            continue
+        if text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = len(text) if end == -1 else end + 2
+            repairs.append("comments")
+            continue
+        if char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                repairs.append("trailing_commas")
+            if stack and stack[-1] == char:
+                stack.pop()
+        elif char == "{":
+            stack.append("}")
+        elif char == "[":
+            stack.append("]")
+        elif char == '"':
+            in_string = True
+        out.append(char)
+        i += 1
+
+    if not in_string and not stack:
+        return "".join(out)
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+        repairs.append("unterminated_string")
+    text = "".join(out).rstrip()
+    if stack and stack[-1] == "}":
+        match = _DANGLING_KEY.search(text)
+        if match:
+            text = text[:match.start() + 1] if match.group(1) == "{" else text[:match.start()]
+            repairs.append("dangling_key")
+    text = text.rstrip().rstrip(",")
+    repairs.append("unclosed_brackets")
+    return text + "".join(reversed(stack))
+
+
+def repair_json(raw: Optional[str]) -> Tuple[Any, List[str]]:
+    """
+    Parse model output as JSON, repairing it step by step.
+
+    Args:
+        raw (str): Raw model output
+
+    Returns:
+        tuple: (parsed value or None, names of the repairs applied)
+    """
+    if not raw:
+        return None, []
+    text = raw.strip()
+    try:
+        return json.loads(text), []
+    except json.JSONDecodeError:
+        pass
+
+    repairs = []
+    match = _FENCE.search(text)
+    if match:
+        text = match.group(1).strip()
+        repairs.append("fences")
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return None, repairs
+    if min(starts) > 0:
+        text = text[min(starts):]
+        repairs.append("leading_text")
+    try:
+        value, end = json.JSONDecoder().raw_decode(text)
+        if text[end:].strip():
+            repairs.append("trailing_text")
+        return value, repairs
+    except json.JSONDecodeError:
+        pass
+
+    text = _close_truncated(text, repairs)
+    try:
+        value, end = json.JSONDecoder().raw_decode(text)
+    except json.JSONDecodeError:
+        return None, repairs
+    if text[end:].strip():
+        repairs.append("trailing_text")
+    return value, list(dict.fromkeys(repairs))
+
+
+def normalize_options(value: Any, set_id: str) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Bring parsed output into the layout of one options entry.
+
+    Args:
+        value: Parsed model output, normally {set_id: {"truth": {...}}}
+        set_id (str): Set ID the output was requested for
+
+    Returns:
+        tuple: ({"truth": {"correct_answer": ..., "wrong_answers": [...]}} or
+               None if the output has no usable structure, names of the repairs applied)
+    """
+    repairs = []
+    if not isinstance(value, dict):
+        return None, repairs
+    if set_id in value:
+        entry = value[set_id]
+        if len(value) > 1:
+            repairs.append("extra_keys")
+    elif "truth" in value or "correct_answer" in value:
+        entry = value
+        repairs.append("missing_set_id_key")
+    elif len(value) == 1:
+        entry = next(iter(value.values()))
+        repairs.append("wrong_set_id_key")
+    else:
+        return None, repairs
+    if not isinstance(entry, dict):
+        return None, repairs
+    if "truth" not in entry and "correct_answer" in entry:
+        entry = {"truth": entry}
+        repairs.append("missing_truth_key")
+    truth = entry.get("truth")
+    if not isinstance(truth, dict):
+        return None, repairs
+    if len(entry) > 1 or set(truth) - {"correct_answer", "wrong_answers", "wrong_answer"}:
+        repairs.append("extra_keys")
+
+    if "wrong_answer" in truth:
+        repairs.append("wrong_answer_key")
+    raw_wrong = truth.get("wrong_answer", truth.get("wrong_answers"))
+    wrong_answers = flatten_wrong_answers(truth)
+    if raw_wrong is not None and wrong_answers != raw_wrong:
+        repairs.append("wrong_answers_layout")
+    if len(wrong_answers) > N_WRONG_ANSWERS:
+        wrong_answers = wrong_answers[:N_WRONG_ANSWERS]
+        repairs.append("extra_wrong_answers")
+    correct_answer = truth.get("correct_answer")
+    normalized = {
+        "correct_answer": correct_answer.strip() if isinstance(correct_answer, str) else correct_answer,
+        "wrong_answers": [answer.strip() if isinstance(answer, str) else answer for answer in wrong_answers],
+    }
+    return {"truth": normalized}, list(dict.fromkeys(repairs))
+
+
+def _sentence_error(value: Any) -> Optional[str]:
+    if not isinstance(value, str) or not value:
+        return "missing or empty"
+    if len(value.split()) > MAX_WORDS:
+        return f"longer than {MAX_WORDS} words"
+    return None
+
+
+def _canonical(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", "", text.lower()).split())
+
+
+def validate_options(entry: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Check a normalized options entry.
+
+    Args:
+        entry (dict): Output of `normalize_options`
+
+    Returns:
+        dict: Invalid field -> problem; fields are "correct_answer" and
+              "wrong_answer_1" ... "wrong_answer_3" (empty if the entry is valid)
+    """
+    truth = entry["truth"]
+    errors = {}
+    correct_answer = truth.get("correct_answer")
+    error = _sentence_error(correct_answer)
+    if error:
+        errors["correct_answer"] = error
+    seen = {_canonical(correct_answer): "correct_answer"} if not error else {}
+    wrong_answers = truth.get("wrong_answers") or []
+    for i in range(N_WRONG_ANSWERS):
+        field = f"wrong_answer_{i + 1}"
+        answer = wrong_answers[i] if i < len(wrong_answers) else None
+        error = _sentence_error(answer)
+        if error:
+            errors[field] = error
+            continue
+        key = _canonical(answer)
+        if key in seen:
+            errors[field] = f"duplicates {seen[key]}"
+        else:
+            seen[key] = field
+    return errors
+
+
+def field_value(entry: Dict[str, Any], field: str) -> Any:
+    """Value of a validation field ("correct_answer" or "wrong_answer_N") in an entry."""
+    truth = entry["truth"]
+    if field == "correct_answer":
+        return truth.get("correct_answer")
+    i = int(field.rsplit("_", 1)[1]) - 1
+    wrong_answers = truth.get("wrong_answers") or []
+    return wrong_answers[i] if i < len(wrong_answers) else None
+
+
+def follow_up_prompt(set_id: str, entry: Dict[str, Any], errors: Dict[str, str]) -> str:
+    """
+    Prompt asking only for the invalid fields of an entry.
+
+    Args:
+        set_id (str): Set ID of the entry
+        entry (dict): Normalized entry
+        errors (dict): Output of `validate_options`
+
+    Returns:
+        str: Follow-up prompt (sent after the original prompt and reply)
+    """
+    fields = ["correct_answer"] + [f"wrong_answer_{i + 1}" for i in range(N_WRONG_ANSWERS)]
+    keep = {field: field_value(entry, field) for field in fields if field not in errors}
+    descriptions = [f"- {field}: {problem}" for field, problem in errors.items()]
+    types = [f"- wrong_answer_{i + 1}: {description}" for i, description in enumerate(WRONG_ANSWER_TYPES)]
+    keys = ", ".join(f'"{field}"' for field in errors)
+    return "\n".join([
+        f'Some fields of your answer for set_id "{set_id}" are invalid:',
+        *descriptions,
+        "",
+        "These fields are fine and stay as they are:",
+        json.dumps(keep, indent=2, ensure_ascii=False),
+        "",
+        "Wrong answer types:",
+        *types,
+        "",
+        f"Return ONLY a JSON object with exactly the keys {keys}. Each value is one realistic English sentence "
+        f"of at most {MAX_WORDS} words that follows its type, re-uses the exact character names and does not "
+        "repeat the correct answer or another wrong answer.",
+    ])
+
+
+def apply_follow_up(entry: Dict[str, Any], reply: Any, fields: List[str]) -> Dict[str, Any]:
+    """
+    Merge the reply to a follow-up prompt into a copy of the entry.
+
+    Args:
+        entry (dict): Normalized entry
+        reply: Parsed follow-up reply {field: sentence}
+        fields (list): Requested fields
+
+    Returns:
+        dict: Updated entry
+    """
+    truth = entry["truth"]
+    wrong_answers = list(truth.get("wrong_answers") or [])
+    wrong_answers += [None] * (N_WRONG_ANSWERS - len(wrong_answers))
+    merged = {"correct_answer": truth.get("correct_answer"), "wrong_answers": wrong_answers}
+    if isinstance(reply, dict):
+        for field in fields:
+            value = reply.get(field)
+            if not isinstance(value, str):
+                continue
+            if field == "correct_answer":
+                merged["correct_answer"] = value.strip()
+            else:
+                wrong_answers[int(field.rsplit("_", 1)[1]) - 1] = value.strip()
+    return {"truth": merged}
+
+
+class RepairReport:
+    """Counts of the path that produced each entry, and of the local repairs applied."""
+
+    PATHS = ("valid", "local_repair", "structured", "follow_up", "regenerated", "failed")
+
+    def __init__(self):
+        self.paths = Counter()
+        self.repairs = Counter()
+        # None until a structured-output request has been tried
+        self.structured_supported: Optional[bool] = None
+
+    def add(self, path: str, repairs: List[str] = ()):
+        self.paths[path] += 1
+        self.repairs.update(repairs)
+
+    def summary(self) -> Dict[str, Any]:
+        total = sum(self.paths.values())
+        return {
+            "entries": total,
+            "paths": {path: {"count": self.paths[path], "rate": round(self.paths[path] / total, 3) if total else 0.0}
+                      for path in self.PATHS},
+            "local_repairs": dict(self.repairs.most_common()),
+            "structured_output": self.structured_supported,
+        }
+
+
+def validate_options_file(path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Validate every entry of a justification options file.
+
+    Returns:
+        dict: set_id -> problems (layout repairs the entry would need, and
+              invalid fields), for the entries that are not valid as stored
+    """
+    problems = {}
+    for set_id, options in load_justification_options(path).items():
+        entry, repairs = normalize_options({set_id: options}, set_id)
+        if entry is None:
+            problems[set_id] = {"entry": "no usable structure"}
+            continue
+        errors = {repair: "needs repair" for repair in repairs}
+        errors.update(validate_options(entry))
+        if errors:
+            problems[set_id] = errors
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate justification options files against the schema")
+    parser.add_argument('paths', nargs="*", default=[JUSTIFICATION_OPTIONS_DIR],
+                        help="Options files or directories (default: dataset/justification_options)")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".json"))
+        else:
+            files.append(path)
+    n_invalid = 0
+    for path in files:
+        problems = validate_options_file(path)
+        n_invalid += len(problems)
+        print(f"{path}: {len(problems)} invalid entries")
+        for set_id, errors in problems.items():
+            for field, problem in errors.items():
+                print(f"  {set_id} {field}: {problem}")
+    return 1 if n_invalid else 0
+
+
+if __name__ == "__main__":
+    exit(main())
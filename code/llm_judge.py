@@ -0,0 +1,304 @@
+"""
+LLM-as-judge scoring for TactfulToM freeform answers.
+
+Every freeform answer is shown to a judge model together with its question,
+the correct answer and the wrong-answer distractors, and the judge names the
+option the answer matches (or "none"). Any OpenAI-compatible endpoint can act
+as the judge (e.g. a local vLLM / llama.cpp server via --base_url).
+
+Cost scales with unique answers, not entries:
+  • every (question, options, answer) triple is keyed by a content hash that
+    also covers the judge model and prompt version; identical answers across
+    models, CoT / no-CoT runs and reruns are judged once
+  • verdicts are cached on disk under cache/judge, so reruns only send new triples
+  • pending triples are packed `batch_size` per judge call and the calls run
+    concurrently
+  • the options are shown in an order shuffled deterministically per cache key
+    (the correct answer is not always option 1), and the verdict is mapped back
+    to the original option index
+
+The judge's verdicts are compared with the nearest option under the
+similarity scores (see `freeform_scoring.py`), per model × category; entries
+without similarity scores only count towards the judge accuracy.
+
+Usage (from the repository root):
+    python code/llm_judge.py --judge_model Qwen/Qwen2.5-72B-Instruct --base_url http://localhost:8000/v1
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from openai import OpenAI
+from prettytable import PrettyTable
+from tqdm import tqdm
+
+from cache_utils import CACHE_DIR, atomic_write_json, content_hash, load_json
+from distractor_analysis import load_question_index
+from freeform_scoring import assign_options, list_sim_files, load_similarity_table
+from justification_option_generator import clean_json_str
+from result_table import RESULTS_DIR, encode, list_result_files, load_result_table
+from slice_analysis import DATASET_DIR
+
+
+# "2": options shown in a shuffled order
+PROMPT_VERSION = "2"
+NO_MATCH = -1
+UNPARSED = -2
+# nearest option of an entry without similarity scores (no _sim file)
+UNKNOWN_SIMILARITY = -3
+
+SYSTEM_PROMPT = """You are grading answers to social reasoning questions.
+For every numbered item you get a question, a list of numbered options and a candidate answer.
+Decide which option the candidate answer expresses the same meaning as. If it matches none of them, answer "none".
+Reply with a JSON list only, one object per item: [{"id": <item id>, "option": <option number or "none">}]"""
+
+
+def format_batch(triples: List[Dict]) -> str:
+    blocks = []
+    for i, triple in enumerate(triples):
+        options = "\n".join(f"  {k + 1}. {option}" for k, option in enumerate(triple["options"]))
+        blocks.append(f"Item {i}\nQuestion: {triple['question']}\nOptions:\n{options}\nCandidate answer: {triple['answer']}")
+    return "\n\n".join(blocks)
+
+
+def option_order(key: str, n_options: int) -> np.ndarray:
+    """Order in which the options of a triple are shown, seeded by its cache key (order[shown] = original)."""
+    return np.random.default_rng(int(key[:16], 16)).permutation(n_options)
+
+
+def parse_verdicts(response: str, n_items: int, n_options: List[int]) -> List[Optional[int]]:
+    """
+    Parse a judge response into option indices (0 = correct answer, NO_MATCH =
+    matches none); items missing from the response are None.
+    """
+    verdicts = [None] * n_items
+    if "[" not in response:
+        return verdicts
+    try:
+        parsed = json.loads(clean_json_str(response[response.find("["):response.rfind("]") + 1]))
+    except (json.JSONDecodeError, ValueError):
+        return verdicts
+    for item in parsed if isinstance(parsed, list) else []:
+        try:
+            i = int(item["id"])
+            option = item["option"]
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not 0 <= i < n_items:
+            continue
+        if isinstance(option, str) and option.strip().lower() == "none":
+            verdicts[i] = NO_MATCH
+            continue
+        try:
+            option = int(option)
+        except (TypeError, ValueError):
+            continue
+        if 1 <= option <= n_options[i]:
+            verdicts[i] = option - 1
+    return verdicts
+
+
+class LLMJudge:
+    def __init__(self, judge_model: str, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 batch_size: int = 20, max_workers: int = 8, max_retries: int = 2, cache_dir: str = CACHE_DIR):
+        """
+        Args:
+            judge_model (str): Model name sent to the endpoint
+            base_url (str): OpenAI-compatible endpoint (default: the OpenAI API)
+            api_key (str): API key (default: $OPENAI_API_KEY, or "EMPTY" for local servers)
+            batch_size (int): Triples packed into one judge call
+            max_workers (int): Concurrent judge calls
+            max_retries (int): Rounds in which unparsed triples are sent again
+            cache_dir (str): Root cache directory
+        """
+        self.client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY", "EMPTY"), base_url=base_url)
+        self.judge_model = judge_model
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.cache_path = os.path.join(cache_dir, "judge", judge_model.replace("/", "_") + ".json")
+        self.verdicts: Dict[str, int] = load_json(self.cache_path, {})
+        self.n_calls = 0
+
+    def key(self, triple: Dict) -> str:
+        return content_hash([self.judge_model, PROMPT_VERSION, triple["question"], triple["options"], triple["answer"]])
+
+    def _judge_batch(self, triples: List[Dict]) -> List[Optional[int]]:
+        try:
+            response = self.client.chat.completions.create(
+                model=self.judge_model,
+                messages=[{"role": "system", "content": SYSTEM_PROMPT},
+                          {"role": "user", "content": format_batch(triples)}],
+                temperature=0
+            )
+            content = response.choices[0].message.content
+        except Exception as e:
+            print(f"Judge call failed: {e}")
+            return [None] * len(triples)
+        return parse_verdicts(content, len(triples), [len(t["options"]) for t in triples])
+
+    def judge(self, triples: List[Dict]) -> List[int]:
+        """
+        Verdicts for a list of {"question", "options", "answer"} triples (options[0]
+        is the correct answer). Only triples not in the cache are sent, once each.
+
+        Returns:
+            list: Option index per triple, NO_MATCH, or UNPARSED if the judge never
+                  returned a usable verdict
+        """
+        keys = [self.key(triple) for triple in triples]
+        # pending triples with their options in the shown order
+        pending, orders = {}, {}
+        for key, triple in zip(keys, triples):
+            if key not in self.verdicts and key not in pending:
+                orders[key] = option_order(key, len(triple["options"]))
+                pending[key] = dict(triple, options=[triple["options"][i] for i in orders[key]])
+
+        for _ in range(self.max_retries + 1):
+            if not pending:
+                break
+            items = list(pending.items())
+            batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._judge_batch, [t for _, t in batch]): batch for batch in batches}
+                for future in tqdm(concurrent.futures.as_completed(futures), total=len(batches)):
+                    self.n_calls += 1
+                    for (key, _), verdict in zip(futures[future], future.result()):
+                        if verdict is not None:
+                            self.verdicts[key] = verdict if verdict == NO_MATCH else int(orders[key][verdict])
+                            pending.pop(key)
+            atomic_write_json(self.cache_path, self.verdicts)
+        return [self.verdicts.get(key, UNPARSED) for key in keys]
+
+
+def collect_triples(table: Dict[str, np.ndarray], question_index: Dict[str, Dict]) -> Tuple[np.ndarray, List[Dict]]:
+    """
+    Judge triples for the freeform rows of a result table.
+
+    Returns:
+        tuple: (rows, triples) where rows are the indices into `table` of the
+               freeform entries with known options and triples the matching
+               {"question", "options", "answer"} dicts
+    """
+    rows, triples = [], []
+    for row in np.nonzero(table["question_type"] == "freeform")[0]:
+        info = question_index.get(table["q_id"][row])
+        entry = table["entry"][row]
+        if info is None or entry["original_result"] == "ERROR":
+            continue
+        rows.append(row)
+        triples.append({"question": entry["question"], "options": info["options"],
+                        "answer": entry["original_result"].split("</think>")[-1].strip()})
+    return np.asarray(rows, dtype=np.int64), triples
+
+
+def judge_agreement(groups: np.ndarray, categories: np.ndarray, judge: np.ndarray, similarity: np.ndarray) -> Dict:
+    """
+    Judge accuracy, similarity accuracy and their agreement per group × category.
+
+    Args:
+        groups, categories (np.ndarray): Group and category of every judged entry
+        judge (np.ndarray): Judge option index per entry (UNPARSED entries are excluded)
+        similarity (np.ndarray): Nearest option by similarity per entry (UNKNOWN_SIMILARITY
+            entries only count towards the judge accuracy)
+
+    Returns:
+        dict: "groups", "categories" and arrays "count", "judge_accuracy",
+              "similarity_count" (entries with similarity scores), "similarity_accuracy",
+              "agreement" (same option) and "correct_agreement" (same correct / wrong call),
+              shape (n_groups, n_categories)
+    """
+    valid = judge != UNPARSED
+    group_levels, g = encode(groups[valid])
+    cat_levels, c = encode(categories[valid])
+    judge, similarity = judge[valid], similarity[valid]
+    dims = (max(len(group_levels), 1), max(len(cat_levels), 1))
+    flat = np.ravel_multi_index((g, c), dims) if len(g) else np.zeros(0, dtype=np.int64)
+    size = int(np.prod(dims))
+
+    known = similarity != UNKNOWN_SIMILARITY
+    count = np.bincount(flat, minlength=size).reshape(dims)
+    similarity_count = np.bincount(flat[known], minlength=size).reshape(dims)
+
+    def rate(values, mask=None):
+        cells, total = (flat, count) if mask is None else (flat[mask], similarity_count)
+        values = values if mask is None else values[mask]
+        return np.bincount(cells, weights=values.astype(np.float64), minlength=size).reshape(dims) / total
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "groups": group_levels, "categories": cat_levels, "count": count,
+            "similarity_count": similarity_count,
+            "judge_accuracy": rate(judge == 0),
+            "similarity_accuracy": rate(similarity == 0, known),
+            "agreement": rate(judge == similarity, known),
+            "correct_agreement": rate((judge == 0) == (similarity == 0), known)
+        }
+
+
+def make_judge_table(result: Dict, field: str) -> PrettyTable:
+    table = PrettyTable()
+    table.field_names = ["model_type"] + result["categories"]
+    count = result["count" if field == "judge_accuracy" else "similarity_count"]
+    for g, group in enumerate(result["groups"]):
+        table.add_row([group] + ["-" if not count[g, c] else "{:.2f}".format(result[field][g, c] * 100)
+                                 for c in range(len(result["categories"]))])
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade TactfulToM freeform answers with an LLM judge")
+    parser.add_argument('--judge_model', type=str, required=True)
+    parser.add_argument('--base_url', type=str, default=None, help="OpenAI-compatible endpoint, e.g. a local server")
+    parser.add_argument('--api_key', type=str, default=None)
+    parser.add_argument('--batch_size', type=int, default=20, help="Answers graded per judge call")
+    parser.add_argument('--max_workers', type=int, default=8)
+    parser.add_argument('--condition', type=str, default="full_context")
+    parser.add_argument('--file_names', type=str, default=None,
+                        help="Comma-separated result file names (default: every file in results/clean)")
+    parser.add_argument('--results_dir', type=str, default=RESULTS_DIR)
+    parser.add_argument('--dataset_dir', type=str, default=DATASET_DIR)
+    parser.add_argument('--similarity', type=str, default="cosine", choices=["cosine", "f1", "combined"],
+                        help="Similarity rule the judge is compared with")
+    parser.add_argument('--by', type=str, default="model", choices=["model", "file_name"])
+    parser.add_argument('--output_dir', type=str, default="cases")
+    args = parser.parse_args()
+
+    file_names = [name.strip() for name in args.file_names.split(",")] if args.file_names else list_result_files(args.results_dir)
+    table = load_result_table(file_names, args.condition, args.results_dir, include_freeform=True)
+    rows, triples = collect_triples(table, load_question_index(args.dataset_dir))
+
+    judge = LLMJudge(args.judge_model, args.base_url, args.api_key, args.batch_size, args.max_workers)
+    verdicts = np.asarray(judge.judge(triples), dtype=np.int64)
+    print(f"{len(triples)} answers, {len({judge.key(t) for t in triples})} unique, {judge.n_calls} judge calls")
+
+    available = set(list_sim_files())
+    sim_table = load_similarity_table([name for name in file_names if name in available], args.condition)
+    assigned = assign_options(sim_table, args.similarity)["assigned"]
+    nearest = {(f, q): int(a) for f, q, a in zip(sim_table["file_name"], sim_table["q_id"], assigned)}
+    similarity = np.array([nearest.get((table["file_name"][row], table["q_id"][row]), UNKNOWN_SIMILARITY)
+                           for row in rows], dtype=np.int64)
+
+    result = judge_agreement(table[args.by][rows], table["category"][rows], verdicts, similarity)
+    for field, title in [("judge_accuracy", "Judge accuracy"), ("similarity_accuracy", f"{args.similarity} accuracy"),
+                         ("correct_agreement", "Judge vs similarity agreement on correctness"),
+                         ("agreement", "Judge vs similarity agreement on the chosen option")]:
+        print(f"{title} (%)")
+        print(make_judge_table(result, field))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    verdict_cases = [{"file_name": table["file_name"][row], "question_id": table["q_id"][row],
+                      "category": table["category"][row], "answer": triple["answer"],
+                      "judge_option": int(verdict),
+                      "similarity_option": None if sim == UNKNOWN_SIMILARITY else int(sim)}
+                     for row, triple, verdict, sim in zip(rows, triples, verdicts, similarity)]
+    with open(os.path.join(args.output_dir, f"judge_{args.condition}.json"), "w") as f:
+        json.dump(verdict_cases, f, indent=3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Compact name-sampling index for conversation generation.
+
+`conv_generation.ipynb` used to download the Kaggle names-by-birth-year CSV
+(one row per name × year × sex), sort the whole frame by Count and slice the
+top 20% in every session before sampling four character names. The `build`
+step of this module reduces the CSV once to a small deduplicated index stored
+in the repository (dataset/names/name_index.npz):
+
+  • one entry per name (case-insensitive), weighted by its total Count over
+    all years; the most frequent `top_fraction` of names is kept
+  • optional attributes (e.g. Sex), stored per name as the level with the
+    largest Count together with the level list
+  • names that would clash with the A/B/C/D character placeholders
+    (single letters) or are not plain names are dropped
+  • a precomputed alias table (Vose's alias method), so each weighted draw is
+    O(1) regardless of the number of names
+
+`NameIndex.sample` draws k distinct names; candidates that equal (or are a
+prefix of) an already drawn or excluded name are rejected, so "Ann" and
+"Anna" are never cast in the same conversation. Until the index is built,
+`load_name_index` falls back to the Kaggle CSV (downloaded with kagglehub, as
+the notebook did) and builds it on first use.
+
+Usage (from the repository root):
+    python code/name_index.py build --csv names_by_birth_year.csv
+    python code/name_index.py build            # downloads the CSV with kagglehub
+    python code/name_index.py sample --k 4 --seed 0
+"""
+
+import argparse
+import csv
+import io
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cache_utils import atomic_write_bytes
+from template_engine import CHARACTER_LETTERS
+
+
+NAME_INDEX_PATH = "dataset/names/name_index.npz"
+KAGGLE_DATASET = "ryanburnsworth/popular-names-by-birth-year-1880-2022"
+KAGGLE_FILE = "names_by_birth_year.csv"
+NAME_PATTERN = re.compile(r"^[A-Z][a-z]+(?:[-'][A-Z]?[a-z]+)*$")
+
+
+def build_alias_table(weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vose's alias table for a weight vector.
+
+    Returns:
+        tuple: (prob, alias); draw column i uniformly, keep i with probability
+               prob[i], otherwise take alias[i]
+    """
+    n = len(weights)
+    prob = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    alias = np.arange(n, dtype=np.int32)
+    small = list(np.flatnonzero(prob < 1.0))
+    large = list(np.flatnonzero(prob >= 1.0))
+    while small and large:
+        s, l = small.pop(), large.pop()
+        alias[s] = l
+        prob[l] -= 1.0 - prob[s]
+        (small if prob[l] < 1.0 else large).append(l)
+    # leftovers are 1 up to rounding error
+    prob[small + large] = 1.0
+    return prob, alias
+
+
+def kaggle_csv_path() -> str:
+    """Download (or reuse the kagglehub copy of) the Kaggle names-by-birth-year CSV."""
+    import kagglehub
+    return os.path.join(kagglehub.dataset_download(KAGGLE_DATASET), KAGGLE_FILE)
+
+
+def is_valid_name(name: str) -> bool:
+    """A plain capitalized name that cannot be mistaken for an A/B/C/D placeholder."""
+    return len(name) > 1 and name not in CHARACTER_LETTERS and bool(NAME_PATTERN.match(name))
+
+
+def build_name_index(csv_path: str, output: str = NAME_INDEX_PATH, top_fraction: float = 0.2,
+                     attributes: Sequence[str] = ("Sex",), name_column: str = "Name",
+                     count_column: str = "Count") -> Dict:
+    """
+    Reduce the names CSV to a deduplicated, weighted index.
+
+    Args:
+        csv_path (str): Kaggle names-by-birth-year CSV
+        output (str): Path of the .npz index
+        top_fraction (float): Fraction of the (deduplicated) names to keep, most frequent first
+        attributes (list): Optional per-name attribute columns; missing columns are skipped
+        name_column (str): Column with the names
+        count_column (str): Column with the counts
+
+    Returns:
+        dict: Build statistics
+    """
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        attributes = [column for column in attributes if column in reader.fieldnames]
+        totals: Dict[str, float] = defaultdict(float)
+        spellings: Dict[Tuple[str, str], float] = defaultdict(float)
+        attribute_counts = {column: defaultdict(float) for column in attributes}
+        n_rows = n_invalid = 0
+        for row in reader:
+            n_rows += 1
+            name = (row[name_column] or "").strip()
+            if not is_valid_name(name) or not row[count_column]:
+                n_invalid += 1
+                continue
+            count = float(row[count_column])
+            key = name.casefold()
+            totals[key] += count
+            spellings[key, name] += count
+            for column in attributes:
+                attribute_counts[column][key, row[column]] += count
+
+    def dominant(counts: Dict[Tuple[str, str], float]) -> Dict[str, str]:
+        """The value with the largest count per name key."""
+        best = {}
+        for (key, value), count in counts.items():
+            if key not in best or count > best[key][1]:
+                best[key] = (value, count)
+        return {key: value for key, (value, _) in best.items()}
+
+    # most frequent names first; ties keep the order of first appearance
+    keys = sorted(totals, key=totals.get, reverse=True)
+    keys = keys[:max(1, int(len(keys) * top_fraction))]
+    # display form: the most frequent spelling of each case-insensitive name
+    display = dominant(spellings)
+    arrays = {
+        "names": np.array([display[key] for key in keys], dtype=str),
+        "weights": np.array([totals[key] for key in keys], dtype=np.float64),
+    }
+    for column in attributes:
+        values = dominant(attribute_counts[column])
+        levels, codes = np.unique(np.array([values[key] for key in keys], dtype=str), return_inverse=True)
+        arrays[f"attr_{column}"] = codes.astype(np.int16)
+        arrays[f"levels_{column}"] = levels
+    arrays["alias_prob"], arrays["alias"] = build_alias_table(arrays["weights"])
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    atomic_write_bytes(output, buffer.getvalue())
+    return {"rows": n_rows, "invalid_rows": n_invalid, "unique_names": len(totals), "kept_names": len(keys),
+            "attributes": attributes, "bytes": len(buffer.getvalue())}
+
+
+class NameIndex:
+    def __init__(self, path: str = NAME_INDEX_PATH):
+        """
+        Args:
+            path (str): Index built by `build_name_index`
+        """
+        with np.load(path) as data:
+            self.names: np.ndarray = data["names"]
+            self.weights: np.ndarray = data["weights"]
+            self.attributes = {name[len("attr_"):]: (data[name], data["levels_" + name[len("attr_"):]])
+                               for name in data.files if name.startswith("attr_")}
+            self._alias_tables = {(): (data["alias_prob"], data["alias"], np.arange(len(self.names)))}
+        self._keys = np.char.lower(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _alias_table(self, filters: Tuple[Tuple[str, str], ...]):
+        """Alias table restricted to the names matching every (attribute, level) filter."""
+        if filters not in self._alias_tables:
+            mask = np.ones(len(self.names), dtype=bool)
+            for attribute, level in filters:
+                codes, levels = self.attributes[attribute]
+                matches = np.flatnonzero(levels == level)
+                mask &= np.isin(codes, matches)
+            members = np.flatnonzero(mask)
+            if not len(members):
+                raise ValueError(f"No names match {dict(filters)}")
+            prob, alias = build_alias_table(self.weights[members])
+            self._alias_tables[filters] = (prob, alias, members)
+        return self._alias_tables[filters]
+
+    def sample(self, k: int = 4, rng: Optional[np.random.Generator] = None, exclude: Iterable[str] = (),
+               weighted: bool = True, max_draws: int = 10000, **filters: str) -> List[str]:
+        """
+        Draw k distinct, mutually non-clashing names.
+
+        Args:
+            k (int): Number of names
+            rng (np.random.Generator): Random generator (default: a fresh one)
+            exclude (iterable): Names that must not be drawn (nor clash with a draw)
+            weighted (bool): Draw proportionally to name frequency; otherwise uniformly
+            max_draws (int): Give up after this many rejected candidates
+            **filters: Attribute levels, e.g. Sex="F"
+
+        Returns:
+            list: k names
+
+        Raises:
+            ValueError: If k names cannot be drawn
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        prob, alias, members = self._alias_table(tuple(sorted(filters.items())))
+        chosen_keys = [name.casefold() for name in exclude]
+        chosen = []
+        for _ in range(max_draws):
+            if len(chosen) == k:
+                return chosen
+            column = rng.integers(len(members))
+            if weighted and rng.random() >= prob[column]:
+                column = alias[column]
+            candidate = members[column]
+            key = self._keys[candidate]
+            if any(key.startswith(other) or other.startswith(key) for other in chosen_keys):
+                continue
+            chosen_keys.append(key)
+            chosen.append(str(self.names[candidate]))
+        if len(chosen) == k:
+            return chosen
+        raise ValueError(f"Could not draw {k} non-clashing names from {len(members)} candidates")
+
+    def sample_characters(self, rng: Optional[np.random.Generator] = None, **kwargs) -> Dict[str, str]:
+        """Names for the A/B/C/D characters (see `template_engine.character_names`)."""
+        return dict(zip(CHARACTER_LETTERS, self.sample(len(CHARACTER_LETTERS), rng, **kwargs)))
+
+
+def load_name_index(path: str = NAME_INDEX_PATH, csv_path: Optional[str] = None, **build_kwargs) -> NameIndex:
+    """
+    Load the name index, building it from the names CSV first if it does not exist yet.
+
+    Args:
+        path (str): Path of the .npz index
+        csv_path (str): Names CSV for the fallback build (default: download with kagglehub)
+        **build_kwargs: Passed to `build_name_index`
+
+    Returns:
+        NameIndex: The loaded index
+    """
+    if not os.path.exists(path):
+        print(f"{path} not found, building it from the names CSV")
+        build_name_index(csv_path or kaggle_csv_path(), path, **build_kwargs)
+    return NameIndex(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or sample the compact character name index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build the index from the Kaggle names CSV")
+    build.add_argument('--csv', type=str, default=None, help=f"Path of {KAGGLE_FILE} (default: download with kagglehub)")
+    build.add_argument('--output', type=str, default=NAME_INDEX_PATH)
+    build.add_argument('--top_fraction', type=float, default=0.2)
+    build.add_argument('--attributes', type=str, default="Sex", help="Comma-separated optional attribute columns")
+
+    sample = subparsers.add_parser("sample", help="Draw character names from the index")
+    sample.add_argument('--index', type=str, default=NAME_INDEX_PATH)
+    sample.add_argument('--k', type=int, default=4)
+    sample.add_argument('--n', type=int, default=1, help="Number of draws")
+    sample.add_argument('--seed', type=int, default=None)
+    sample.add_argument('--uniform', action="store_true", help="Ignore name frequencies")
+    sample.add_argument('--filter', type=str, default=None, help="Attribute filter, e.g. Sex=F")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        csv_path = args.csv or kaggle_csv_path()
+        attributes = [a.strip() for a in args.attributes.split(",") if a.strip()]
+        stats = build_name_index(csv_path, args.output, args.top_fraction, attributes)
+        print(f"Wrote {args.output}: {stats}")
+    else:
+        index = NameIndex(args.index)
+        filters = dict([args.filter.split("=", 1)]) if args.filter else {}
+        rng = np.random.default_rng(args.seed)
+        for _ in range(args.n):
+            print(", ".join(index.sample(args.k, rng, weighted=not args.uniform, **filters)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Near-duplicate detection for conversations and MCQ options.
+
+Two checks, both in roughly linear time in the number of conversations and
+options (no all-pairs comparison):
+
+  • conversations: every full_context is reduced to a set of word shingles
+    (character names replaced by their role, so a renamed copy of a seed
+    story still matches), summarized by a MinHash signature and indexed with
+    banded LSH; only pairs sharing a band bucket are compared, by their exact
+    shingle Jaccard similarity, and pairs above the threshold are merged into
+    duplicate clusters
+  • options: the options of free-text questions (justificationQA by default;
+    template-generated options differ from each other by design) are embedded
+    once through the shared EmbeddingCache and indexed with random-hyperplane
+    (SimHash) LSH; option pairs from different sets that collide in a table
+    and have a cosine similarity above the threshold form duplicate option
+    clusters, and items whose correct answer is within a small cosine margin
+    of one of their distractors are reported as low-margin (ambiguous) items
+
+Usage (from the repository root):
+    python code/near_duplicates.py
+    python code/near_duplicates.py --files dataset/final_set/*.json internal/*.json --skip_embeddings
+"""
+
+import argparse
+import json
+import os
+import re
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from cache_utils import CACHE_DIR
+from embedding_cache import EmbeddingCache
+from generate_questions import FINAL_SET_DIR, SET_PREFIX
+from question_generation_utils import flatten_wrong_answers
+
+
+# prime above 2^32 for the MinHash permutations (a * x + b stays below 2^64)
+MINHASH_PRIME = (1 << 32) + 15
+TOKEN_PATTERN = re.compile(r"<\w+>|\w+")
+
+
+def _union_find_clusters(n: int, pairs: Iterable[Tuple[int, int]], min_size: int = 2) -> List[List[int]]:
+    """Connected components (of at least `min_size` nodes) of the graph given by `pairs`."""
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    groups: Dict[int, List[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return sorted((group for group in groups.values() if len(group) >= min_size), key=lambda group: (-len(group), group))
+
+
+def shingles(text: str, k: int = 3, characters: Optional[Dict[str, str]] = None) -> Set[int]:
+    """
+    Hashed word k-shingles of a text.
+
+    Args:
+        text (str): Conversation text
+        k (int): Words per shingle
+        characters (dict): Role -> name; names are replaced by "<role>" first
+
+    Returns:
+        set: 32-bit hashes of the shingles
+    """
+    text = text.lower()
+    names = {name.lower(): role for role, name in (characters or {}).items() if isinstance(name, str) and name}
+    if names:
+        pattern = re.compile(r"\b(" + "|".join(map(re.escape, sorted(names, key=len, reverse=True))) + r")\b")
+        text = pattern.sub(lambda match: f"<{names[match.group(1)]}>", text)
+    words = TOKEN_PATTERN.findall(text)
+    if len(words) < k:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + k]).encode("utf-8")) for i in range(len(words) - k + 1)}
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class MinHashLSH:
+    def __init__(self, num_perm: int = 120, bands: int = 40, seed: int = 0):
+        """
+        Args:
+            num_perm (int): MinHash signature length
+            bands (int): LSH bands (num_perm must be divisible by it); more
+                bands catch less similar pairs, at the cost of more candidates.
+                A pair of Jaccard similarity s becomes a candidate with
+                probability 1 - (1 - s^r)^bands, r = num_perm / bands
+            seed (int): Seed of the hash permutations
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.num_perm, self.bands, self.rows = num_perm, bands, num_perm // bands
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+
+    def signature(self, shingle_set: Set[int]) -> np.ndarray:
+        """MinHash signature (num_perm uint64 values) of a set of 32-bit shingle hashes."""
+        if not shingle_set:
+            return np.full(self.num_perm, MINHASH_PRIME, dtype=np.uint64)
+        x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))[None, :]
+        return ((self.a * x + self.b) % MINHASH_PRIME).min(axis=1)
+
+    def threshold(self) -> float:
+        """Jaccard similarity at which a pair has a ~50% chance of becoming a candidate."""
+        return (1 / self.bands) ** (1 / self.rows)
+
+    def candidate_pairs(self, signatures: np.ndarray) -> Set[Tuple[int, int]]:
+        """
+        Pairs of rows of a (n, num_perm) signature matrix that share a bucket in any band.
+
+        Returns:
+            set: (i, j) with i < j
+        """
+        pairs = set()
+        for band in range(self.bands):
+            buckets: Dict[bytes, List[int]] = {}
+            block = np.ascontiguousarray(signatures[:, band * self.rows:(band + 1) * self.rows])
+            for i in range(len(block)):
+                buckets.setdefault(block[i].tobytes(), []).append(i)
+            for members in buckets.values():
+                for x in range(len(members)):
+                    for y in range(x + 1, len(members)):
+                        pairs.add((members[x], members[y]))
+        return pairs
+
+
+class SimHashIndex:
+    def __init__(self, dim: int, n_bits: int = 10, n_tables: int = 16, seed: int = 0):
+        """
+        Random-hyperplane LSH for cosine similarity.
+
+        Args:
+            dim (int): Embedding dimension
+            n_bits (int): Hyperplanes (code bits) per table; more bits mean
+                smaller buckets and fewer, closer candidates
+            n_tables (int): Independent tables; more tables mean higher recall
+            seed (int): Seed of the hyperplanes
+        """
+        if n_bits > 62:
+            raise ValueError("n_bits must be at most 62")
+        self.n_bits, self.n_tables = n_bits, n_tables
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((n_tables, dim, n_bits)).astype(np.float32)
+        self.weights = 1 << np.arange(n_bits, dtype=np.int64)
+
+    def recall(self, cosine: float) -> float:
+        """Probability that a pair with this cosine similarity becomes a candidate."""
+        bit_agreement = 1 - np.arccos(np.clip(cosine, -1, 1)) / np.pi
+        return float(1 - (1 - bit_agreement ** self.n_bits) ** self.n_tables)
+
+    def codes(self, embeddings: np.ndarray) -> np.ndarray:
+        """(n_tables, n) bucket codes of the rows of an embedding matrix."""
+        bits = np.einsum("nd,tdb->tnb", embeddings, self.planes) > 0
+        return bits.astype(np.int64) @ self.weights
+
+    def candidate_pairs(self, embeddings: np.ndarray) -> Set[Tuple[int, int]]:
+        """Pairs of rows that share a bucket in any table, as (i, j) with i < j."""
+        pairs = set()
+        for table_codes in self.codes(embeddings):
+            order = np.argsort(table_codes, kind="stable")
+            sorted_codes = table_codes[order]
+            starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+            ends = np.r_[starts[1:], len(order)]
+            for start, end in zip(starts, ends):
+                if end - start < 2:
+                    continue
+                members = np.sort(order[start:end])
+                for x in range(len(members)):
+                    for y in range(x + 1, len(members)):
+                        pairs.add((int(members[x]), int(members[y])))
+        return pairs
+
+
+def load_conversations(files: Sequence[str]) -> List[Dict[str, Any]]:
+    """Entries with a full_context of several final_set (or elements) files, tagged with their file."""
+    conversations = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            if isinstance(entry.get("full_context"), str):
+                conversations.append(dict(entry, _file=path))
+    return conversations
+
+
+def conversation_duplicates(conversations: List[Dict[str, Any]], shingle_size: int = 3, num_perm: int = 120,
+                            bands: int = 40, threshold: float = 0.35, mask_names: bool = True,
+                            seed: int = 0) -> Dict[str, Any]:
+    """
+    Near-duplicate conversation clusters via MinHash LSH.
+
+    Args:
+        conversations (list): Entries with set_id, full_context and characters
+        shingle_size (int): Words per shingle
+        num_perm (int): MinHash signature length
+        bands (int): LSH bands
+        threshold (float): Minimum exact shingle Jaccard similarity of a duplicate pair
+        mask_names (bool): Replace character names by their role before shingling
+        seed (int): Seed of the hash permutations
+
+    Returns:
+        dict: {"n_conversations", "n_candidates", "lsh_threshold",
+               "pairs": [{"set_ids", "files", "jaccard"}], "clusters": [[set_id, ...]]}
+    """
+    lsh = MinHashLSH(num_perm, bands, seed)
+    shingle_sets = [shingles(entry["full_context"], shingle_size, entry.get("characters") if mask_names else None)
+                    for entry in conversations]
+    signatures = np.stack([lsh.signature(shingle_set) for shingle_set in shingle_sets]) if shingle_sets \
+        else np.zeros((0, num_perm), dtype=np.uint64)
+    candidates = lsh.candidate_pairs(signatures)
+
+    pairs = []
+    for i, j in sorted(candidates):
+        similarity = jaccard(shingle_sets[i], shingle_sets[j])
+        if similarity >= threshold:
+            pairs.append((i, j, similarity))
+    pairs.sort(key=lambda pair: -pair[2])
+    return {
+        "n_conversations": len(conversations),
+        "n_candidates": len(candidates),
+        "lsh_threshold": lsh.threshold(),
+        "pairs": [{"set_ids": [conversations[i].get("set_id"), conversations[j].get("set_id")],
+                   "files": [conversations[i]["_file"], conversations[j]["_file"]],
+                   "jaccard": round(similarity, 4)} for i, j, similarity in pairs],
+        "clusters": [[conversations[i].get("set_id") for i in cluster]
+                     for cluster in _union_find_clusters(len(conversations), [(i, j) for i, j, _ in pairs])],
+    }
+
+
+def option_items(conversations: List[Dict[str, Any]], fields: Sequence[str]) -> List[Dict[str, Any]]:
+    """MCQ items (q_id, set_id, correct answer, distractors) of the given question fields."""
+    items = []
+    for entry in conversations:
+        for field in fields:
+            for question in entry.get(field) or []:
+                correct_answer = question.get("correct_answer")
+                wrong_answers = [answer for answer in flatten_wrong_answers(question) if isinstance(answer, str)]
+                if isinstance(correct_answer, str) and wrong_answers:
+                    items.append({"q_id": question.get("q_id"), "set_id": entry.get("set_id"),
+                                  "correct_answer": correct_answer, "wrong_answers": wrong_answers})
+    return items
+
+
+def option_duplicates(items: List[Dict[str, Any]], index: Dict[str, int], embeddings: np.ndarray,
+                      cosine_threshold: float = 0.95, min_margin: float = 0.05, n_bits: int = 10,
+                      n_tables: int = 16, seed: int = 0) -> Dict[str, Any]:
+    """
+    Duplicate option clusters across sets, and low-margin items.
+
+    Args:
+        items (list): Output of `option_items`
+        index (dict): Option text -> row of `embeddings` (see `encode_unique`)
+        embeddings (np.ndarray): L2-normalized option embeddings
+        cosine_threshold (float): Minimum cosine similarity of duplicate options
+        min_margin (float): Items whose correct answer has a cosine similarity
+            above 1 - min_margin to a distractor are low-margin
+        n_bits (int): SimHash bits per table
+        n_tables (int): SimHash tables
+        seed (int): Seed of the hyperplanes
+
+    Returns:
+        dict: {"n_items", "n_options", "n_candidates", "recall" (expected share
+               of the pairs at the threshold that are found), "clusters":
+               [[{"text", "set_ids"}, ...]], "low_margin": [{"q_id", "set_id",
+               "correct_answer", "closest_distractor", "cosine"}]}
+    """
+    # set_ids using each option text
+    owners: Dict[str, Set[str]] = {}
+    for item in items:
+        for text in [item["correct_answer"]] + item["wrong_answers"]:
+            owners.setdefault(text, set()).add(item["set_id"])
+    texts = list(owners)
+    rows = np.fromiter((index[text] for text in texts), dtype=np.int64, count=len(texts))
+
+    clusters, candidates, recall = [], set(), 1.0
+    if len(texts) > 1:
+        matrix = embeddings[rows]
+        simhash = SimHashIndex(matrix.shape[1], n_bits, n_tables, seed)
+        candidates, recall = simhash.candidate_pairs(matrix), simhash.recall(cosine_threshold)
+        # options of a single set are compared by the margin check below
+        pairs = [(i, j) for i, j in candidates
+                 if len(owners[texts[i]] | owners[texts[j]]) > 1 and float(matrix[i] @ matrix[j]) >= cosine_threshold]
+        # a text used by several sets is a duplicate on its own
+        clusters = [[{"text": texts[i], "set_ids": sorted(owners[texts[i]])} for i in cluster]
+                    for cluster in _union_find_clusters(len(texts), pairs, min_size=1)
+                    if len(cluster) > 1 or len(owners[texts[cluster[0]]]) > 1]
+
+    low_margin = []
+    if items:
+        n_wrong = max(len(item["wrong_answers"]) for item in items)
+        correct_rows = np.fromiter((index[item["correct_answer"]] for item in items), dtype=np.int64, count=len(items))
+        wrong_rows = np.zeros((len(items), n_wrong), dtype=np.int64)
+        valid = np.zeros((len(items), n_wrong), dtype=bool)
+        for row, item in enumerate(items):
+            wrong_rows[row, :len(item["wrong_answers"])] = [index[text] for text in item["wrong_answers"]]
+            valid[row, :len(item["wrong_answers"])] = True
+        sims = np.where(valid, np.einsum("nd,nmd->nm", embeddings[correct_rows], embeddings[wrong_rows]), -np.inf)
+        closest = sims.argmax(axis=1)
+        closest_sims = sims[np.arange(len(items)), closest]
+        flagged = np.flatnonzero(closest_sims > 1 - min_margin)
+        for row in flagged[np.argsort(-closest_sims[flagged], kind="stable")]:
+            item = items[row]
+            low_margin.append({"q_id": item["q_id"], "set_id": item["set_id"],
+                               "correct_answer": item["correct_answer"],
+                               "closest_distractor": item["wrong_answers"][closest[row]],
+                               "cosine": round(float(closest_sims[row]), 4)})
+    return {"n_items": len(items), "n_options": len(texts), "n_candidates": len(candidates), "recall": recall,
+            "clusters": clusters, "low_margin": low_margin}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate conversations and options")
+    parser.add_argument('--files', type=str, nargs="+", default=None,
+                        help="final_set (or elements) files (default: all final_set files)")
+    parser.add_argument('--shingle_size', type=int, default=3)
+    parser.add_argument('--num_perm', type=int, default=120)
+    parser.add_argument('--bands', type=int, default=40)
+    parser.add_argument('--jaccard_threshold', type=float, default=0.35,
+                        help="Minimum shingle Jaccard similarity of duplicate conversations")
+    parser.add_argument('--no_mask_names', action="store_true", help="Keep character names when shingling")
+    parser.add_argument('--skip_embeddings', action="store_true", help="Only check conversations")
+    parser.add_argument('--fields', type=str, nargs="+", default=["justificationQA"],
+                        help="Question fields whose options are compared")
+    parser.add_argument('--cosine_threshold', type=float, default=0.95,
+                        help="Minimum cosine similarity of duplicate options")
+    parser.add_argument('--min_margin', type=float, default=0.05,
+                        help="Report items whose correct answer is within this cosine distance of a distractor")
+    parser.add_argument('--n_bits', type=int, default=10)
+    parser.add_argument('--n_tables', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', type=str, default="torch", choices=["torch", "onnx", "onnx-fp32"])
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--no_cache', action="store_true", help="Do not read or write the embedding cache")
+    parser.add_argument('--output_dir', type=str, default="cases")
+    args = parser.parse_args()
+
+    files = args.files or [os.path.join(FINAL_SET_DIR, name) for name in sorted(os.listdir(FINAL_SET_DIR))
+                           if name.startswith(SET_PREFIX) and name.endswith(".json")]
+    conversations = load_conversations(files)
+    report = {"conversations": conversation_duplicates(conversations, args.shingle_size, args.num_perm, args.bands,
+                                                       args.jaccard_threshold, not args.no_mask_names, args.seed)}
+    result = report["conversations"]
+    print(f"{result['n_conversations']} conversations, {result['n_candidates']} LSH candidate pairs "
+          f"(~50% recall at Jaccard {result['lsh_threshold']:.2f}), {len(result['pairs'])} duplicate pairs")
+    for cluster in result["clusters"]:
+        print(f"  duplicate conversations: {', '.join(map(str, cluster))}")
+
+    if not args.skip_embeddings:
+        # the encoder (and sentence-transformers) is only needed here
+        from evaluate_freeform import ENCODER_NAME, encode_unique, encoder_version, load_encoder
+
+        model = load_encoder(args.backend)
+        cache = None if args.no_cache else EmbeddingCache(ENCODER_NAME, encoder_version(model), cache_dir=CACHE_DIR)
+        items = option_items(conversations, args.fields)
+        texts = [text for item in items for text in [item["correct_answer"]] + item["wrong_answers"]]
+        index, embeddings = encode_unique(texts, model, args.batch_size, cache)
+        report["options"] = option_duplicates(items, index, embeddings, args.cosine_threshold, args.min_margin,
+                                              args.n_bits, args.n_tables, args.seed)
+        result = report["options"]
+        print(f"{result['n_items']} items, {result['n_options']} unique options, "
+              f"{result['n_candidates']} SimHash candidate pairs (~{result['recall']:.1%} recall at cosine "
+              f"{args.cosine_threshold})")
+        for cluster in result["clusters"]:
+            print(f"  duplicate options: {' | '.join(option['text'] for option in cluster)}")
+        print(f"{len(result['low_margin'])} low-margin items (cosine > {1 - args.min_margin:.2f})")
+        for item in result["low_margin"]:
+            print(f"  {item['q_id']} ({item['cosine']:.3f}): {item['correct_answer']} ~ {item['closest_distractor']}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "near_duplicates.json"), "w") as f:
+        json.dump(report, f, indent=3)
+
+
+if __name__ == "__main__":
+    main()
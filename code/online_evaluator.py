@@ -0,0 +1,202 @@
+"""
+Online evaluator for TactfulToM inference runs.
+
+`get_original_results.py` streams every LLM response to an `OnlineEvaluator`
+as soon as it arrives. The evaluator cleans and scores the answer with the same
+`_clean` / `score_entry` logic as `evaluate_non_freeform.py`, keeps running
+per-model × category accuracy and parse-failure rates, and flags a model as
+aborted (or paused) once its parse-failure rate crosses a threshold, so that a
+model that misformats its answers is caught after a few dozen calls instead of
+after the whole sweep.
+
+A paused run polls for a sentinel file in `control_dir`: create
+<control_dir>/<file_name>.resume to resume it (the threshold is not applied
+again), or <file_name>.abort to stop it.
+"""
+
+import copy
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from prettytable import PrettyTable
+
+from cache_utils import CACHE_DIR
+from evaluate_non_freeform import _clean, _clean_reasoning, score_entry
+
+
+CONTROL_DIR = os.path.join(CACHE_DIR, "online_eval")
+
+
+class OnlineEvaluator:
+    def __init__(self, max_parse_failure_rate: Optional[float] = None, min_entries: int = 50,
+                 on_threshold: str = "abort", control_dir: str = CONTROL_DIR, poll_interval: float = 5.0):
+        """
+        Args:
+            max_parse_failure_rate (float): Parse-failure rate above which a model is
+                stopped; None disables the check
+            min_entries (int): Number of scorable answers a model needs before the
+                threshold is applied
+            on_threshold (str): "abort" stops the model's run, "pause" blocks it in
+                `wait_if_paused` until `resume` is called or a sentinel file appears
+            control_dir (str): Directory polled for <file_name>.resume / <file_name>.abort
+            poll_interval (float): Seconds between sentinel checks while paused
+        """
+        if on_threshold not in ["abort", "pause"]:
+            raise ValueError(f"Unknown on_threshold '{on_threshold}', expected 'abort' or 'pause'")
+        self.max_parse_failure_rate = max_parse_failure_rate
+        self.min_entries = min_entries
+        self.on_threshold = on_threshold
+        self.control_dir = control_dir
+        self.poll_interval = poll_interval
+        self.stats = {}
+        self.status = {}
+        self._resumed = {}
+        self._lock = threading.Lock()
+
+    def observe(self, file_name: str, category: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Clean and score one answer and update the running statistics.
+
+        Args:
+            file_name (str): Result file name of the run (used for model-specific cleaning)
+            category (str): Question category of the entry
+            entry (dict): Result entry with "original_result" filled in; it is not modified
+
+        Returns:
+            dict: {"clean_result", "score", "parse_failure", "api_error"}
+        """
+        entry = dict(entry)
+        api_error = entry["original_result"] == "ERROR"
+        if api_error:
+            clean_result = "ERROR"
+        else:
+            try:
+                if "QwQ" in file_name or "DeepSeek-R1" in file_name:
+                    clean_result = _clean_reasoning(entry, file_name)
+                else:
+                    clean_result = _clean(entry, file_name)
+            except IndexError:
+                # empty answer to an MCQ question
+                clean_result = "NAN"
+        entry["clean_result"] = clean_result
+
+        parse_failure = clean_result == "NAN"
+        scorable = entry["question_type"] != "freeform" and not api_error
+        score = score_entry(entry) if scorable and not parse_failure else (0 if scorable else None)
+
+        with self._lock:
+            stats = self.stats.setdefault(file_name, {}).setdefault(
+                category, {"n": 0, "scored": 0, "correct": 0, "parse_failures": 0, "api_errors": 0})
+            stats["n"] += 1
+            stats["api_errors"] += int(api_error)
+            if scorable:
+                stats["scored"] += 1
+                stats["correct"] += int(bool(score))
+                stats["parse_failures"] += int(parse_failure)
+            self._check_threshold(file_name)
+
+        return {"clean_result": clean_result, "score": score, "parse_failure": parse_failure, "api_error": api_error}
+
+    def totals(self, file_name: str) -> Dict[str, int]:
+        """Statistics of a run summed over categories."""
+        totals = {"n": 0, "scored": 0, "correct": 0, "parse_failures": 0, "api_errors": 0}
+        for stats in self.stats.get(file_name, {}).values():
+            for k in totals:
+                totals[k] += stats[k]
+        return totals
+
+    def parse_failure_rate(self, file_name: str) -> float:
+        totals = self.totals(file_name)
+        return totals["parse_failures"] / totals["scored"] if totals["scored"] else 0.0
+
+    def _check_threshold(self, file_name: str):
+        if self.max_parse_failure_rate is None or self.status.get(file_name) in ["aborted", "paused", "resumed"]:
+            return
+        if self.totals(file_name)["scored"] < self.min_entries:
+            return
+        rate = self.parse_failure_rate(file_name)
+        if rate > self.max_parse_failure_rate:
+            self.status[file_name] = "aborted" if self.on_threshold == "abort" else "paused"
+            self._resumed[file_name] = threading.Event()
+            print(f"[OnlineEvaluator] {file_name}: parse-failure rate {rate:.2%} > "
+                  f"{self.max_parse_failure_rate:.2%}, {self.status[file_name]}")
+            if self.status[file_name] == "paused":
+                # sentinels left over from an earlier pause must not resume this one
+                os.makedirs(self.control_dir, exist_ok=True)
+                for action in ["resume", "abort"]:
+                    if os.path.exists(self.sentinel_path(file_name, action)):
+                        os.remove(self.sentinel_path(file_name, action))
+                print(f"[OnlineEvaluator] touch {self.sentinel_path(file_name, 'resume')} to resume, "
+                      f"or {self.sentinel_path(file_name, 'abort')} to stop")
+
+    def sentinel_path(self, file_name: str, action: str) -> str:
+        """Path of the file that resumes ("resume") or stops ("abort") a paused run."""
+        return os.path.join(self.control_dir, f"{file_name}.{action}")
+
+    def _poll_sentinels(self, file_name: str):
+        """Apply (and consume) a resume or abort sentinel of a paused run."""
+        for action, apply in [("abort", self.abort), ("resume", self.resume)]:
+            path = self.sentinel_path(file_name, action)
+            if os.path.exists(path):
+                os.remove(path)
+                apply(file_name)
+                return
+
+    def should_stop(self, file_name: str) -> bool:
+        """Whether the run should stop submitting requests (aborted or paused)."""
+        return self.status.get(file_name) in ["aborted", "paused"]
+
+    def is_aborted(self, file_name: str) -> bool:
+        return self.status.get(file_name) == "aborted"
+
+    def wait_if_paused(self, file_name: str, timeout: Optional[float] = None) -> bool:
+        """
+        Block while a run is paused, polling for its sentinel files.
+
+        Returns:
+            bool: True if the run may continue, False if it is aborted or the wait timed out
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self.status.get(file_name) == "paused":
+            self._poll_sentinels(file_name)
+            wait = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+            if wait <= 0 or self._resumed[file_name].wait(wait):
+                break
+        return not self.should_stop(file_name)
+
+    def resume(self, file_name: str):
+        """Resume a paused run; the threshold is not applied to it again."""
+        if self.status.get(file_name) == "paused":
+            self.status[file_name] = "resumed"
+            self._resumed[file_name].set()
+            print(f"[OnlineEvaluator] {file_name}: resumed")
+
+    def abort(self, file_name: str):
+        """Stop a paused run."""
+        if self.status.get(file_name) == "paused":
+            self.status[file_name] = "aborted"
+            self._resumed[file_name].set()
+            print(f"[OnlineEvaluator] {file_name}: aborted")
+
+    def snapshot(self, file_name: str) -> Dict[str, Dict[str, int]]:
+        """Copy of a run's statistics, to `restore` before re-running an interrupted set."""
+        with self._lock:
+            return copy.deepcopy(self.stats.get(file_name, {}))
+
+    def restore(self, file_name: str, snapshot: Dict[str, Dict[str, int]]):
+        """Reset a run's statistics to a `snapshot`, dropping the answers observed since."""
+        with self._lock:
+            self.stats[file_name] = copy.deepcopy(snapshot)
+
+    def make_table(self) -> PrettyTable:
+        table = PrettyTable()
+        table.field_names = ["model_type", "category", "n", "accuracy", "parse_failure", "api_error", "status"]
+        for file_name, categories in self.stats.items():
+            for category, stats in categories.items():
+                accuracy = stats["correct"] / stats["scored"] * 100 if stats["scored"] else 0
+                failure = stats["parse_failures"] / stats["scored"] * 100 if stats["scored"] else 0
+                table.add_row([file_name, category, stats["n"], "{:.2f}".format(accuracy), "{:.2f}".format(failure),
+                               stats["api_errors"], self.status.get(file_name, "running")])
+        return table
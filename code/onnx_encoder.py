@@ -0,0 +1,150 @@
+"""
+Quantized CPU encoder backend for freeform similarity scoring.
+
+Exports a sentence-transformers MiniLM model to ONNX, applies dynamic int8
+quantization to its weights and runs it with onnxruntime on all CPU cores.
+`OnnxEncoder.encode` mirrors `SentenceTransformer.encode` (mean pooling over
+the attention mask, optional L2 normalization), so it can be passed wherever
+`evaluate_freeform.py` expects a model.
+
+`validate_backend` compares a candidate backend with the reference PyTorch
+model on the same items and reports the per-item similarity drift and the
+items whose option ranking changes.
+
+onnxruntime is only needed for this backend:
+    pip install onnxruntime
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+
+ONNX_DIR = "cache/onnx"
+
+
+def onnx_model_path(model_name: str, onnx_dir: str = ONNX_DIR, quantize: bool = True) -> str:
+    suffix = "int8" if quantize else "fp32"
+    return os.path.join(onnx_dir, model_name.replace("/", "_"), f"model-{suffix}.onnx")
+
+
+def export_onnx(model_name: str, onnx_dir: str = ONNX_DIR, quantize: bool = True) -> str:
+    """
+    Export the transformer of a sentence-transformers model to ONNX, optionally
+    with dynamic int8 weight quantization. Existing exports are reused.
+
+    Returns:
+        str: Path of the .onnx file
+    """
+    path = onnx_model_path(model_name, onnx_dir, quantize)
+    if os.path.exists(path):
+        return path
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    hub_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    tokenizer = AutoTokenizer.from_pretrained(hub_name)
+    model = AutoModel.from_pretrained(hub_name).eval()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tokenizer.save_pretrained(os.path.dirname(path))
+
+    fp32_path = onnx_model_path(model_name, onnx_dir, quantize=False)
+    if not os.path.exists(fp32_path):
+        dummy = tokenizer(["a dummy sentence"], return_tensors="pt")
+        inputs = (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"])
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in
+                        ["input_ids", "attention_mask", "token_type_ids", "last_hidden_state"]}
+        with torch.no_grad():
+            torch.onnx.export(model, inputs, fp32_path, input_names=["input_ids", "attention_mask", "token_type_ids"],
+                              output_names=["last_hidden_state"], dynamic_axes=dynamic_axes, opset_version=14)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+    return path
+
+
+class OnnxEncoder:
+    def __init__(self, model_name: str, onnx_dir: str = ONNX_DIR, quantize: bool = True,
+                 num_threads: Optional[int] = None, max_length: int = 256):
+        """
+        Args:
+            model_name (str): sentence-transformers model name (e.g. "all-MiniLM-L6-v2")
+            onnx_dir (str): Directory holding the exported models
+            quantize (bool): Use the int8 quantized model
+            num_threads (int): Intra-op threads (default: all cores)
+            max_length (int): Maximum sequence length, as in the sentence-transformers config
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(model_name, onnx_dir, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(path))
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = max_length
+        self.version = f"onnx-{'int8' if quantize else 'fp32'}"
+
+    def encode(self, sentences: List[str], batch_size: int = 256, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False) -> np.ndarray:
+        """Mean-pooled sentence embeddings, same interface as `SentenceTransformer.encode`."""
+        # sort by length so that batches are padded as little as possible
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        embeddings = np.zeros((len(sentences), 0), dtype=np.float32)
+        batches = range(0, len(sentences), batch_size)
+        for start in tqdm(batches, disable=not show_progress_bar):
+            rows = order[start:start + batch_size]
+            tokens = self.tokenizer([sentences[i] for i in rows], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            feed = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if not embeddings.shape[1]:
+                embeddings = np.zeros((len(sentences), pooled.shape[1]), dtype=np.float32)
+            embeddings[rows] = pooled
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+
+def validate_backend(reference: List[List[float]], candidate: List[List[float]]) -> Dict:
+    """
+    Compare the similarities of a candidate backend with the reference backend.
+
+    Args:
+        reference (list): Per-item option similarities from the reference backend
+        candidate (list): Per-item option similarities from the candidate backend
+
+    Returns:
+        dict: Drift statistics ("mean_abs_drift", "max_abs_drift", "p99_abs_drift"),
+              "top1_changed" (items whose nearest option changes), "pair_flips"
+              (fraction of option pairs whose order flips) and "changed_items"
+              (indices of the items whose nearest option changes)
+    """
+    drifts, flips, pairs, changed = [], 0, 0, []
+    for item, (ref, cand) in enumerate(zip(reference, candidate)):
+        ref, cand = np.asarray(ref), np.asarray(cand)
+        drifts.append(np.abs(ref - cand))
+        if np.argmax(ref) != np.argmax(cand):
+            changed.append(item)
+        upper = np.triu_indices(len(ref), k=1)
+        ref_order = np.sign(ref[:, None] - ref[None, :])[upper]
+        cand_order = np.sign(cand[:, None] - cand[None, :])[upper]
+        flips += int((ref_order != cand_order).sum())
+        pairs += len(ref_order)
+    drifts = np.concatenate(drifts) if drifts else np.zeros(0)
+    return {
+        "n_items": len(reference),
+        "mean_abs_drift": float(drifts.mean()) if len(drifts) else 0.0,
+        "p99_abs_drift": float(np.percentile(drifts, 99)) if len(drifts) else 0.0,
+        "max_abs_drift": float(drifts.max()) if len(drifts) else 0.0,
+        "top1_changed": len(changed),
+        "pair_flips": flips / pairs if pairs else 0.0,
+        "changed_items": changed
+    }
@@ -0,0 +1,175 @@
+"""
+Aho-Corasick multi-pattern matcher.
+
+All patterns are compiled into one automaton, so a text is scanned once
+whatever the number of patterns:
+
+  • matching is case-insensitive by default; text and patterns are lowercased
+    per character, so match offsets are offsets in the original text
+  • transitions (including failure links) are memoized per state on first
+    use, so each character of a scan costs one dict lookup
+  • `finditer` yields every match, `find` the leftmost-longest
+    non-overlapping ones, optionally restricted to a subset of pattern ids,
+    and `replace` substitutes them in one pass
+"""
+
+from typing import Callable, Container, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+Match = Tuple[int, int, int]  # (start, end, pattern id)
+
+
+class PatternMatcher:
+    def __init__(self, patterns: Iterable[str] = (), case_sensitive: bool = False):
+        """
+        Args:
+            patterns (iterable): Literal patterns (ids are assigned in order)
+            case_sensitive (bool): Match case-sensitively
+        """
+        self.case_sensitive = case_sensitive
+        self.patterns: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._lengths: List[int] = []
+        self._trie: List[Dict[str, int]] = [{}]
+        self._terminal: List[Optional[int]] = [None]
+        self._delta: List[Dict[str, int]] = []
+        self._fail: List[int] = []
+        self._out: List[Tuple[int, ...]] = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def fold(self, text: str) -> str:
+        """The form of a text the automaton is run on (same length as the text)."""
+        if self.case_sensitive:
+            return text
+        folded = text.lower()
+        if len(folded) == len(text):
+            return folded
+        # a few characters (e.g. "İ") lowercase to several; keep those as they are
+        return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+    def add(self, pattern: str) -> int:
+        """
+        Add a pattern.
+
+        Returns:
+            int: Pattern id (the id of the existing pattern if it folds to the same text)
+        """
+        if not pattern:
+            raise ValueError("Empty pattern")
+        key = self.fold(pattern)
+        if key in self._ids:
+            return self._ids[key]
+        pattern_id = len(self.patterns)
+        self.patterns.append(pattern)
+        self._ids[key] = pattern_id
+        self._lengths.append(len(key))
+        state = 0
+        for char in key:
+            if char not in self._trie[state]:
+                self._trie[state][char] = len(self._trie)
+                self._trie.append({})
+                self._terminal.append(None)
+            state = self._trie[state][char]
+        self._terminal[state] = pattern_id
+        # failure links are (re)built on the next scan
+        self._delta = []
+        return pattern_id
+
+    def pattern_id(self, pattern: str) -> Optional[int]:
+        return self._ids.get(self.fold(pattern))
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _build(self):
+        """Failure links and output sets, breadth-first over the trie."""
+        n = len(self._trie)
+        self._fail = [0] * n
+        self._out = [()] * n
+        order = list(self._trie[0].values())
+        for state in order:
+            terminal = self._terminal[state]
+            self._out[state] = (terminal,) if terminal is not None else ()
+        i = 0
+        while i < len(order):
+            state = order[i]
+            i += 1
+            for char, child in self._trie[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._trie[fallback]:
+                    fallback = self._fail[fallback]
+                fail = self._trie[fallback].get(char, 0)
+                self._fail[child] = fail if fail != child else 0
+                terminal = self._terminal[child]
+                self._out[child] = ((terminal,) if terminal is not None else ()) + self._out[self._fail[child]]
+                order.append(child)
+        self._delta = [dict(edges) for edges in self._trie]
+
+    def _step(self, state: int, char: str) -> int:
+        """Transition for a character not yet memoized in `_delta[state]`."""
+        origin = state
+        while state and char not in self._trie[state]:
+            state = self._fail[state]
+        target = self._trie[state].get(char, 0)
+        self._delta[origin][char] = target
+        return target
+
+    def finditer(self, text: str) -> Iterator[Match]:
+        """Every match in the text, by end offset."""
+        if not self._delta:
+            self._build()
+        delta, out, lengths, step = self._delta, self._out, self._lengths, self._step
+        state = 0
+        for end, char in enumerate(self.fold(text), 1):
+            target = delta[state].get(char)
+            state = step(state, char) if target is None else target
+            if out[state]:
+                for pattern_id in out[state]:
+                    yield end - lengths[pattern_id], end, pattern_id
+
+    def find(self, text: str, allowed: Optional[Container[int]] = None) -> List[Match]:
+        """
+        Leftmost-longest non-overlapping matches.
+
+        Args:
+            text (str): Text to scan
+            allowed (container): Only consider these pattern ids (default: all)
+
+        Returns:
+            list: (start, end, pattern id) in text order
+        """
+        matches = [match for match in self.finditer(text) if allowed is None or match[2] in allowed]
+        if len(matches) < 2:
+            return matches
+        matches.sort(key=lambda match: (match[0], -match[1]))
+        selected, position = [], 0
+        for match in matches:
+            if match[0] >= position:
+                selected.append(match)
+                position = match[1]
+        return selected
+
+    def replace(self, text: str, replacement: Callable[[int], str],
+                allowed: Optional[Container[int]] = None) -> Tuple[str, List[Match]]:
+        """
+        Replace the leftmost-longest matches.
+
+        Args:
+            text (str): Text to rewrite
+            replacement (callable): Pattern id -> replacement text
+            allowed (container): Only replace these pattern ids (default: all)
+
+        Returns:
+            tuple: (new text, matches replaced)
+        """
+        matches = self.find(text, allowed)
+        if not matches:
+            return text, matches
+        parts, position = [], 0
+        for start, end, pattern_id in matches:
+            parts.append(text[position:start])
+            parts.append(replacement(pattern_id))
+            position = end
+        parts.append(text[position:])
+        return "".join(parts), matches
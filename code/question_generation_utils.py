@@ -9,9 +9,15 @@ justification, fact-based, belief, and various ToM-related questions.
 import json
 import random
 import os
+import re
+from functools import lru_cache
 from typing import Dict, List, Any, Optional
 
 
+JUSTIFICATION_OPTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         "..", "dataset", "justification_options")
+
+
 def load_justification_options(file_path: str) -> dict:
     """
     Load justification options file and organize it into a flat dictionary
@@ -45,6 +51,194 @@ def load_justification_options(file_path: str) -> dict:
     raise ValueError("Unsupported JSON structure in justification-options file.")
 
 
+@lru_cache(maxsize=None)
+def load_justification_index(options_dir: str = JUSTIFICATION_OPTIONS_DIR) -> dict:
+    """
+    Load every justification options file in a directory once and merge them
+    into a single {set_id: option_dict} index.
+    
+    Args:
+        options_dir (str): Directory with the justification_option_*.json files
+        
+    Returns:
+        dict: Merged dictionary with set_id as keys (shared between calls; do not modify)
+        
+    Raises:
+        ValueError: If two files hold different options for the same set_id
+    """
+    merged = {}
+    for file_name in sorted(os.listdir(options_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        for set_id, options in load_justification_options(os.path.join(options_dir, file_name)).items():
+            if set_id in merged and merged[set_id] != options:
+                raise ValueError(f"Conflicting justification options for set_id '{set_id}' in {file_name}")
+            merged[set_id] = options
+    return merged
+
+
+# Distractor types of the justification wrong answers, in the Type-1/2/3 order
+# requested by justification_option_generator.py
+JUSTIFICATION_DISTRACTOR_TYPES = ["literal_reason", "negative_feeling", "random_excuse"]
+
+_STANCE = r"(?P<{}>believes that|believe that|believes|believe|is unaware that|is unaware)"
+
+
+def flatten_wrong_answers(question: Dict[str, Any]) -> List[str]:
+    """
+    Return the wrong answers of a question as a flat list of strings.
+
+    Older sets store "wrong_answers" instead of "wrong_answer", a single string
+    instead of a list, or a list nested inside a list.
+    """
+    wrong_answer_list = question.get("wrong_answer", question.get("wrong_answers"))
+    if wrong_answer_list is None:
+        return []
+    if not isinstance(wrong_answer_list, list):
+        wrong_answer_list = [wrong_answer_list]
+    while wrong_answer_list and isinstance(wrong_answer_list[0], list):
+        wrong_answer_list = wrong_answer_list[0]
+    return wrong_answer_list
+
+
+def _stance(text: str) -> str:
+    return "unaware" if "unaware" in text else "believes"
+
+
+def _name_pattern(characters: Dict[str, str]) -> str:
+    names = sorted({name for name in characters.values() if name}, key=len, reverse=True)
+    return "|".join(re.escape(name) for name in names)
+
+
+def _mentioned_roles(text: str, characters: Dict[str, str]) -> frozenset:
+    """Roles whose character name occurs as a word in text."""
+    return frozenset(role for role, name in characters.items()
+                     if name and re.search(rf"\b{re.escape(name)}\b", text))
+
+
+def _set_relation(option_roles: frozenset, correct_roles: frozenset) -> str:
+    if option_roles == correct_roles:
+        return "same_characters"
+    if option_roles < correct_roles:
+        return "subset"
+    if option_roles > correct_roles:
+        return "superset"
+    if option_roles & correct_roles:
+        return "partial_overlap"
+    return "disjoint"
+
+
+def _parse_fact(text: str, characters: Dict[str, str]) -> Optional[frozenset]:
+    participants = text.split(" talked about that")[0]
+    return _mentioned_roles(participants, characters) if participants != text else None
+
+
+def _parse_first_order(text: str, characters: Dict[str, str]) -> Optional[tuple]:
+    names = _name_pattern(characters)
+    match = re.match(rf"(?P<a>{names}) {_STANCE.format('s1')} (?P<participants>.*?) discussed", text)
+    if not match:
+        return None
+    return _stance(match.group("s1")), _mentioned_roles(match.group("participants"), characters)
+
+
+def _parse_chain(text: str, characters: Dict[str, str]) -> Optional[tuple]:
+    # second-order beliefs may be framed as "The text provides no information ... it can be stated that X ..."
+    # and lieability options as "X tell Y that '<lie>' because X believes that Y ..."
+    if "it can be stated that " in text:
+        text = text.split("it can be stated that ", 1)[1]
+    elif "' because " in text:
+        text = text.rsplit("' because ", 1)[1]
+    names = _name_pattern(characters)
+    match = re.match(rf"(?P<a>{names}) {_STANCE.format('s1')} (?P<b>{names})(?:'s belief)? {_STANCE.format('s2')}", text)
+    if not match:
+        return None
+    return match.group("a"), _stance(match.group("s1")), match.group("b"), _stance(match.group("s2"))
+
+
+def classify_distractor(option: str, correct_answer: str, characters: Dict[str, str],
+                        question_type: str, tom_type: Optional[str] = None) -> str:
+    """
+    Classify a wrong option by how it deviates from the correct answer.
+
+    Types by question family:
+      • fact:      relation of the named participants to the correct ones
+                   ("subset", "superset", "partial_overlap", "disjoint")
+      • 1st-order: "{same|flipped}_stance:{participant relation}"
+      • 2nd-order / lieability: which level of the belief chain is flipped
+                   ("outer_flipped", "inner_flipped", "both_flipped"), with
+                   ":wrong_character" appended if the chain names other characters, or
+                   "no_information" for truncated "X is unaware that Y's belief" options
+
+    Args:
+        option (str): Wrong option text
+        correct_answer (str): Correct option text
+        characters (dict): {"liar": name, "target": name, "accomplice": name, "observer": name}
+        question_type (str): Dataset question_type, e.g. "tom:belief:accessible:reason"
+        tom_type (str): Dataset tom_type for belief questions, e.g. "first-order:A"
+
+    Returns:
+        str: Distractor type, or "unparsed" if the option does not follow a known template
+    """
+    if question_type.startswith("fact"):
+        option_roles, correct_roles = _parse_fact(option, characters), _parse_fact(correct_answer, characters)
+        if option_roles is None or correct_roles is None:
+            return "unparsed"
+        return _set_relation(option_roles, correct_roles)
+
+    if question_type.startswith("tom:belief") and (tom_type or "").startswith("first-order"):
+        parsed_option, parsed_correct = _parse_first_order(option, characters), _parse_first_order(correct_answer, characters)
+        if parsed_option is None or parsed_correct is None:
+            return "unparsed"
+        stance = "same_stance" if parsed_option[0] == parsed_correct[0] else "flipped_stance"
+        return f"{stance}:{_set_relation(parsed_option[1], parsed_correct[1])}"
+
+    if question_type.startswith("tom:belief") or question_type.startswith("tom:lieability"):
+        parsed_option, parsed_correct = _parse_chain(option, characters), _parse_chain(correct_answer, characters)
+        if parsed_option is None and option.endswith("'s belief regarding that."):
+            # truncated "X is unaware that Y's belief regarding that." options in some second-order sets
+            return "no_information"
+        if parsed_option is None or parsed_correct is None:
+            return "unparsed"
+        outer, inner = parsed_option[1] != parsed_correct[1], parsed_option[3] != parsed_correct[3]
+        if outer and inner:
+            distractor_type = "both_flipped"
+        elif outer:
+            distractor_type = "outer_flipped"
+        elif inner:
+            distractor_type = "inner_flipped"
+        else:
+            distractor_type = "same_stance"
+        if (parsed_option[0], parsed_option[2]) != (parsed_correct[0], parsed_correct[2]):
+            distractor_type += ":wrong_character"
+        return distractor_type
+
+    return "unparsed"
+
+
+def annotate_distractor_types(qa: Dict[str, Any], characters: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Record the distractor type of every wrong answer of an MCQ question in
+    qa["wrong_answer_types"] (same order as the flattened wrong answers).
+
+    Args:
+        qa (dict): Generated question with "question_type", "correct_answer" and "wrong_answer"
+        characters (dict): Role -> name mapping of the conversation
+
+    Returns:
+        dict: The same question dict
+    """
+    wrong_answers = flatten_wrong_answers(qa)
+    if qa["question_type"].startswith("justification"):
+        types = JUSTIFICATION_DISTRACTOR_TYPES[:len(wrong_answers)]
+        types += ["unparsed"] * (len(wrong_answers) - len(types))
+    else:
+        types = [classify_distractor(option, qa["correct_answer"], characters,
+                                     qa["question_type"], qa.get("tom_type"))
+                 for option in wrong_answers]
+    qa["wrong_answer_types"] = types
+    return qa
+
+
 def generate_comprehensionQA(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
     """
     Generate comprehension questions based on the conversation data.
@@ -76,22 +270,23 @@ def generate_comprehensionQA(data: Dict[str, Any]) -> Dict[str, List[Dict[str, A
     return {"comprehensionQA": [comprehension_qa]}
 
 
-def generate_justificationQA(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+def generate_justificationQA(data: Dict[str, Any],
+                             options_map: Optional[dict] = None) -> Dict[str, List[Dict[str, Any]]]:
     """
     Generate justification questions asking why characters told lies.
     
     Args:
         data (dict): Conversation data containing characters, lie info, and set_id
+        options_map (dict): {set_id: option_dict} index; defaults to the merged
+            index of dataset/justification_options (see `load_justification_index`)
         
     Returns:
         dict: Dictionary with "justificationQA" key containing list of questions
     """
     set_id = data["set_id"]
     
-    # Load justification options - you may need to adjust this path
-    options_map = load_justification_options(
-        f"/Users/liuyiwei/python/tactful-tom/dataset/justification_options/justification_option_4.json"
-    )
+    if options_map is None:
+        options_map = load_justification_index()
 
     options = options_map.get(set_id)
     if options is None:
@@ -124,6 +319,9 @@ def generate_justificationQA(data: Dict[str, Any]) -> Dict[str, List[Dict[str, A
         }
     ]
 
+    for qa in justification_qas:
+        annotate_distractor_types(qa, data["characters"])
+
     return {"justificationQA": justification_qas}
 
 
@@ -190,6 +388,10 @@ def generate_fact_QA(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
             "wrong_answer": random_wrong_answer_truth
         }
 
+    annotate_distractor_types(reason_qa, data["characters"])
+    if truth_qa:
+        annotate_distractor_types(truth_qa, data["characters"])
+
     return {"fact_reasonQA": [reason_qa], "fact_truthQA": [truth_qa] if truth_qa else []}
 
 
@@ -323,6 +525,9 @@ def generate_1stbeliefQAs(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]
         # (Implementation similar to real_reason but for truth)
         pass
 
+    for qa in belief_qas:
+        annotate_distractor_types(qa, data["characters"])
+
     return {"beliefQAs": belief_qas}
 
 
@@ -406,6 +611,9 @@ def generate_2ndbeliefQAs(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]
         "real_reason_accessibility": "accessible"
     })
 
+    for qa in belief_qas:
+        annotate_distractor_types(qa, data["characters"])
+
     return {"beliefQAs": belief_qas}
 
 
@@ -653,6 +861,9 @@ def generate_lieabilityQAs(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any
             ],
         })
 
+    for qa in lieability:
+        annotate_distractor_types(qa, data["characters"])
+
     return {"lieabilityQAs": lieability}
 
 
@@ -754,3 +965,55 @@ def assign_question_ids(new_entry: Dict[str, Any], set_id: str) -> Dict[str, Any
             q_dict["q_id"] = f"{set_id}-lieability-{i}"
 
     return new_entry
+
+
+def generate_all_questions(selected_set: Dict[str, Any], options_map: Optional[dict] = None,
+                           verbose: bool = True) -> Dict[str, Any]:
+    """
+    Generate all types of questions for a given dataset item.
+    
+    Args:
+        selected_set (dict): A single item from the dataset
+        options_map (dict): Justification options index (see `generate_justificationQA`)
+        verbose (bool): Print the set being processed
+        
+    Returns:
+        dict: Combined dictionary with all question types
+    """
+    selected_set_id = selected_set.get("set_id", "unknown")
+    if verbose:
+        print(f"Processing set: {selected_set_id}")
+
+    # Generate all question types
+    comprehension_qas = generate_comprehensionQA(selected_set)
+    justification_qas = generate_justificationQA(selected_set, options_map)
+    fact_qas = generate_fact_QA(selected_set)
+    
+    # Generate and merge belief questions
+    belief_qas_1 = generate_1stbeliefQAs(selected_set)
+    belief_qas_2 = generate_2ndbeliefQAs(selected_set)
+    belief_qas = merge_beliefQAs(belief_qas_1, belief_qas_2)
+
+    # Generate ToM-related questions
+    info_accessibility_qas = generate_infoAccessibilityQAs(selected_set)
+    answerability_qas = generate_answerabilityQAs(selected_set)
+    liedetectability_qas = generate_liedetectabilityQAs(selected_set)
+    lieability_qas = generate_lieabilityQAs(selected_set)
+
+    # Combine all questions into a single dictionary
+    combined_entry = {
+        "set_id": selected_set_id,
+        **comprehension_qas,
+        **justification_qas,
+        **fact_qas,
+        **belief_qas,
+        **info_accessibility_qas,
+        **answerability_qas,
+        **liedetectability_qas,
+        **lieability_qas
+    }
+
+    # Assign unique question IDs
+    combined_entry = assign_question_ids(combined_entry, selected_set_id)
+    
+    return combined_entry
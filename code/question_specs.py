@@ -0,0 +1,557 @@
+"""
+Declarative question-family specs and a compiled batch question generator.
+
+The question families of `question_generation_utils.py` are written down here
+as data instead of code:
+
+  • QUESTION_FIELDS: the output fields of a set, in order, with their q_id prefixes
+  • QUESTION_SPECS: one entry per question (MCQ) or per list/binary group
+      - MCQ specs map every output key to a {{placeholder}} template; the
+        wrong answers are a list of slots (a template, or {"choice": [...]} to
+        draw one template of a pool), {"sample": [...], "k": n} to draw n
+        templates of a pool, or {"variable": name} for a list-valued variable
+      - list/binary specs ("kind": "access") name the roles that know the
+        information; the list question lists them, and one binary question
+        per character asks about each of them
+      - "when" restricts a spec to scenarios matching a named CONDITION
+
+`QuestionGenerator` compiles the specs once: every template is parsed by
+`template_engine.compile_template`, and the distractor type of every wrong
+answer template is classified once against its correct answer, so a scenario
+only renders the templates it draws and looks its types up. Pools are drawn
+with the same `random` calls as the hand-written generators, so for the same
+seed `generate` returns exactly the entry of `generate_all_questions`.
+
+A new question family is a new entry in QUESTION_SPECS (and, for a new output
+field, in QUESTION_FIELDS).
+"""
+
+import random
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from question_generation_utils import (JUSTIFICATION_DISTRACTOR_TYPES, classify_distractor,
+                                       flatten_wrong_answers, load_justification_index)
+from template_engine import CompiledTemplate, compile_template
+
+
+ROLES = ["liar", "target", "accomplice", "observer"]
+
+# output field -> q_id prefix, in the order of the generated entry
+QUESTION_FIELDS = [
+    ("comprehensionQA", "comprehension"),
+    ("justificationQA", "justification"),
+    ("fact_reasonQA", "fact_reason"),
+    ("fact_truthQA", "fact_truth"),
+    ("beliefQAs", "belief"),
+    ("infoAccessibilityQA_list", "info_access_list"),
+    ("infoAccessibilityQAs_binary", "info_access_binary"),
+    ("answerabilityQA_list", "answerability_list"),
+    ("answerabilityQAs_binary", "answerability_binary"),
+    ("liedetectabilityQAs_list", "liedetect_list"),
+    ("liedetectabilityQAs_binary", "liedetect_binary"),
+    ("lieabilityQAs", "lieability"),
+]
+
+CONDITIONS: Dict[str, Callable[[Dict[str, Any]], bool]] = {
+    "truth": lambda data: data["truth_id"] == 1,
+    "multiple_liar": lambda data: data.get("multiple_liar") is True,
+    "single_liar": lambda data: data.get("multiple_liar") is not True,
+}
+
+# string variables available to templates (see `scenario_variables`)
+SCENARIO_VARIABLES = tuple(ROLES) + ("liars", "real_reason", "truth", "truth_stripped", "lie",
+                                     "real_reason_question", "truth_question", "comprehension_q",
+                                     "justification_correct")
+# list-valued variables for {"variable": name} wrong answers
+LIST_VARIABLES = ("justification_wrong_answers",)
+
+_FIRST_ORDER_REASON = "{{real_reason}}."
+_NO_INFO = "The text provides no information on what {{%s}} believes about {{%s}}'s belief regarding that. Therefore, it can be stated that "
+
+QUESTION_SPECS: List[Dict[str, Any]] = [
+    # comprehension
+    {"field": "comprehensionQA", "annotate": False, "fields": {
+        "question": "Was what {{liars}} told {{target}}, '{{lie}}', true?",
+        "question_type": "comprehension",
+        "correct_answer": "No",
+        "wrong_answer": "Yes",
+    }},
+
+    # justification (options from dataset/justification_options)
+    {"field": "justificationQA", "when": "multiple_liar", "fields": {
+        "question": "Why did {{liars}} tell {{target}} '{{lie}}'?",
+        "question_type": "justification:liar",
+        "correct_answer": "{{justification_correct}}",
+        "wrong_answer": {"variable": "justification_wrong_answers"},
+    }},
+    {"field": "justificationQA", "when": "single_liar", "fields": {
+        "question": "Why did {{liars}} tell {{target}} '{{lie}}'?",
+        "question_type": "justification:liar:accompliance",
+        "correct_answer": "{{justification_correct}}",
+        "wrong_answer": {"variable": "justification_wrong_answers"},
+    }},
+
+    # fact
+    {"field": "fact_reasonQA", "fields": {
+        "question": "Who discussed '{{real_reason}}'?",
+        "question_type": "fact:real_reason",
+        "correct_answer": "{{liar}} and {{accomplice}} talked about that.",
+        "wrong_answer": {"sample": [
+            "{{accomplice}} and {{target}} talked about that.",
+            "{{observer}} and {{liar}} talked about that.",
+            "{{observer}} and {{accomplice}} talked about that.",
+            "{{target}} and {{liar}} talked about that.",
+            "{{target}}, {{accomplice}} and {{liar}} talked about that.",
+            "{{liar}}, {{observer}} and {{accomplice}} talked about that.",
+        ], "k": 3},
+    }},
+    {"field": "fact_truthQA", "when": "truth", "fields": {
+        "question": "Who discussed '{{truth_stripped}}'?",
+        "question_type": "fact:truth",
+        "correct_answer": "{{liar}}, {{observer}} and {{accomplice}} talked about that.",
+        "wrong_answer": {"sample": [
+            "{{observer}}, {{accomplice}} and {{target}} talked about that.",
+            "{{observer}}, {{target}} and {{liar}} talked about that.",
+            "{{target}}, {{accomplice}} and {{liar}} talked about that.",
+            "{{liar}} and {{accomplice}} talked about that",
+            "{{observer}} and {{liar}} talked about that",
+            "{{observer}} and {{accomplice}} talked about that",
+        ], "k": 3},
+    }},
+
+    # first-order beliefs about the real reason
+    {"field": "beliefQAs", "fields": {
+        "question": "What does {{liar}} believe about '{{real_reason_question}}'?",
+        "question_type": "tom:belief:accessible:reason",
+        "tom_type": "first-order:A",
+        "correct_answer": "{{liar}} believes that {{accomplice}} discussed " + _FIRST_ORDER_REASON,
+        "wrong_answer": [
+            {"choice": [
+                "{{liar}} is unaware that {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{liar}} is unaware that {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{liar}} is unaware that {{observer}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+            {"choice": [
+                "{{liar}} believes that {{accomplice}} and {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{liar}} believes that {{accomplice}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{liar}} believes that {{observer}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+            {"choice": [
+                "{{liar}} believes that {{accomplice}}, {{observer}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{liar}} believes that {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{liar}} believes that {{target}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+        ],
+        "real_reason_accessibility": "accessible",
+    }},
+    {"field": "beliefQAs", "fields": {
+        "question": "What does {{target}} believe about '{{real_reason_question}}'?",
+        "question_type": "tom:belief:inaccessible:reason",
+        "tom_type": "first-order:B",
+        "correct_answer": "{{target}} is unaware that {{liar}} and {{accomplice}} discussed " + _FIRST_ORDER_REASON,
+        "wrong_answer": [
+            {"choice": [
+                "{{target}} is unaware that {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{target}} is unaware that {{liar}} and {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{target}} is unaware that {{accomplice}} and {{observer}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+            {"choice": [
+                "{{target}} believes that {{liar}} and {{accomplice}} discussed " + _FIRST_ORDER_REASON,
+                "{{target}} believes that {{liar}} discussed " + _FIRST_ORDER_REASON,
+                "{{target}} believes that {{accomplice}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+            {"choice": [
+                "{{target}} believes that {{accomplice}}, {{liar}} and {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{target}} believes that {{accomplice}} and {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{target}} believes that {{observer}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+        ],
+        "real_reason_accessibility": "inaccessible",
+    }},
+    {"field": "beliefQAs", "fields": {
+        "question": "What does {{accomplice}} believe about '{{real_reason_question}}'?",
+        "question_type": "tom:belief:accessible:reason",
+        "tom_type": "first-order:C",
+        "correct_answer": "{{accomplice}} believes that {{liar}} discussed " + _FIRST_ORDER_REASON,
+        "wrong_answer": [
+            {"choice": [
+                "{{accomplice}} believes that {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} believes that {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} believes that {{observer}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} believes that {{observer}} and {{liar}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} believes that {{liar}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} believes that {{liar}}, {{observer}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+            "{{accomplice}} is unaware that {{liar}} discussed " + _FIRST_ORDER_REASON,
+            {"choice": [
+                "{{accomplice}} is unaware that {{observer}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} is unaware that {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} is unaware that {{observer}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} is unaware that {{observer}} and {{liar}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} is unaware that {{liar}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+                "{{accomplice}} is unaware that {{liar}}, {{observer}} and {{target}} discussed " + _FIRST_ORDER_REASON,
+            ]},
+        ],
+        "real_reason_accessibility": "accessible",
+    }},
+
+    # second-order beliefs about the real reason
+    {"field": "beliefQAs", "fields": {
+        "question": "What does {{target}} believe about {{observer}}'s belief regarding '{{real_reason_question}}'?",
+        "question_type": "tom:belief:inaccessible:reason",
+        "tom_type": "second-order:BD",
+        "correct_answer": _NO_INFO % ("target", "observer") + "{{target}} is unaware that {{observer}} is unaware that {{real_reason}}.",
+        "wrong_answer": [
+            _NO_INFO % ("target", "observer") + "{{target}} is unaware that {{observer}} believes that {{real_reason}}.",
+            "{{target}} believes that {{observer}} is unaware that {{real_reason}}, because {{observer}} was not involved in the conversation when this was discussed.",
+            "{{target}} believes that {{observer}} believes that {{real_reason}}.",
+        ],
+        "missed_info_accessibility": "inaccessible",
+    }},
+    {"field": "beliefQAs", "fields": {
+        "question": "What does {{accomplice}} believe about {{liar}}'s belief regarding '{{real_reason_question}}'?",
+        "question_type": "tom:belief:accessible:reason",
+        "tom_type": "second-order:CA",
+        "correct_answer": "{{accomplice}} believes that {{liar}} believes that {{real_reason}}.",
+        "wrong_answer": [
+            "{{accomplice}} believes that {{liar}} is unaware that {{real_reason}}, because {{liar}} was not involved in the conversation when this was discussed.",
+            _NO_INFO % ("accomplice", "liar") + "{{accomplice}} is unaware that {{liar}} is unaware that {{real_reason}}.",
+            _NO_INFO % ("accomplice", "liar") + "{{accomplice}} is unaware that {{liar}} believes that {{real_reason}}.",
+        ],
+        "real_reason_accessibility": "accessible",
+    }},
+    {"field": "beliefQAs", "fields": {
+        "question": "What does {{accomplice}} believe about {{target}}'s belief regarding '{{real_reason_question}}'?",
+        "question_type": "tom:belief:accessible:reason",
+        "tom_type": "second-order:CB",
+        "correct_answer": "{{accomplice}} believes that {{target}} is unaware that {{real_reason}}, because {{target}} was not involved in the conversation when this was discussed.",
+        "wrong_answer": [
+            "{{accomplice}} believes that {{target}} believes that {{real_reason}}.",
+            _NO_INFO % ("accomplice", "target") + "{{accomplice}} is unaware that {{target}} is unaware that {{real_reason}}.",
+            _NO_INFO % ("accomplice", "target") + "{{accomplice}} is unaware that {{target}} believes that {{real_reason}}.",
+        ],
+        "real_reason_accessibility": "accessible",
+    }},
+    {"field": "beliefQAs", "fields": {
+        "question": "What does {{accomplice}} believe about {{observer}}'s belief regarding '{{real_reason_question}}'?",
+        "question_type": "tom:belief:accessible:reason",
+        "tom_type": "second-order:CD",
+        "correct_answer": "{{accomplice}} believes that {{observer}} is unaware that {{real_reason}}, because {{observer}} was not involved in the conversation when this was discussed.",
+        "wrong_answer": [
+            "{{accomplice}} believes that {{observer}} believes that {{real_reason}}.",
+            _NO_INFO % ("accomplice", "observer") + "{{accomplice}} is unaware that {{target}} is unaware that {{real_reason}}.",
+            _NO_INFO % ("accomplice", "observer") + "{{accomplice}} is unaware that {{target}} believes that {{real_reason}}.",
+        ],
+        "real_reason_accessibility": "accessible",
+    }},
+
+    # information accessibility
+    {"kind": "access", "list_field": "infoAccessibilityQA_list", "binary_field": "infoAccessibilityQAs_binary",
+     "context": {"information": "Who discussed '{{real_reason}}'?"},
+     "list": {"question": "List all the characters who have access to this information.",
+              "question_type": "tom:info_accessibility:list:real_reason"},
+     "binary": {"question": "Does {{character}} have access to this information?",
+                "question_type": "tom:info_accessibility:binary:real_reason"},
+     "knowers": ["liar", "accomplice"]},
+    {"kind": "access", "when": "truth", "list_field": "infoAccessibilityQA_list", "binary_field": "infoAccessibilityQAs_binary",
+     "context": {"information": "Who discussed '{{truth}}'?"},
+     "list": {"question": "List all the characters who have access to this information.",
+              "question_type": "tom:info_accessibility:list:truth"},
+     "binary": {"question": "Does {{character}} have access to this information?",
+                "question_type": "tom:info_accessibility:binary:truth"},
+     "knowers": ["liar", "observer", "accomplice"]},
+
+    # answerability
+    {"kind": "access", "list_field": "answerabilityQA_list", "binary_field": "answerabilityQAs_binary",
+     "context": {"fact_question_real_reason": "Who discussed '{{real_reason}}'?"},
+     "list": {"question": "List all the characters who know the precise correct answer to this question.",
+              "question_type": "tom:answerability:list:real_reason"},
+     "binary": {"question": "Does {{character}} know the precise correct answer to this question?",
+                "question_type": "tom:answerability:binary:real_reason"},
+     "knowers": ["liar", "accomplice"]},
+    {"kind": "access", "when": "truth", "list_field": "answerabilityQA_list", "binary_field": "answerabilityQAs_binary",
+     "context": {"fact_question_truth": "Who discussed '{{truth}}'?"},
+     "list": {"question": "List all the characters who know the precise correct answer to this question.",
+              "question_type": "tom:answerability:list:truth"},
+     "binary": {"question": "Does {{character}} know the precise correct answer to this question?",
+                "question_type": "tom:answerability:binary:truth"},
+     "knowers": ["liar", "observer", "accomplice"]},
+
+    # lie detectability
+    {"kind": "access", "list_field": "liedetectabilityQAs_list", "binary_field": "liedetectabilityQAs_binary",
+     "context": {"comprehension_q": "{{comprehension_q}}"},
+     "list": {"question": "List all the characters who know the precise correct answer to this question.",
+              "question_type": "tom:liedetectability:list"},
+     "binary": {"question": "Does {{character}} know the precise correct answer to this question?",
+                "question_type": "tom:liedetectability:binary"},
+     "knowers": ["liar", "accomplice"]},
+
+    # lieability
+    {"field": "lieabilityQAs", "fields": {
+        "question": "Please choose the correct answer from the options below:",
+        "question_type": "tom:lieability:liar:real_reason",
+        "correct_answer": "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} believes that {{target}} is unaware that {{real_reason}}.",
+        "wrong_answer": [
+            "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} believes that {{target}} believes {{real_reason}}.",
+            "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} is unaware that {{target}} is unaware that {{real_reason}}.",
+            "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} is unaware that {{target}} believes {{real_reason}}.",
+        ],
+    }},
+    {"field": "lieabilityQAs", "when": "truth", "fields": {
+        "question": "Please choose the correct answer from the options below:",
+        "question_type": "tom:lieability:liar:truth",
+        "correct_answer": "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} believes that {{target}} is unaware that {{truth}}.",
+        "wrong_answer": [
+            "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} believes that {{target}} believes {{truth}}.",
+            "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} is unaware that {{target}} is unaware that {{truth}}.",
+            "{{liar}} tell {{target}} that '{{lie}}' because {{liar}} is unaware that {{target}} believes {{truth}}.",
+        ],
+    }},
+]
+
+# stand-in values used to classify the distractor templates once at compile time
+_PROBE_VALUES = dict(zip(ROLES, ["Liarname", "Targetname", "Accompliname", "Observername"]))
+_PROBE_VALUES.update({name: f"<{name}>" for name in SCENARIO_VARIABLES if name not in _PROBE_VALUES})
+
+
+def scenario_variables(data: Dict[str, Any], options_map: Optional[dict] = None,
+                       justification: bool = True) -> Dict[str, Any]:
+    """
+    Template variables of one scenario (same text normalization as the
+    hand-written generators).
+
+    Raises:
+        ValueError: If `justification` and the set has no justification options
+    """
+    characters, lie_info = data["characters"], data["lie"]
+    real_reason = (lie_info.get("real_reason_q") or lie_info["real_reason_c"]).rstrip(".")
+    truth = lie_info.get("truth_q") or (lie_info.get("truth_c") or "").rstrip(".")
+    lie = (lie_info.get("lie_q") or lie_info["lie_c"]).rstrip(".")
+    values = {role: characters[role] for role in ROLES}
+    values["liars"] = (f"{characters['liar']} and {characters['accomplice']}"
+                       if CONDITIONS["multiple_liar"](data) else characters["liar"])
+    values.update({
+        "real_reason": real_reason, "truth": truth, "truth_stripped": truth.rstrip("."), "lie": lie,
+        "real_reason_question": f"Who discussed '{real_reason}'?",
+        "truth_question": f"Who discussed '{truth}'?",
+    })
+    values["comprehension_q"] = f"Was what {values['liars']} told {values['target']}, '{lie}', true?"
+
+    if justification:
+        options_map = options_map if options_map is not None else load_justification_index()
+        options = options_map.get(data["set_id"])
+        if options is None:
+            raise ValueError(f"Options not found for set_id '{data['set_id']}'.")
+        values["justification_correct"] = options["truth"]["correct_answer"]
+        values["justification_wrong_answers"] = options["truth"]["wrong_answers"]
+    return values
+
+
+def _names_are_distinct(characters: Dict[str, str]) -> bool:
+    """True if no character name occurs as a word in another one (precomputed types then apply)."""
+    names = [characters[role] for role in ROLES]
+    if len(set(names)) < len(names) or not all(names):
+        return False
+    return not any(a != b and re.search(rf"\b{re.escape(a)}\b", b) for a in names for b in names)
+
+
+class _CompiledMCQ:
+    def __init__(self, spec: Dict[str, Any]):
+        self.field = spec["field"]
+        self.when = spec.get("when")
+        self.annotate = spec.get("annotate", True)
+        self.fields: List[Tuple[str, Any]] = []
+        for key, value in spec["fields"].items():
+            if key == "wrong_answer":
+                self.fields.append((key, self._compile_wrong(value)))
+            else:
+                self.fields.append((key, compile_template(value, SCENARIO_VARIABLES)))
+        self.correct = dict(self.fields)["correct_answer"]
+        self.question_type = spec["fields"]["question_type"]
+        self.tom_type = spec["fields"].get("tom_type")
+        self.types = self._classify_templates() if self.annotate else None
+
+    @staticmethod
+    def _compile_wrong(value: Any) -> Any:
+        if isinstance(value, str):
+            return ("fixed", compile_template(value, SCENARIO_VARIABLES))
+        if isinstance(value, dict) and "sample" in value:
+            return ("sample", [compile_template(t, SCENARIO_VARIABLES) for t in value["sample"]], value["k"])
+        if isinstance(value, dict) and "variable" in value:
+            if value["variable"] not in LIST_VARIABLES:
+                raise ValueError(f"Unknown list variable '{value['variable']}'")
+            return ("variable", value["variable"])
+        slots = []
+        for slot in value:
+            if isinstance(slot, str):
+                slots.append([compile_template(slot, SCENARIO_VARIABLES)])
+            else:
+                slots.append([compile_template(t, SCENARIO_VARIABLES) for t in slot["choice"]])
+        return ("slots", slots)
+
+    def _templates(self) -> List[CompiledTemplate]:
+        kind = dict(self.fields)["wrong_answer"]
+        if kind[0] == "fixed":
+            return [kind[1]]
+        if kind[0] == "sample":
+            return kind[1]
+        if kind[0] == "slots":
+            return [template for slot in kind[1] for template in slot]
+        return []
+
+    def _classify_templates(self) -> Dict[int, str]:
+        """Distractor type of every wrong answer template, keyed by id(template)."""
+        characters = {role: _PROBE_VALUES[role] for role in ROLES}
+        correct = self.correct.render(_PROBE_VALUES)
+        return {id(template): classify_distractor(template.render(_PROBE_VALUES), correct, characters,
+                                                  self.question_type, self.tom_type)
+                for template in self._templates()}
+
+    def render(self, values: Dict[str, Any], rng: random.Random, exact_types: bool) -> Dict[str, Any]:
+        qa, chosen = {}, []
+        for key, compiled in self.fields:
+            if key != "wrong_answer":
+                qa[key] = compiled.render(values)
+                continue
+            kind = compiled[0]
+            if kind == "fixed":
+                chosen = [compiled[1]]
+                qa[key] = compiled[1].render(values)
+            elif kind == "sample":
+                chosen = rng.sample(compiled[1], compiled[2])
+                qa[key] = [template.render(values) for template in chosen]
+            elif kind == "variable":
+                qa[key] = values[compiled[1]]
+            else:
+                chosen = [slot[0] if len(slot) == 1 else rng.choice(slot) for slot in compiled[1]]
+                qa[key] = [template.render(values) for template in chosen]
+
+        if self.annotate:
+            wrong = dict(self.fields)["wrong_answer"]
+            if self.question_type.startswith("justification"):
+                n = len(flatten_wrong_answers(qa))
+                qa["wrong_answer_types"] = (JUSTIFICATION_DISTRACTOR_TYPES + ["unparsed"] * n)[:n]
+            elif exact_types and wrong[0] != "variable":
+                qa["wrong_answer_types"] = [self.types[id(template)] for template in chosen]
+            else:
+                characters = {role: values[role] for role in ROLES}
+                options = qa["wrong_answer"] if isinstance(qa["wrong_answer"], list) else [qa["wrong_answer"]]
+                qa["wrong_answer_types"] = [classify_distractor(option, qa["correct_answer"], characters,
+                                                                self.question_type, self.tom_type)
+                                            for option in options]
+        return qa
+
+
+class _CompiledAccess:
+    def __init__(self, spec: Dict[str, Any]):
+        self.when = spec.get("when")
+        self.list_field, self.binary_field = spec["list_field"], spec["binary_field"]
+        self.context = [(key, compile_template(t, SCENARIO_VARIABLES)) for key, t in spec["context"].items()]
+        self.list_fields = [(key, compile_template(t, SCENARIO_VARIABLES)) for key, t in spec["list"].items()]
+        self.binary_fields = [(key, compile_template(t, SCENARIO_VARIABLES + ("character",)))
+                              for key, t in spec["binary"].items()]
+        self.knowers = spec["knowers"]
+        unknown = set(self.knowers) - set(ROLES)
+        if unknown:
+            raise ValueError(f"Unknown roles {sorted(unknown)}")
+        self.others = [role for role in ROLES if role not in self.knowers]
+
+    def render(self, values: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        context = {key: template.render(values) for key, template in self.context}
+        list_qa = dict(context)
+        list_qa.update((key, template.render(values)) for key, template in self.list_fields)
+        knower_names = [values[role] for role in self.knowers]
+        list_qa["correct_answer"] = knower_names
+        list_qa["wrong_answer"] = [values[role] for role in self.others]
+
+        binary_qas = []
+        character_values = dict(values)
+        for role in ROLES:
+            character_values["character"] = values[role]
+            qa = dict(context)
+            qa.update((key, template.render(character_values)) for key, template in self.binary_fields)
+            qa["correct_answer"] = "yes" if values[role] in knower_names else "no"
+            binary_qas.append(qa)
+        return list_qa, binary_qas
+
+
+class QuestionGenerator:
+    def __init__(self, specs: Optional[List[Dict[str, Any]]] = None,
+                 fields: Optional[List[Tuple[str, str]]] = None):
+        """
+        Args:
+            specs (list): Question specs (default: QUESTION_SPECS)
+            fields (list): (output field, q_id prefix) pairs (default: QUESTION_FIELDS)
+
+        Raises:
+            TemplateError: If a template uses an unknown variable
+            ValueError: If a spec refers to an unknown field, condition or role
+        """
+        self.fields = list(fields if fields is not None else QUESTION_FIELDS)
+        field_names = {field for field, _ in self.fields}
+        self.rules = []
+        for spec in (specs if specs is not None else QUESTION_SPECS):
+            rule = _CompiledAccess(spec) if spec.get("kind") == "access" else _CompiledMCQ(spec)
+            targets = [rule.list_field, rule.binary_field] if isinstance(rule, _CompiledAccess) else [rule.field]
+            missing = [field for field in targets if field not in field_names]
+            if missing:
+                raise ValueError(f"Spec writes to unknown fields {missing}")
+            if rule.when is not None and rule.when not in CONDITIONS:
+                raise ValueError(f"Unknown condition '{rule.when}'")
+            self.rules.append(rule)
+        self.needs_justification = any(isinstance(rule, _CompiledMCQ) and rule.field == "justificationQA"
+                                       for rule in self.rules)
+
+    def generate(self, data: Dict[str, Any], options_map: Optional[dict] = None,
+                 rng: Optional[random.Random] = None) -> Dict[str, Any]:
+        """
+        Generate all questions of one scenario.
+
+        Args:
+            data (dict): A dataset/elements item
+            options_map (dict): Justification options index (default: dataset/justification_options)
+            rng (random.Random): Random generator for the distractor pools (default: the `random` module)
+
+        Returns:
+            dict: {"set_id": ..., field: [questions with q_id], ...}, as `generate_all_questions`
+        """
+        rng = rng if rng is not None else random
+        values = scenario_variables(data, options_map, self.needs_justification)
+        exact_types = _names_are_distinct(data["characters"])
+        set_id = data.get("set_id", "unknown")
+        entry = {"set_id": set_id}
+        entry.update((field, []) for field, _ in self.fields)
+        for rule in self.rules:
+            if rule.when is not None and not CONDITIONS[rule.when](data):
+                continue
+            if isinstance(rule, _CompiledAccess):
+                list_qa, binary_qas = rule.render(values)
+                entry[rule.list_field].append(list_qa)
+                entry[rule.binary_field].extend(binary_qas)
+            else:
+                entry[rule.field].append(rule.render(values, rng, exact_types))
+
+        for field, prefix in self.fields:
+            for i, qa in enumerate(entry[field]):
+                qa["q_id"] = f"{set_id}-{prefix}-{i}"
+        return entry
+
+    def generate_batch(self, datasets: Iterable[Dict[str, Any]], options_map: Optional[dict] = None,
+                       seed: Optional[Callable[[Dict[str, Any]], int]] = None) -> List[Dict[str, Any]]:
+        """
+        Generate the questions of many scenarios.
+
+        Args:
+            datasets (iterable): dataset/elements items
+            options_map (dict): Justification options index
+            seed (callable): Per-scenario seed function (e.g. crc32 of the set_id);
+                None draws from the `random` module
+
+        Returns:
+            list: Generated entries, in input order
+        """
+        if options_map is None and self.needs_justification:
+            options_map = load_justification_index()
+        return [self.generate(data, options_map, random.Random(seed(data)) if seed else None)
+                for data in datasets]
@@ -0,0 +1,203 @@
+"""
+Append-only JSONL record store for generation outputs.
+
+Every record is one JSON line appended with a single write and fsynced, so a
+crash can at worst leave a torn last line, which is ignored (and truncated on
+the next append). Writers from several processes serialize their appends with
+an fcntl lock on a sidecar .lock file. On open, the store scans the file once
+and builds an index from a key field (e.g. set_id) to the byte offsets of the
+records carrying it; `refresh` picks up records appended by other writers
+since the last scan, and rescans from the start when another store compacted
+(replaced) or truncated the file in the meantime.
+
+`export_json` writes the latest record per key as a JSON list (the layout of
+dataset/elements/*.json), and `compact` rewrites the JSONL file the same way;
+`import_json` seeds a new store from such a list.
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from cache_utils import atomic_write_bytes
+
+
+class RecordStore:
+    def __init__(self, path: str, key: Optional[str] = "set_id"):
+        """
+        Args:
+            path (str): Path of the .jsonl file (created on first append)
+            key (str): Record field to index on; None disables the index
+        """
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.key = key
+        self.index: Dict[Any, List[int]] = {}
+        self.n_records = 0
+        self._scanned = 0
+        self._inode = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Index the complete records appended since the last scan."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            self._scan(f)
+
+    def _scan(self, f):
+        stat = os.fstat(f.fileno())
+        if stat.st_ino != self._inode or stat.st_size < self._scanned:
+            # first scan, or the file was compacted / truncated since: the offsets are stale
+            self.index, self.n_records, self._scanned = {}, 0, 0
+            self._inode = stat.st_ino
+        f.seek(self._scanned)
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                # end of file, or a torn last line from an interrupted write
+                break
+            self._scanned = f.tell()
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._add_to_index(record, offset)
+
+    def _add_to_index(self, record: Dict, offset: int):
+        self.n_records += 1
+        if self.key is not None and isinstance(record, dict) and record.get(self.key) is not None:
+            self.index.setdefault(record[self.key], []).append(offset)
+
+    def append(self, record: Dict):
+        """Append one record durably."""
+        self.extend([record])
+
+    def extend(self, records: List[Dict]):
+        """Append several records with one write and one fsync."""
+        if not records:
+            return
+        with self._locked():
+            self._write(records)
+
+    def _write(self, records: List[Dict]):
+        """Append records; the caller holds the lock."""
+        lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+        # index what other writers appended, and drop a torn last line
+        self.refresh()
+        with open(self.path, "ab") as f:
+            if f.tell() > self._scanned:
+                f.truncate(self._scanned)
+            offset = self._scanned
+            f.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        for record, line in zip(records, lines):
+            self._add_to_index(record, offset)
+            offset += len(line.encode("utf-8"))
+        self._scanned = offset
+
+    def import_json(self, path: str) -> int:
+        """
+        Seed an empty store with the records of a JSON list file. The check and
+        the import happen under the lock, so of several writers opening a new
+        store at once only the first imports.
+
+        Returns:
+            int: Number of imported records
+        """
+        with self._locked():
+            self.refresh()
+            if self.n_records or not os.path.exists(path):
+                return 0
+            with open(path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+            if records:
+                self._write(records)
+            return len(records)
+
+    def _read_at(self, f, offset: int) -> Dict:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Latest record with the given key."""
+        if not os.path.exists(self.path):
+            return default
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_ino != self._inode:
+                # compacted by another store since the last scan
+                self._scan(f)
+            offsets = self.index.get(key)
+            if not offsets:
+                return default
+            return self._read_at(f, offsets[-1])
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def keys(self) -> List[Any]:
+        return list(self.index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        """All complete records in append order."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def latest(self) -> List[Dict]:
+        """
+        The latest record per key, in order of each key's first appearance;
+        records without the key are kept as they are.
+        """
+        records, positions = [], {}
+        for record in self:
+            key = record.get(self.key) if self.key is not None and isinstance(record, dict) else None
+            if key is None:
+                records.append(record)
+            elif key in positions:
+                records[positions[key]] = record
+            else:
+                positions[key] = len(records)
+                records.append(record)
+        return records
+
+    def export_json(self, path: str, indent: int = 4):
+        """Atomically write the latest record per key as a JSON list."""
+        self.refresh()
+        data = json.dumps(self.latest(), ensure_ascii=False, indent=indent)
+        atomic_write_bytes(path, data.encode("utf-8"))
+
+    def compact(self):
+        """Rewrite the JSONL file with only the latest record per key."""
+        with self._locked():
+            self.refresh()
+            records = self.latest()
+            data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            atomic_write_bytes(self.path, data.encode("utf-8"))
+            # the new file has a new inode, so this rescans it from the start
+            self.refresh()
@@ -11,12 +11,22 @@ This script:
 1. Reads the source data (elements or justification_options)
 2. For each item, finds where _c content appears in questions
 3. Replaces it with the corresponding _q content
+
+The (_c, _q) pairs of all items of all input files, plus optional dataset-wide
+pairs (--pairs), are compiled into one Aho-Corasick automaton (see
+`pattern_matcher.py`). Each file is then rewritten in a single pass: every
+string is scanned once (case-insensitively), only the pairs of its own item
+(or dataset-wide pairs) are applied, leftmost-longest first, and each match is
+recorded under its exact field path (e.g. beliefQAs[3].question). --dry-run
+prints a unified diff of the modified items instead of writing.
 """
 
+import difflib
 import json
-import re
-from typing import Dict, Any, List, Tuple
-from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from cache_utils import atomic_write_json
+from pattern_matcher import PatternMatcher
 
 
 def load_json(path: str) -> List[Dict]:
@@ -26,9 +36,12 @@ def load_json(path: str) -> List[Dict]:
 
 
 def save_json(path: str, data: List[Dict]):
-    """Save JSON file."""
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    """Save JSON file (atomically)."""
+    atomic_write_json(path, data, indent=4)
+
+
+# Fields that are never rewritten
+SKIP_FIELDS = ("lie", "set_id", "characters")
 
 
 def get_replacement_pairs(item: Dict[str, Any]) -> List[Tuple[str, str]]:
@@ -58,97 +71,159 @@ def get_replacement_pairs(item: Dict[str, Any]) -> List[Tuple[str, str]]:
     return pairs
 
 
-def replace_in_string(text: str, old: str, new: str) -> Tuple[str, bool]:
+def load_pairs(path: str) -> List[Tuple[str, str]]:
     """
-    Replace old content with new content in text.
-    Returns (new_text, was_modified)
+    Load dataset-wide replacement pairs.
+
+    Supports {"old": "new", ...} and [["old", "new"], ...].
     """
-    if not text or not old:
-        return text, False
-    
-    # Try exact match first
-    if old in text:
-        return text.replace(old, new), True
-    
-    # Try case-insensitive match
-    pattern = re.escape(old)
-    if re.search(pattern, text, re.IGNORECASE):
-        new_text = re.sub(pattern, new, text, flags=re.IGNORECASE)
-        return new_text, True
-    
-    return text, False
+    raw = load_json(path)
+    pairs = raw.items() if isinstance(raw, dict) else raw
+    return [(old, new) for old, new in pairs if old and old != new]
+
+
+def _format_path(path: List) -> str:
+    text = ""
+    for part in path:
+        text += f"[{part}]" if isinstance(part, int) else (f".{part}" if text else part)
+    return text
+
+
+class ReplacementEngine:
+    """(old → new) replacements of many items, compiled into one automaton."""
+
+    def __init__(self, case_sensitive: bool = False):
+        """
+        Args:
+            case_sensitive (bool): Only replace exact-case occurrences
+        """
+        self.matcher = PatternMatcher(case_sensitive=case_sensitive)
+        # set_id (None: every item) -> pattern id -> replacement
+        self.scopes: Dict[Optional[str], Dict[int, str]] = {}
+        self._merged: Dict[Optional[str], Dict[int, str]] = {}
+
+    def add(self, old: str, new: str, set_id: Optional[str] = None):
+        """Replace `old` with `new` in the item `set_id` (None: in every item)."""
+        pattern_id = self.matcher.add(old)
+        self.scopes.setdefault(set_id, {})[pattern_id] = new
+        self._merged = {}
+
+    def add_items(self, items: List[Dict[str, Any]]):
+        """Add the (_c, _q) pairs of every item."""
+        for item in items:
+            for old, new in get_replacement_pairs(item):
+                self.add(old, new, item.get("set_id", "unknown"))
+
+    def replacements(self, set_id: Optional[str]) -> Dict[int, str]:
+        """Pattern id -> replacement of an item; item pairs take precedence over dataset-wide ones."""
+        if set_id not in self._merged:
+            merged = dict(self.scopes.get(None, {}))
+            if set_id is not None:
+                merged.update(self.scopes.get(set_id, {}))
+            self._merged[set_id] = merged
+        return self._merged[set_id]
+
+    def num_pairs(self, set_id: Optional[str]) -> int:
+        return len(self.replacements(set_id))
 
+    def _replace_value(self, value: Any, replacements: Dict[int, str], path: List,
+                       matches: List[Dict[str, Any]]) -> Any:
+        if isinstance(value, str):
+            if not replacements:
+                return value
+            new_value, found = self.matcher.replace(value, replacements.__getitem__, replacements)
+            if found:
+                counts: Dict[int, int] = {}
+                for _, _, pattern_id in found:
+                    counts[pattern_id] = counts.get(pattern_id, 0) + 1
+                field = _format_path(path)
+                for pattern_id, count in counts.items():
+                    matches.append({"field": field, "old": self.matcher.patterns[pattern_id],
+                                    "new": replacements[pattern_id], "count": count})
+            return new_value
+        if isinstance(value, dict):
+            new_dict = {}
+            for k, v in value.items():
+                path.append(k)
+                new_dict[k] = self._replace_value(v, replacements, path, matches)
+                path.pop()
+            return new_dict
+        if isinstance(value, list):
+            new_list = []
+            for i, v in enumerate(value):
+                path.append(i)
+                new_list.append(self._replace_value(v, replacements, path, matches))
+                path.pop()
+            return new_list
+        return value
 
-def replace_in_value(value: Any, replacement_pairs: List[Tuple[str, str]]) -> Tuple[Any, int]:
+    def replace_item(self, item: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Replace content in every field of an item except SKIP_FIELDS.
+
+        Returns:
+            tuple: (new item, matches [{"field", "old", "new", "count"}, ...])
+        """
+        replacements = self.replacements(item.get("set_id", "unknown"))
+        matches = []
+        if not replacements:
+            return item, matches
+        new_item = {}
+        for field_name, value in item.items():
+            if field_name in SKIP_FIELDS:
+                new_item[field_name] = value
+            else:
+                new_item[field_name] = self._replace_value(value, replacements, [field_name], matches)
+        return (new_item if matches else item), matches
+
+
+def build_engine(datasets: List[List[Dict]], pairs: Optional[List[Tuple[str, str]]] = None,
+                 case_sensitive: bool = False) -> ReplacementEngine:
     """
-    Recursively replace content in a value.
-    Returns (new_value, num_replacements)
+    Compile the replacement pairs of several loaded files into one engine.
+
+    Args:
+        datasets (list): Loaded JSON files (lists of items)
+        pairs (list): Dataset-wide (old, new) pairs
+        case_sensitive (bool): Only replace exact-case occurrences
     """
-    num_replacements = 0
-    
-    if isinstance(value, str):
-        for old_content, new_content in replacement_pairs:
-            value, was_modified = replace_in_string(value, old_content, new_content)
-            if was_modified:
-                num_replacements += 1
-        return value, num_replacements
-    
-    elif isinstance(value, dict):
-        new_dict = {}
-        for k, v in value.items():
-            new_dict[k], count = replace_in_value(v, replacement_pairs)
-            num_replacements += count
-        return new_dict, num_replacements
-    
-    elif isinstance(value, list):
-        new_list = []
-        for item in value:
-            new_item, count = replace_in_value(item, replacement_pairs)
-            new_list.append(new_item)
-            num_replacements += count
-        return new_list, num_replacements
-    
-    else:
-        return value, 0
+    engine = ReplacementEngine(case_sensitive)
+    for old, new in pairs or []:
+        engine.add(old, new)
+    for data in datasets:
+        engine.add_items(data)
+    return engine
+
+
+def item_diff(old_item: Dict[str, Any], new_item: Dict[str, Any], label: str) -> List[str]:
+    """Unified diff of the pretty-printed JSON of an item."""
+    old_lines = json.dumps(old_item, indent=4, ensure_ascii=False).splitlines()
+    new_lines = json.dumps(new_item, indent=4, ensure_ascii=False).splitlines()
+    return list(difflib.unified_diff(old_lines, new_lines, f"a/{label}", f"b/{label}", lineterm=""))
+
 
+def _short(text: str, limit: int = 50) -> str:
+    return text[:limit] + "..." if len(text) > limit else text
 
-def analyze_item(item: Dict[str, Any]) -> Dict[str, Any]:
+
+def analyze_item(item: Dict[str, Any], engine: Optional[ReplacementEngine] = None) -> Dict[str, Any]:
     """
     Analyze what would be replaced in an item.
     
     Returns analysis results including:
     - replacement_pairs: list of (old, new) pairs
-    - fields_with_matches: fields that contain _c content
+    - fields_with_matches: exact field paths that contain _c content, with match counts
     """
     set_id = item.get("set_id", "unknown")
-    replacement_pairs = get_replacement_pairs(item)
-    
-    if not replacement_pairs:
-        return {
-            "set_id": set_id,
-            "has_replacements": False,
-            "num_pairs": 0,
-            "replacement_pairs": []
-        }
-    
-    # Find which fields contain the _c content
-    fields_with_matches = []
-    
-    for field_name, field_value in item.items():
-        if field_name in ["lie", "set_id", "characters"]:
-            continue
-        
-        # Check if this field contains any _c content
-        for old_content, new_content in replacement_pairs:
-            if isinstance(field_value, (str, dict, list)):
-                str_repr = json.dumps(field_value, ensure_ascii=False) if not isinstance(field_value, str) else field_value
-                if old_content in str_repr:
-                    fields_with_matches.append({
-                        "field": field_name,
-                        "old_content": old_content[:50] + "..." if len(old_content) > 50 else old_content,
-                        "new_content": new_content[:50] + "..." if len(new_content) > 50 else new_content
-                    })
-    
+    if engine is None:
+        engine = build_engine([[item]])
+    replacements = engine.replacements(set_id)
+    replacement_pairs = [(engine.matcher.patterns[pattern_id], new) for pattern_id, new in replacements.items()]
+
+    _, matches = engine.replace_item(item)
+    fields_with_matches = [dict(match, old_content=_short(match["old"]), new_content=_short(match["new"]))
+                           for match in matches]
+
     return {
         "set_id": set_id,
         "has_replacements": len(fields_with_matches) > 0,
@@ -158,13 +233,17 @@ def analyze_item(item: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def analyze_file(file_path: str) -> Dict[str, Any]:
+def analyze_file(file_path: str, engine: Optional[ReplacementEngine] = None,
+                 data: Optional[List[Dict]] = None) -> Dict[str, Any]:
     """
     Analyze a file to see what would be replaced.
     """
     print(f"\n=== Analyzing {file_path} ===")
     
-    data = load_json(file_path)
+    if data is None:
+        data = load_json(file_path)
+    if engine is None:
+        engine = build_engine([data])
     
     total_items = len(data)
     items_with_replacements = 0
@@ -173,22 +252,22 @@ def analyze_file(file_path: str) -> Dict[str, Any]:
     detailed_results = []
     
     for item in data:
-        analysis = analyze_item(item)
+        analysis = analyze_item(item, engine)
         if analysis["has_replacements"]:
             items_with_replacements += 1
-            total_matches += len(analysis["fields_with_matches"])
+            total_matches += sum(match["count"] for match in analysis["fields_with_matches"])
             detailed_results.append(analysis)
     
     print(f"Total items: {total_items}")
     print(f"Items with _c content in questions: {items_with_replacements}")
-    print(f"Total field matches found: {total_matches}")
+    print(f"Total matches found: {total_matches}")
     
     if detailed_results and items_with_replacements <= 5:
         print("\nDetailed matches:")
         for result in detailed_results:
             print(f"\n  Set {result['set_id']}:")
             for match in result["fields_with_matches"]:
-                print(f"    Field: {match['field']}")
+                print(f"    Field: {match['field']} ({match['count']}x)")
                 print(f"      Old: {match['old_content']}")
                 print(f"      New: {match['new_content']}")
     
@@ -201,7 +280,9 @@ def analyze_file(file_path: str) -> Dict[str, Any]:
     }
 
 
-def replace_in_file(input_path: str, output_path: str = None, backup: bool = True, verbose: bool = True) -> bool:
+def replace_in_file(input_path: str, output_path: str = None, backup: bool = True, verbose: bool = True,
+                    dry_run: bool = False, engine: Optional[ReplacementEngine] = None,
+                    data: Optional[List[Dict]] = None) -> bool:
     """
     Replace _c content with _q content in a file.
     
@@ -210,91 +291,58 @@ def replace_in_file(input_path: str, output_path: str = None, backup: bool = Tru
         output_path: Path to output JSON file (default: same as input)
         backup: Whether to create backup before modifying
         verbose: Whether to print detailed replacement information
+        dry_run: Print a unified diff of the modified items instead of writing
+        engine: Compiled replacements (default: the pairs of this file)
+        data: Already loaded content of input_path
     """
     if output_path is None:
         output_path = input_path
     
     print(f"\n{'='*80}")
-    print(f"Processing: {input_path}")
+    print(f"Processing: {input_path}{' (dry run)' if dry_run else ''}")
     print(f"{'='*80}")
     
     # Load data
-    try:
-        data = load_json(input_path)
-    except Exception as e:
-        print(f"❌ Error loading file: {e}")
-        return False
-    
-    # Create backup
-    if backup and input_path == output_path:
-        backup_path = input_path + ".backup"
+    if data is None:
         try:
-            save_json(backup_path, data)
-            print(f"✅ Backup created: {backup_path}")
+            data = load_json(input_path)
         except Exception as e:
-            print(f"❌ Error creating backup: {e}")
+            print(f"❌ Error loading file: {e}")
             return False
+    if engine is None:
+        engine = build_engine([data])
     
-    # Process each item
+    # Single pass: replace and record the matches of every item
     total_replacements = 0
     modified_items = 0
     all_replacements = []  # Store all replacement details
+    new_data = []
+    diff = []
     
     for item in data:
-        replacement_pairs = get_replacement_pairs(item)
-        if not replacement_pairs:
+        new_item, matches = engine.replace_item(item)
+        new_data.append(new_item)
+        if not matches:
             continue
         
         set_id = item.get("set_id", "unknown")
-        item_replacements = 0
-        item_details = []
-        
-        # Replace in all fields except 'lie', 'set_id', 'characters'
-        for field_name in list(item.keys()):
-            if field_name in ["lie", "set_id", "characters"]:
-                continue
-            
-            old_value = item[field_name]
-            new_value, count = replace_in_value(old_value, replacement_pairs)
-            
-            if count > 0:
-                item[field_name] = new_value
-                item_replacements += count
-                
-                # Track which fields were modified
-                if verbose:
-                    for old_content, new_content in replacement_pairs:
-                        # Check if this pair was actually used in this field
-                        if isinstance(old_value, str) and old_content in old_value:
-                            item_details.append({
-                                'field': field_name,
-                                'old': old_content,
-                                'new': new_content
-                            })
-                        elif isinstance(old_value, (dict, list)):
-                            str_repr = json.dumps(old_value, ensure_ascii=False)
-                            if old_content in str_repr:
-                                item_details.append({
-                                    'field': field_name,
-                                    'old': old_content,
-                                    'new': new_content
-                                })
+        item_replacements = sum(match["count"] for match in matches)
+        modified_items += 1
+        total_replacements += item_replacements
+        all_replacements.append({
+            'set_id': set_id,
+            'count': item_replacements,
+            'details': matches
+        })
+        if dry_run:
+            diff.extend(item_diff(item, new_item, f"{input_path} [{set_id}]"))
         
-        if item_replacements > 0:
-            modified_items += 1
-            total_replacements += item_replacements
-            all_replacements.append({
-                'set_id': set_id,
-                'count': item_replacements,
-                'details': item_details
-            })
-            
-            if verbose:
-                print(f"\n📝 Set {set_id}: {item_replacements} replacement(s)")
-                for detail in item_details:
-                    print(f"   Field: {detail['field']}")
-                    print(f"   Old: '{detail['old'][:80]}{'...' if len(detail['old']) > 80 else ''}'")
-                    print(f"   New: '{detail['new'][:80]}{'...' if len(detail['new']) > 80 else ''}'")
+        if verbose:
+            print(f"\n📝 Set {set_id}: {item_replacements} replacement(s)")
+            for detail in matches:
+                print(f"   Field: {detail['field']} ({detail['count']}x)")
+                print(f"   Old: '{detail['old'][:80]}{'...' if len(detail['old']) > 80 else ''}'")
+                print(f"   New: '{detail['new'][:80]}{'...' if len(detail['new']) > 80 else ''}'")
     
     # Print summary
     print(f"\n{'='*80}")
@@ -309,9 +357,30 @@ def replace_in_file(input_path: str, output_path: str = None, backup: bool = Tru
         for repl in all_replacements:
             print(f"  • {repl['set_id']}: {repl['count']} replacement(s)")
     
+    if dry_run:
+        if diff:
+            print()
+            print("\n".join(diff))
+        print(f"\n🔍 Dry run: {output_path} not modified")
+        return True
+    
+    if modified_items == 0 and output_path == input_path:
+        print(f"\n✅ Nothing to replace in: {input_path}")
+        return True
+    
+    # Create backup
+    if backup and input_path == output_path:
+        backup_path = input_path + ".backup"
+        try:
+            save_json(backup_path, data)
+            print(f"✅ Backup created: {backup_path}")
+        except Exception as e:
+            print(f"❌ Error creating backup: {e}")
+            return False
+    
     # Save
     try:
-        save_json(output_path, data)
+        save_json(output_path, new_data)
         print(f"\n✅ Successfully saved to: {output_path}")
         if backup and input_path == output_path:
             print(f"💾 Backup available at: {output_path}.backup")
@@ -328,30 +397,44 @@ def main():
     parser = argparse.ArgumentParser(
         description="Replace _c content with _q content in generated questions"
     )
-    parser.add_argument("--input", "-i", required=True,
-                       help="Input JSON file")
+    parser.add_argument("--input", "-i", required=True, nargs="+",
+                       help="Input JSON file(s); all pairs are compiled into one automaton")
     parser.add_argument("--output", "-o",
-                       help="Output JSON file (default: same as input)")
+                       help="Output JSON file (default: same as input; single input only)")
+    parser.add_argument("--pairs",
+                       help="JSON file with dataset-wide replacement pairs ({old: new} or [[old, new], ...])")
     parser.add_argument("--analyze-only", action="store_true",
                        help="Only analyze without modifying")
+    parser.add_argument("--dry-run", action="store_true",
+                       help="Print a unified diff of the modified items without writing")
+    parser.add_argument("--case-sensitive", action="store_true",
+                       help="Only replace exact-case occurrences")
     parser.add_argument("--no-backup", action="store_true",
                        help="Don't create backup before modifying")
     parser.add_argument("--quiet", "-q", action="store_true",
                        help="Quiet mode: minimal output")
     
     args = parser.parse_args()
-    
-    if args.analyze_only:
-        analyze_file(args.input)
-    else:
-        replace_in_file(
-            args.input, 
-            args.output, 
-            backup=not args.no_backup,
-            verbose=not args.quiet
-        )
+    if args.output and len(args.input) > 1:
+        parser.error("--output requires a single --input")
+    
+    datasets = {path: load_json(path) for path in args.input}
+    engine = build_engine(list(datasets.values()), load_pairs(args.pairs) if args.pairs else None,
+                          args.case_sensitive)
+    for path, data in datasets.items():
+        if args.analyze_only:
+            analyze_file(path, engine, data)
+        else:
+            replace_in_file(
+                path,
+                args.output,
+                backup=not args.no_backup,
+                verbose=not args.quiet,
+                dry_run=args.dry_run,
+                engine=engine,
+                data=data
+            )
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,150 @@
+"""
+Flat result tables for TactfulToM evaluation analysis.
+
+The clean result files written by `evaluate_non_freeform.py` are nested as
+question set -> category -> question -> entry. This module flattens them into
+column arrays (one row per scored entry) so that analyses can operate on all
+models and categories at once with NumPy instead of nested Python loops.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from evaluate_non_freeform import question_categories, filter_entry, score_entry
+
+
+RESULTS_DIR = "results/clean"
+# suffix of the result files of augmented runs (`get_original_results.py --augment_axes`)
+AUGMENTED_SUFFIX = "-aug"
+
+
+def _strip_augmented(file_name: str) -> str:
+    return file_name[:-len(AUGMENTED_SUFFIX)] if file_name.endswith(AUGMENTED_SUFFIX) else file_name
+
+
+def model_name(file_name: str) -> str:
+    """
+    Strip the dataset type suffix from a result file name.
+
+    Result files are named `{model}[-cot]-{type_num}[-aug]` by `get_original_results.py`,
+    e.g. "gpt-4o-2024-08-06-cot-0" -> "gpt-4o-2024-08-06-cot"; augmented runs are
+    told apart by the "augmentation" slice field (see `slice_analysis.py`).
+    """
+    file_name = _strip_augmented(file_name)
+    head, _, tail = file_name.rpartition("-")
+    if head and tail.isdigit():
+        return head
+    return file_name
+
+
+def type_num(file_name: str) -> str:
+    """Return the dataset type suffix ("0"-"4") of a result file name, or ""."""
+    head, _, tail = _strip_augmented(file_name).rpartition("-")
+    if head and tail.isdigit():
+        return tail
+    return ""
+
+
+def set_id_from_qid(q_id: str) -> str:
+    """Recover the set_id ("0-1-0-0") from a q_id ("0-1-0-0-belief-3")."""
+    return "-".join(q_id.split("-")[:4])
+
+
+def file_mtime(path: str) -> float:
+    """Modification time of a file, or -1 if it does not exist (used as a cache key)."""
+    return os.path.getmtime(path) if os.path.exists(path) else -1.0
+
+
+def list_result_files(results_dir: str = RESULTS_DIR) -> List[str]:
+    """List result file names (without ".json") in a results directory, sorted."""
+    file_names = [name[:-5] for name in os.listdir(results_dir) if name.endswith(".json")]
+    file_names.sort()
+    return file_names
+
+
+def load_result_table(file_names: List[str], condition: Optional[str] = "full_context",
+                      results_dir: str = RESULTS_DIR, include_freeform: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Flatten clean result files into a column-oriented table.
+
+    Entries rejected by `filter_entry` are dropped, and freeform entries are
+    only kept when `include_freeform` is set (their score is NaN).
+
+    Args:
+        file_names (list): Result file names without ".json"
+        condition (str): Context condition passed to `filter_entry`
+        results_dir (str): Directory holding the clean result files
+        include_freeform (bool): Whether to keep freeform entries
+
+    Returns:
+        dict: Column name -> np.ndarray, all of equal length. Columns are
+              file_name, model, type_num, set_index, set_id, category, q_id,
+              question_type, context_type, item_key, score and entry (the
+              original entry dict, for analyses that need raw answers).
+    """
+    columns = {name: [] for name in ["file_name", "model", "type_num", "set_index", "set_id", "category",
+                                     "q_id", "question_type", "context_type", "item_key", "score", "entry"]}
+    for file_name in file_names:
+        with open(os.path.join(results_dir, f"{file_name}.json")) as f:
+            result = json.load(f)
+        model, type_id = model_name(file_name), type_num(file_name)
+        for i, question_set in enumerate(result):
+            for category in question_categories:
+                for cat_result in question_set.get(category, []):
+                    for entry in cat_result:
+                        if not filter_entry(entry, condition):
+                            continue
+                        if entry["question_type"] == "freeform":
+                            if not include_freeform:
+                                continue
+                            score = np.nan
+                        else:
+                            score = float(score_entry(entry))
+                        q_id = entry.get("question_id") or f"{type_id}:{i}-{category}"
+                        set_id = set_id_from_qid(q_id) if entry.get("question_id") else f"{type_id}:{i}"
+                        columns["file_name"].append(file_name)
+                        columns["model"].append(model)
+                        columns["type_num"].append(type_id)
+                        columns["set_index"].append(i)
+                        columns["set_id"].append(set_id)
+                        columns["category"].append(category)
+                        columns["q_id"].append(q_id)
+                        columns["question_type"].append(entry["question_type"])
+                        columns["context_type"].append(entry["context_type"])
+                        columns["item_key"].append(f"{q_id}|{entry['question_type']}|{entry['context_type']}")
+                        columns["score"].append(score)
+                        columns["entry"].append(entry)
+
+    table = {}
+    for name, values in columns.items():
+        if name == "score":
+            table[name] = np.asarray(values, dtype=np.float64)
+        elif name == "set_index":
+            table[name] = np.asarray(values, dtype=np.int64)
+        else:
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            table[name] = array
+    return table
+
+
+def encode(values: np.ndarray, levels: Optional[List[str]] = None):
+    """
+    Integer-encode a column.
+
+    Args:
+        values (np.ndarray): Column to encode
+        levels (list): Fixed level order; values outside it are encoded as -1
+
+    Returns:
+        tuple: (levels, codes) where levels[codes[i]] == values[i]
+    """
+    if levels is None:
+        levels, codes = np.unique(values.astype(str), return_inverse=True)
+        return list(levels), codes.reshape(-1)
+    lookup = {level: i for i, level in enumerate(levels)}
+    codes = np.fromiter((lookup.get(v, -1) for v in values), dtype=np.int64, count=len(values))
+    return list(levels), codes
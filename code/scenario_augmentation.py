@@ -0,0 +1,317 @@
+"""
+Lazy scenario augmentation for large-scale robustness evaluation.
+
+Every dataset/final_set record is one fixed conversation with four sampled
+names. `ScenarioAugmenter` turns each record into many variants along four
+axes and yields them one at a time, so any number of variants can be streamed
+into the inference queue (see `get_original_results.py --augment_axes`) with
+constant memory:
+
+  • names:  the four characters get fresh names from the name index
+            (`name_index.py`); the conversation, scenario fields and questions
+            are rewritten consistently
+  • roles:  the four existing names are permuted over the roles (the liar is
+            now called by the target's name, ...)
+  • leave:  leave reasons that occur verbatim in the conversation are
+            resampled from `get_leave_reasons()` and rewritten in the text
+  • truth:  the questions about the truth are dropped from sets with
+            truth_id 1; the conversation still discusses the truth, so these
+            variants are marked with truth_id HIDDEN_TRUTH_ID (a level of its
+            own when slicing) rather than passed off as truth_id 0 sets
+
+Variants combine one value per axis; a variant id is the base set_id plus the
+axis values, e.g. "0-1-0-0~n2.r5.t", and all randomness of a variant is seeded
+from crc32(seed:variant_id), so the same variant is always rewritten the same
+way. The questions are either the curated final_set questions rewritten with
+the same name mapping (default) or regenerated on demand by the compiled spec
+generator of `question_specs.py`. q_ids are renumbered under the variant id.
+
+Names are replaced as whole, case-sensitive words; a name that is also a
+capitalized English word (e.g. "Can") may be replaced at sentence starts too.
+
+Usage (from the repository root):
+    python code/scenario_augmentation.py --axes names,roles,truth --names_per_set 3 --limit 20
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import tiktoken
+
+from conv_generation_utils import get_leave_reasons
+from name_index import NAME_INDEX_PATH, NameIndex, load_name_index
+from question_generation_utils import load_justification_index
+from question_specs import QUESTION_FIELDS, ROLES, QuestionGenerator
+
+
+FINAL_SET_PATHS = [f"dataset/final_set/Tactful_conv_set_{i}.json" for i in range(5)]
+ELEMENTS_PATHS = [f"dataset/elements/Tactful_conv_element_{i}.json" for i in range(5)]
+AXES = ["names", "roles", "leave", "truth"]
+LEAVE_REASON_KEYS = ["leave_reason_B", "leave_reason_D_1", "leave_reason_D_2"]
+# every reordering of the four names over the roles, except the original one
+ROLE_PERMUTATIONS = list(itertools.permutations(range(len(ROLES))))[1:]
+# fields that are identifiers or labels, never rewritten
+FIXED_KEYS = {"set_id", "lie_id", "conv_id", "truth_id", "lie_type", "emotion", "relationship",
+              "real_reason_type", "q_id", "question_type", "tom_type", "wrong_answer_types",
+              "full_context_tokens", "Short_context_tokens"}
+QUESTION_FIELD_NAMES = [field for field, _ in QUESTION_FIELDS]
+# truth_id of "truth" variants: the truth is in the conversation but never asked about
+HIDDEN_TRUTH_ID = "hidden"
+
+
+def iter_records(paths: Sequence[str]) -> Iterator[Dict[str, Any]]:
+    """Stream the records of several dataset files, one file in memory at a time."""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        yield from records
+        del records
+
+
+def load_multiple_liar(paths: Sequence[str] = ELEMENTS_PATHS) -> Dict[str, bool]:
+    """set_id -> multiple_liar from the elements files (final_set records do not keep it)."""
+    return {record["set_id"]: record.get("multiple_liar") is True for record in iter_records(paths)}
+
+
+def variant_seed(seed: int, variant_id: str) -> int:
+    return zlib.crc32(f"{seed}:{variant_id}".encode("utf-8"))
+
+
+class NameRewriter:
+    """
+    Rewrites the character names of one record. Every distinct string is split
+    at the names (whole words) once, so each variant only joins cached pieces.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        names = sorted({name for name in names if name}, key=len, reverse=True)
+        pattern = re.compile(r"\b(" + "|".join(re.escape(name) for name in names) + r")\b") if names else None
+        self._split = pattern.split if pattern else (lambda text: [text])
+        self._parts: Dict[str, List[str]] = {}
+
+    def rewrite(self, value: Any, mapping: Dict[str, str], key: Optional[str] = None,
+                _memo: Optional[Dict[str, str]] = None) -> Any:
+        """Copy of a (nested) record with the names replaced in all text values."""
+        if key in FIXED_KEYS:
+            return value
+        memo = _memo if _memo is not None else {}
+        if isinstance(value, str):
+            if value in memo:
+                return memo[value]
+            parts = self._parts.get(value)
+            if parts is None:
+                parts = self._parts[value] = self._split(value)
+            if len(parts) == 1:
+                return value
+            # odd positions are the matched names
+            parts = list(parts)
+            parts[1::2] = [mapping.get(name, name) for name in parts[1::2]]
+            memo[value] = "".join(parts)
+            return memo[value]
+        if isinstance(value, list):
+            return [self.rewrite(item, mapping, None, memo) for item in value]
+        if isinstance(value, dict):
+            return {k: self.rewrite(v, mapping, k, memo) for k, v in value.items()}
+        return value
+
+
+def is_truth_question(question: Dict[str, Any]) -> bool:
+    return "truth" in question.get("question_type", "").split(":") or "fact_question_truth" in question
+
+
+class ScenarioAugmenter:
+    def __init__(self, axes: Sequence[str] = ("names", "roles", "leave", "truth"), names_per_set: int = 2,
+                 roles_per_set: int = 2, leave_per_set: int = 2, seed: int = 0, questions: str = "rewrite",
+                 name_index: Optional[NameIndex] = None, name_index_path: str = NAME_INDEX_PATH,
+                 options_map: Optional[dict] = None, multiple_liar: Optional[Dict[str, bool]] = None,
+                 include_original: bool = False, encoding: str = "cl100k_base"):
+        """
+        Args:
+            axes (list): Augmentation axes to combine (see module docstring)
+            names_per_set (int): Fresh name draws per set
+            roles_per_set (int): Role permutations per set (at most 23)
+            leave_per_set (int): Leave-reason resamples per set
+            seed (int): Base seed of the per-variant seeds
+            questions (str): "rewrite" the curated questions or "regenerate" them from the specs
+            name_index (NameIndex): Name index for the names axis (default: loaded from name_index_path)
+            options_map (dict): Justification options index for "regenerate"
+            multiple_liar (dict): set_id -> multiple_liar for "regenerate" (default: from dataset/elements)
+            include_original (bool): Also yield every record unchanged (variant id = set_id)
+            encoding (str): tiktoken encoding for the context token counts
+        """
+        unknown = set(axes) - set(AXES)
+        if unknown:
+            raise ValueError(f"Unknown augmentation axes {sorted(unknown)}, expected a subset of {AXES}")
+        if questions not in ("rewrite", "regenerate"):
+            raise ValueError(f"Unknown questions mode '{questions}'")
+        self.axes = [axis for axis in AXES if axis in axes]
+        self.names_per_set = names_per_set
+        self.roles_per_set = min(roles_per_set, len(ROLE_PERMUTATIONS))
+        self.leave_per_set = leave_per_set
+        self.seed = seed
+        self.questions = questions
+        self.include_original = include_original
+        self.name_index = name_index
+        if self.name_index is None and "names" in self.axes:
+            self.name_index = load_name_index(name_index_path)
+        self.leave_reasons = get_leave_reasons()
+        self.encoding = tiktoken.get_encoding(encoding)
+        if questions == "regenerate":
+            self.generator = QuestionGenerator()
+            self.options_map = options_map if options_map is not None else load_justification_index()
+            self.multiple_liar = multiple_liar if multiple_liar is not None else load_multiple_liar()
+
+    def axis_values(self, record: Dict[str, Any]) -> List[List[Optional[str]]]:
+        """Per axis, the values a variant of this record can take (None = unchanged)."""
+        rng = random.Random(variant_seed(self.seed, record["set_id"]))
+        values = []
+        for axis in self.axes:
+            if axis == "names":
+                values.append([None] + [f"n{i}" for i in range(self.names_per_set)])
+            elif axis == "roles":
+                picks = sorted(rng.sample(range(len(ROLE_PERMUTATIONS)), self.roles_per_set))
+                values.append([None] + [f"r{i}" for i in picks])
+            elif axis == "leave":
+                context = record["full_context"].lower()
+                found = any(record["topic"].get(key, "").lower() in context
+                            for key in LEAVE_REASON_KEYS if record["topic"].get(key))
+                values.append([None] + ([f"l{i}" for i in range(self.leave_per_set)] if found else []))
+            else:
+                values.append([None, "t"] if record.get("truth_id") == 1 else [None])
+        return values
+
+    def variant_ids(self, record: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, str]]]:
+        """Lazily enumerate (variant id, {axis: value}) of one record."""
+        for combination in itertools.product(*self.axis_values(record)):
+            chosen = {axis: value for axis, value in zip(self.axes, combination) if value is not None}
+            if not chosen and not self.include_original:
+                continue
+            suffix = ".".join(chosen[axis] for axis in self.axes if axis in chosen)
+            yield (f"{record['set_id']}~{suffix}" if suffix else record["set_id"]), chosen
+
+    def apply(self, record: Dict[str, Any], variant_id: str, chosen: Dict[str, str],
+              rewriter: Optional[NameRewriter] = None) -> Dict[str, Any]:
+        """Build one variant of a record (pass the record's NameRewriter when building several)."""
+        rng = random.Random(variant_seed(self.seed, variant_id))
+        characters = record["characters"]
+        names = [characters[role] for role in ROLES]
+        new_names = list(names)
+        if "names" in chosen:
+            # the same draw for every variant sharing this names value
+            name_rng = np.random.default_rng(variant_seed(self.seed, f"{record['set_id']}~{chosen['names']}"))
+            new_names = self.name_index.sample(len(ROLES), name_rng, exclude=names)
+        if "roles" in chosen:
+            permutation = ROLE_PERMUTATIONS[int(chosen["roles"][1:])]
+            new_names = [new_names[i] for i in permutation]
+        mapping = {old: new for old, new in zip(names, new_names) if old != new}
+
+        leave_mapping = {}
+        topic = dict(record["topic"])
+        if "leave" in chosen:
+            context = record["full_context"].lower()
+            used = {topic.get(key) for key in LEAVE_REASON_KEYS}
+            for key in LEAVE_REASON_KEYS:
+                old = topic.get(key)
+                if not old or old.lower() not in context:
+                    continue
+                new = rng.choice([reason for reason in self.leave_reasons if reason not in used])
+                used.add(new)
+                leave_mapping[old.lower()] = new
+                topic[key] = new
+
+        rewriter = rewriter if rewriter is not None else NameRewriter(names)
+        variant = rewriter.rewrite(dict(record, topic=topic), mapping)
+        if leave_mapping:
+            pattern = re.compile("|".join(re.escape(old) for old in leave_mapping), re.IGNORECASE)
+            for key in ["full_context", "short_context"]:
+                variant[key] = pattern.sub(lambda match: leave_mapping[match.group(0).lower()], variant[key])
+
+        variant["set_id"] = variant_id
+        variant["base_set_id"] = record["set_id"]
+        variant["augmentation"] = chosen
+        if "truth" in chosen:
+            # not 1, so the question specs skip the truth questions when regenerating
+            variant["truth_id"] = HIDDEN_TRUTH_ID
+        for key, tokens_key in [("full_context", "full_context_tokens"), ("short_context", "Short_context_tokens")]:
+            if key in variant and tokens_key in variant:
+                variant[tokens_key] = len(self.encoding.encode(variant[key]))
+
+        if self.questions == "regenerate":
+            base = self.options_map.get(record["set_id"])
+            options_map = {variant_id: rewriter.rewrite(base, mapping)} if base is not None else {}
+            variant["multiple_liar"] = self.multiple_liar.get(record["set_id"], False)
+            variant.update(self.generator.generate(variant, options_map, rng))
+        else:
+            for field, prefix in QUESTION_FIELDS:
+                if field not in variant:
+                    continue
+                questions = variant[field]
+                if "truth" in chosen:
+                    questions = [question for question in questions if not is_truth_question(question)]
+                for i, question in enumerate(questions):
+                    question["q_id"] = f"{variant_id}-{prefix}-{i}"
+                variant[field] = questions
+        return variant
+
+    def variants(self, records: Iterable[Dict[str, Any]], limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily yield the variants of a stream of records.
+
+        Args:
+            records (iterable): dataset/final_set records (e.g. `iter_records(FINAL_SET_PATHS)`)
+            limit (int): Stop after this many variants
+        """
+        count = 0
+        for record in records:
+            rewriter = NameRewriter(record["characters"].values())
+            for variant_id, chosen in self.variant_ids(record):
+                if limit is not None and count >= limit:
+                    return
+                yield record if not chosen else self.apply(record, variant_id, chosen, rewriter)
+                count += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream augmented variants of the final_set conversations")
+    parser.add_argument('--paths', type=str, default=",".join(FINAL_SET_PATHS))
+    parser.add_argument('--axes', type=str, default="names,roles,leave,truth")
+    parser.add_argument('--names_per_set', type=int, default=2)
+    parser.add_argument('--roles_per_set', type=int, default=2)
+    parser.add_argument('--leave_per_set', type=int, default=2)
+    parser.add_argument('--questions', type=str, default="rewrite", choices=["rewrite", "regenerate"])
+    parser.add_argument('--name_index', type=str, default=NAME_INDEX_PATH)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--output', type=str, default=None, help="Write the variants as JSON lines (default: only count)")
+    args = parser.parse_args()
+
+    augmenter = ScenarioAugmenter([axis.strip() for axis in args.axes.split(",")], args.names_per_set,
+                                  args.roles_per_set, args.leave_per_set, args.seed, args.questions,
+                                  name_index_path=args.name_index)
+    records = iter_records([path.strip() for path in args.paths.split(",")])
+    start = time.time()
+    n_variants = n_questions = 0
+    out = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        for variant in augmenter.variants(records, args.limit):
+            n_variants += 1
+            n_questions += sum(len(variant.get(field, [])) for field in QUESTION_FIELD_NAMES)
+            if out is not None:
+                out.write(json.dumps(variant, ensure_ascii=False) + "\n")
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.time() - start
+    print(f"{n_variants} variants, {n_questions} questions in {elapsed:.2f}s "
+          f"({n_variants / elapsed if elapsed else 0:.1f} variants/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Group-by slicing engine for TactfulToM performance breakdowns.
+
+Joins flattened result entries (see `result_table.py`) to the scenario and
+question metadata in dataset/final_set and computes accuracy / count pivots
+over any combination of dimensions in a single bincount pass.
+
+Available dimensions after the join:
+  • result side:   model, file_name, type_num, category, format (mcq/binary/list),
+                   context_type, set_id
+  • scenario side: lie_type, emotion, relationship, real_reason_type, truth_id,
+                   multiple_liar (True/False, or "unknown" when the set lacks the flag),
+                   augmentation (augmented axes of a scenario variant, "none" otherwise)
+  • question side: question_type (e.g. "tom:belief:inaccessible:reason"),
+                   tom_type (e.g. "second-order:CB"), tom_order (first-order/second-order)
+
+Augmented runs (`get_original_results.py --augment_axes`) store the metadata
+of every variant in their result records ("slice_metadata"), since variant
+set_ids and q_ids are not in dataset/final_set; it is joined like the dataset's.
+
+Loaded result tables, dataset metadata and joins are cached on file mtimes, so
+repeated pivots in a notebook only pay for the bincount.
+
+Usage (from the repository root):
+    python code/slice_analysis.py --rows model,tom_order --columns category --where truth_id=1
+"""
+
+import argparse
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from prettytable import PrettyTable
+
+from result_table import RESULTS_DIR, encode, file_mtime, list_result_files, load_result_table
+
+
+DATASET_DIR = "dataset/final_set"
+
+SET_FIELDS = ["lie_type", "emotion", "relationship", "real_reason_type", "truth_id", "multiple_liar", "augmentation"]
+QUESTION_FIELDS = ["question_type", "tom_type", "tom_order"]
+# key of the variant metadata in the result records of augmented runs
+METADATA_KEY = "slice_metadata"
+
+
+def record_metadata(item: Dict) -> Tuple[Dict[str, str], Dict[str, Dict]]:
+    """
+    Slice metadata of one dataset record (or scenario variant).
+
+    Returns:
+        tuple: ({field: value} of the set, {q_id: {field: value}} of its questions)
+    """
+    # some sets spell the flag "muiltiple_liar", and some set_0 sets lack it ("unknown")
+    multiple_liar = item.get("multiple_liar", item.get("muiltiple_liar"))
+    set_meta = {
+        "lie_type": item.get("lie_type", ""),
+        "emotion": item.get("emotion", ""),
+        "relationship": item.get("relationship", ""),
+        "real_reason_type": str(item.get("real_reason_type", "")),
+        "truth_id": str(item.get("truth_id", "")),
+        "multiple_liar": "unknown" if multiple_liar is None else str(multiple_liar is True),
+        "augmentation": "+".join(item.get("augmentation") or {}) or "none"
+    }
+    question_meta = {}
+    for key, value in item.items():
+        if not isinstance(value, list):
+            continue
+        for question in value:
+            if isinstance(question, dict) and "q_id" in question:
+                tom_type = question.get("tom_type", "")
+                question_meta[question["q_id"]] = {
+                    "question_type": question.get("question_type", ""),
+                    "tom_type": tom_type,
+                    "tom_order": tom_type.split(":")[0]
+                }
+    return set_meta, question_meta
+
+
+@lru_cache(maxsize=None)
+def _load_set_metadata(path: str, mtime: float) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    set_meta, question_meta = {}, {}
+    for item in data:
+        item_set_meta, item_question_meta = record_metadata(item)
+        set_meta[item["set_id"]] = item_set_meta
+        question_meta.update(item_question_meta)
+    return set_meta, question_meta
+
+
+@lru_cache(maxsize=None)
+def _load_result_metadata(path: str, mtime: float) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """Variant metadata stored in the records of an augmented result file."""
+    set_meta, question_meta = {}, {}
+    if mtime < 0:
+        return set_meta, question_meta
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for record in data:
+        metadata = record.get(METADATA_KEY) if isinstance(record, dict) else None
+        if metadata:
+            set_meta[record["set_id"]] = metadata["set"]
+            question_meta.update(metadata["questions"])
+    return set_meta, question_meta
+
+
+def load_dataset_metadata(dataset_dir: str = DATASET_DIR) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """
+    Load set-level and question-level metadata for all final_set files.
+
+    Args:
+        dataset_dir (str): Directory holding Tactful_conv_set_*.json
+
+    Returns:
+        tuple: ({set_id: {field: value}}, {q_id: {field: value}}); all values are strings
+    """
+    set_meta, question_meta = {}, {}
+    for name in sorted(os.listdir(dataset_dir)):
+        if not (name.startswith("Tactful_conv_set_") and name.endswith(".json")):
+            continue
+        path = os.path.join(dataset_dir, name)
+        file_set_meta, file_question_meta = _load_set_metadata(path, file_mtime(path))
+        set_meta.update(file_set_meta)
+        question_meta.update(file_question_meta)
+    return set_meta, question_meta
+
+
+@lru_cache(maxsize=32)
+def _cached_table(file_names: Tuple[str, ...], condition: Optional[str], results_dir: str,
+                  mtimes: Tuple[float, ...]) -> Dict[str, np.ndarray]:
+    return load_result_table(list(file_names), condition, results_dir)
+
+
+@lru_cache(maxsize=32)
+def _cached_joined_table(file_names: Tuple[str, ...], condition: Optional[str], results_dir: str,
+                         dataset_dir: str, mtimes: Tuple[float, ...]) -> Dict[str, np.ndarray]:
+    table = _cached_table(file_names, condition, results_dir, mtimes[:len(file_names)])
+    set_meta, question_meta = load_dataset_metadata(dataset_dir)
+    set_meta, question_meta = dict(set_meta), dict(question_meta)
+    for file_name, mtime in zip(file_names, mtimes):
+        file_set_meta, file_question_meta = _load_result_metadata(os.path.join(results_dir, f"{file_name}.json"), mtime)
+        set_meta.update(file_set_meta)
+        question_meta.update(file_question_meta)
+    return join_metadata(table, set_meta, question_meta)
+
+
+def join_metadata(table: Dict[str, np.ndarray], set_meta: Dict[str, Dict],
+                  question_meta: Dict[str, Dict]) -> Dict[str, np.ndarray]:
+    """
+    Attach scenario and question metadata columns to a result table.
+
+    The join is done once per unique set_id / q_id and broadcast back with the
+    inverse index, so its cost scales with the number of questions, not entries.
+    The entry's answer format is renamed from "question_type" to "format" so that
+    "question_type" refers to the dataset's question type.
+
+    Returns:
+        dict: New table with the metadata columns added (missing values are "")
+    """
+    joined = dict(table)
+    joined["format"] = table["question_type"]
+
+    set_levels, set_codes = encode(table["set_id"])
+    for field in SET_FIELDS:
+        lookup = np.array([set_meta.get(s, {}).get(field, "") for s in set_levels] + [""], dtype=object)
+        joined[field] = lookup[set_codes] if len(set_codes) else np.empty(0, dtype=object)
+
+    q_levels, q_codes = encode(table["q_id"])
+    for field in QUESTION_FIELDS:
+        lookup = np.array([question_meta.get(q, {}).get(field, "") for q in q_levels] + [""], dtype=object)
+        joined[field] = lookup[q_codes] if len(q_codes) else np.empty(0, dtype=object)
+    return joined
+
+
+def load_joined_table(file_names: Optional[List[str]] = None, condition: Optional[str] = "full_context",
+                      results_dir: str = RESULTS_DIR, dataset_dir: str = DATASET_DIR) -> Dict[str, np.ndarray]:
+    """
+    Load (or reuse from cache) the result table joined with dataset metadata.
+
+    The cache key includes the mtimes of every result and dataset file, so an
+    updated file is picked up automatically.
+    """
+    if file_names is None:
+        file_names = list_result_files(results_dir)
+    paths = [os.path.join(results_dir, f"{name}.json") for name in file_names]
+    dataset_paths = [os.path.join(dataset_dir, name) for name in sorted(os.listdir(dataset_dir))]
+    mtimes = tuple(file_mtime(path) for path in paths + dataset_paths)
+    return _cached_joined_table(tuple(file_names), condition, results_dir, dataset_dir, mtimes)
+
+
+def select(table: Dict[str, np.ndarray], where: Optional[Dict[str, List[str]]] = None) -> np.ndarray:
+    """
+    Boolean mask of rows that match every `where` condition.
+
+    Args:
+        table (dict): Result table
+        where (dict): {column: [allowed values]}; values are compared as strings
+
+    Returns:
+        np.ndarray: Boolean mask
+    """
+    mask = ~np.isnan(table["score"])
+    for column, values in (where or {}).items():
+        mask &= np.isin(table[column].astype(str), [str(v) for v in values])
+    return mask
+
+
+def group_accuracy(table: Dict[str, np.ndarray], by: List[str],
+                   where: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """
+    Accuracy and counts over the cartesian product of `by` dimensions.
+
+    Args:
+        table (dict): Joined result table
+        by (list): Dimension names, e.g. ["model", "tom_order", "category"]
+        where (dict): Optional row filter (see `select`)
+
+    Returns:
+        dict: "dims" (the `by` list), "levels" (list of level lists), "sum",
+              "count" and "accuracy" arrays of shape [len(levels[d]) for d]
+              (accuracy is NaN where count == 0)
+    """
+    mask = select(table, where)
+    levels, codes = [], []
+    for name in by:
+        level, code = encode(table[name][mask])
+        levels.append(level)
+        codes.append(code)
+    dims = tuple(max(len(level), 1) for level in levels)
+
+    flat = np.ravel_multi_index(codes, dims) if codes and mask.any() else np.zeros(0, dtype=np.int64)
+    size = int(np.prod(dims))
+    sums = np.bincount(flat, weights=table["score"][mask], minlength=size).reshape(dims)
+    counts = np.bincount(flat, minlength=size).reshape(dims)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        accuracy = sums / counts
+    return {"dims": list(by), "levels": levels, "sum": sums, "count": counts, "accuracy": accuracy}
+
+
+def make_pivot_table(result: Dict, n_column_dims: int = 1) -> PrettyTable:
+    """
+    Render a `group_accuracy` result with the last `n_column_dims` dimensions as columns.
+    Cells are "accuracy (count)" with accuracy in percent.
+    """
+    dims, levels = result["dims"], result["levels"]
+    row_dims, col_dims = dims[:len(dims) - n_column_dims], dims[len(dims) - n_column_dims:]
+    row_shape = [len(level) for level in levels[:len(row_dims)]]
+    col_shape = [len(level) for level in levels[len(row_dims):]]
+
+    col_names = []
+    for col in np.ndindex(*col_shape):
+        col_names.append("/".join(levels[len(row_dims) + d][i] for d, i in enumerate(col)))
+
+    table = PrettyTable()
+    table.field_names = ["/".join(row_dims) or "all"] + col_names
+    for row in np.ndindex(*row_shape):
+        name = "/".join(levels[d][i] for d, i in enumerate(row)) or "all"
+        cells = []
+        for col in np.ndindex(*col_shape):
+            index = tuple(row) + tuple(col)
+            count = result["count"][index]
+            cells.append("-" if count == 0 else "{:.2f} ({})".format(result["accuracy"][index] * 100, count))
+        table.add_row([name] + cells)
+    return table
+
+
+def parse_where(where_args: Optional[List[str]]) -> Dict[str, List[str]]:
+    """Parse ["truth_id=1", "emotion=sad,angry"] into {"truth_id": ["1"], "emotion": ["sad", "angry"]}."""
+    where = {}
+    for arg in where_args or []:
+        column, _, values = arg.partition("=")
+        where[column.strip()] = [v.strip() for v in values.split(",")]
+    return where
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slice TactfulToM accuracy by scenario and question metadata")
+    parser.add_argument('--condition', type=str, default="full_context")
+    parser.add_argument('--file_names', type=str, default=None,
+                        help="Comma-separated result file names (default: every file in results/clean)")
+    parser.add_argument('--results_dir', type=str, default=RESULTS_DIR)
+    parser.add_argument('--dataset_dir', type=str, default=DATASET_DIR)
+    parser.add_argument('--rows', type=str, default="model,lie_type",
+                        help="Comma-separated row dimensions")
+    parser.add_argument('--columns', type=str, default="category",
+                        help="Comma-separated column dimensions")
+    parser.add_argument('--where', type=str, action="append",
+                        help="Row filter column=value[,value...]; may be repeated")
+    parser.add_argument('--output_dir', type=str, default="cases")
+    args = parser.parse_args()
+
+    file_names = [name.strip() for name in args.file_names.split(",")] if args.file_names else None
+    rows = [d.strip() for d in args.rows.split(",") if d.strip()]
+    columns = [d.strip() for d in args.columns.split(",") if d.strip()]
+
+    table = load_joined_table(file_names, args.condition, args.results_dir, args.dataset_dir)
+    result = group_accuracy(table, rows + columns, parse_where(args.where))
+    pivot = make_pivot_table(result, len(columns))
+    print(pivot)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    name = "slice_" + "_".join(rows + ["by"] + columns)
+    with open(os.path.join(args.output_dir, f"{name}.txt"), "w") as f:
+        f.write(pivot.get_string())
+    cells = []
+    for index in zip(*np.nonzero(result["count"])):
+        cell = {dim: result["levels"][d][i] for d, (dim, i) in enumerate(zip(result["dims"], index))}
+        cell["accuracy"] = float(result["accuracy"][index])
+        cell["count"] = int(result["count"][index])
+        cells.append(cell)
+    with open(os.path.join(args.output_dir, f"{name}.json"), "w") as f:
+        json.dump(cells, f, indent=3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Sparse-matrix token-F1 engine for freeform answers.
+
+`token_f1_score` in `evaluate_freeform.py` tokenizes both strings of every
+(answer, option) pair and builds Python sets per call. Here every unique
+string is tokenized once (or read from a per-tokenizer token cache), the token
+sets are encoded as rows of a binary CSR matrix over a shared vocabulary, and
+the overlaps of all answer × option pairs are computed with sparse products:
+
+    F1 = 2 |A ∩ O| / (|A| + |O|)
+
+which equals the precision / recall form of `token_f1_score`, including its
+conventions for empty token sets (both empty -> 1, one empty -> 0).
+"""
+
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from cache_utils import CACHE_DIR, atomic_write_json, load_json, text_hash
+
+
+class TokenCache:
+    def __init__(self, tokenizer_name: str, cache_dir: str = CACHE_DIR):
+        """Persistent text_hash -> token list map for one tokenizer."""
+        self.path = os.path.join(cache_dir, "tokens", f"{tokenizer_name}.json")
+        self.tokens: Dict[str, List[str]] = load_json(self.path, {})
+        self._dirty = False
+
+    def tokenize(self, texts: Sequence[str], tokenizer: Callable[[str], List[str]]) -> List[List[str]]:
+        result = []
+        for text in texts:
+            key = text_hash(text)
+            if key not in self.tokens:
+                self.tokens[key] = list(tokenizer(text))
+                self._dirty = True
+            result.append(self.tokens[key])
+        return result
+
+    def save(self):
+        if self._dirty:
+            atomic_write_json(self.path, self.tokens)
+            self._dirty = False
+
+
+def token_matrix(token_lists: Sequence[Sequence[str]]) -> sparse.csr_matrix:
+    """Binary (n_texts, vocab) CSR matrix with a 1 for every distinct token of a text."""
+    vocabulary, indices, indptr = {}, [], [0]
+    for tokens in token_lists:
+        columns = {vocabulary.setdefault(token, len(vocabulary)) for token in tokens}
+        indices.extend(sorted(columns))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float64)
+    return sparse.csr_matrix((data, np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                             shape=(len(token_lists), max(len(vocabulary), 1)))
+
+
+def pair_f1(matrix: sparse.csr_matrix, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Set-F1 between rows left[i] and right[i] of a binary token matrix."""
+    if not len(left):
+        return np.zeros(0)
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    common = np.asarray(matrix[left].multiply(matrix[right]).sum(axis=1)).ravel()
+    total = sizes[left] + sizes[right]
+    # both sides empty -> 1; one side empty -> common == 0 -> 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, 2 * common / total, 1.0)
+
+
+def batch_token_f1(items: Sequence[Tuple[object, str, List[str]]], tokenizer: Callable[[str], List[str]],
+                   token_cache: Optional[TokenCache] = None) -> List[List[float]]:
+    """
+    Token F1 of every answer against each of its options.
+
+    Args:
+        items (list): (entry, answer, options) tuples as built by `collect_freeform_items`
+        tokenizer (callable): Maps a string to a list of tokens
+        token_cache (TokenCache): Optional persistent token cache for `tokenizer`
+
+    Returns:
+        list: One list of F1 scores (in option order) per item
+    """
+    index = {}
+    for _, answer, options in items:
+        for text in [answer] + list(options):
+            if text not in index:
+                index[text] = len(index)
+    texts = list(index)
+    if token_cache is None:
+        token_lists = [tokenizer(text) for text in texts]
+    else:
+        token_lists = token_cache.tokenize(texts, tokenizer)
+        token_cache.save()
+    matrix = token_matrix(token_lists)
+
+    n_options = [len(options) for _, _, options in items]
+    left = np.repeat([index[answer] for _, answer, _ in items], n_options).astype(np.int64)
+    right = np.fromiter((index[option] for _, _, options in items for option in options),
+                        dtype=np.int64, count=int(sum(n_options)))
+    f1 = pair_f1(matrix, left, right)
+    bounds = np.cumsum([0] + n_options)
+    return [f1[bounds[i]:bounds[i + 1]].tolist() for i in range(len(items))]
+
+
+def f1_parity(items: Sequence[Tuple[object, str, List[str]]], batch_scores: List[List[float]],
+              pair_score: Callable[[str, str], float], tol: float = 1e-9) -> Dict:
+    """
+    Compare batch F1 scores with a per-pair reference implementation.
+
+    Returns:
+        dict: "n_pairs", "max_abs_diff" and "mismatches" (pairs differing by more than `tol`)
+    """
+    max_diff, mismatches, n_pairs = 0.0, [], 0
+    for (_, answer, options), scores in zip(items, batch_scores):
+        for option, score in zip(options, scores):
+            reference = pair_score(answer, option)
+            diff = abs(reference - score)
+            n_pairs += 1
+            max_diff = max(max_diff, diff)
+            if diff > tol:
+                mismatches.append({"answer": answer, "option": option, "reference": reference, "batch": score})
+    return {"n_pairs": n_pairs, "max_abs_diff": max_diff, "mismatches": mismatches}
@@ -0,0 +1,123 @@
+"""
+Compiled template engine for conversation prompts.
+
+A template such as "{{A: the liar name}} and {{B: the target name}} discuss
+{{Topic for the scenario}}" is parsed once into alternating literal and
+placeholder segments. Rendering a scenario is then a single join over the
+segments instead of one `str.replace` pass over the whole template per
+variable, and values are never re-scanned for placeholders. Templates are
+validated when compiled: placeholders with no variable and (optionally)
+variables the template never uses are reported up front.
+
+Character placeholders (A/B/C/D inside element strings such as
+"A does not want B's help") are replaced by a precompiled, token-aware
+pattern: only standalone capital letters (with an optional possessive 's / ’s)
+match, including inside quotes ("'A is busy'"), never letters inside words
+such as "Alice" or "DIY".
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(.*?)\}\}", re.DOTALL)
+
+CHARACTER_LETTERS = ("A", "B", "C", "D")
+# a letter right after an opening quote ('A is busy') or before a closing one still
+# matches; an apostrophe followed by a letter (A's, D'Angelo) is not a closing quote
+CHARACTER_PATTERN = re.compile(r"(?<!\w)([ABCD])(?:(['’])s)?(?!\w|['’]\w)")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    def __init__(self, template: str, variables: Optional[Iterable[str]] = None, allow_unused: bool = True):
+        """
+        Args:
+            template (str): Template text with {{placeholder}} markers
+            variables (iterable): Placeholder names that will be provided; when
+                given, placeholders outside it raise TemplateError
+            allow_unused (bool): If False, variables the template does not use
+                also raise TemplateError
+
+        Raises:
+            TemplateError: On missing (or unused) variables
+        """
+        self.template = template
+        self.literals: List[str] = []
+        self.names: List[str] = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(template):
+            self.literals.append(template[position:match.start()])
+            self.names.append(match.group(1))
+            position = match.end()
+        self.literals.append(template[position:])
+        self.placeholders = set(self.names)
+
+        self.unused: List[str] = []
+        if variables is not None:
+            variables = list(variables)
+            missing = sorted(self.placeholders - set(variables))
+            if missing:
+                raise TemplateError(f"Template placeholders without a variable: {missing}")
+            self.unused = [name for name in variables if name not in self.placeholders]
+            if self.unused and not allow_unused:
+                raise TemplateError(f"Variables not used by the template: {self.unused}")
+
+    def render(self, values: Mapping[str, str]) -> str:
+        """Fill in every placeholder; raises KeyError for a placeholder without a value."""
+        parts = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            parts.append(values[name])
+            parts.append(literal)
+        return "".join(parts)
+
+    def render_many(self, rows: Iterable[Mapping[str, str]]) -> Iterator[str]:
+        """Render a batch of scenarios lazily."""
+        for values in rows:
+            yield self.render(values)
+
+
+@lru_cache(maxsize=256)
+def compile_template(template: str, variables: Optional[Sequence[str]] = None) -> CompiledTemplate:
+    """Compile (or reuse) a template; `variables` must be a tuple to be cached."""
+    return CompiledTemplate(template, variables)
+
+
+def replace_characters(text: str, names: Mapping[str, str]) -> str:
+    """
+    Replace standalone character letters (and their possessives) with names.
+
+    Args:
+        text (str): Text with A/B/C/D placeholders
+        names (dict): Letter -> name
+
+    Returns:
+        str: Text with placeholders replaced; the apostrophe style of
+             possessives is kept
+
+    Examples (run with `python -m doctest code/template_engine.py`):
+        >>> names = character_names("Al", "Bo", "Cy", "Di")
+        >>> replace_characters("B said 'A is busy' to D", names)
+        "Bo said 'Al is busy' to Di"
+        >>> replace_characters("Why did A tell B 'I need C'?", names)
+        "Why did Al tell Bo 'I need Cy'?"
+        >>> replace_characters("A's and B’s plan with Alice, DIY", names)
+        "Al's and Bo’s plan with Alice, DIY"
+    """
+    def replacer(match):
+        name = names[match.group(1)]
+        return name + match.group(2) + "s" if match.group(2) else name
+    return CHARACTER_PATTERN.sub(replacer, text)
+
+
+def replace_characters_many(texts: Iterable[str], names_list: Iterable[Mapping[str, str]]) -> List[str]:
+    """Batch version of `replace_characters` with one name mapping per text."""
+    return [replace_characters(text, names) for text, names in zip(texts, names_list)]
+
+
+def character_names(A_name: str, B_name: str, C_name: str, D_name: str) -> Dict[str, str]:
+    return dict(zip(CHARACTER_LETTERS, (A_name, B_name, C_name, D_name)))
@@ -0,0 +1,339 @@
+"""
+Batched, cached token counts under the tokenizer of each target model.
+
+The full_context_tokens / Short_context_tokens keys of final_set are tiktoken
+(cl100k_base) counts written at generation time, and some sets lack them. This
+module counts contexts and compiled prompts with the tokenizer each model is
+actually served with:
+
+  • `tokenizer_for` maps a model name to a tokenizer spec: "tiktoken:<encoding>"
+    for the OpenAI models, "hf:<repository>" (the Hugging Face tokenizer of the
+    model) for the open models (Qwen, Llama, DeepSeek); --tokenizer overrides it
+  • `TokenCounter.count` counts a list of texts: every distinct text is looked
+    up in a persistent text_hash -> count cache per tokenizer
+    (cache/token_counts/), and the rest are tokenized in batches on a thread
+    pool (tiktoken and the fast Hugging Face tokenizers release the GIL); new
+    counts are kept in memory until `TokenCounter.save`
+  • `TokenCounter.count_messages` counts chat prompts: rendered with the chat
+    template of a Hugging Face tokenizer, or the message contents plus the fixed
+    per-message overhead for tiktoken
+  • `prompt_report` counts every prompt `get_original_results.py` would send
+    for a dataset file, for cost estimates and context-length pre-checks
+    (prompt + reserved completion tokens against CONTEXT_LIMITS), and
+    `longest_first` orders prompts for `get_original_results.py --longest_first`
+
+Hugging Face tokenizers are only needed for the open models:
+    pip install transformers
+
+Usage (from the repository root):
+    python code/token_counter.py --llms gpt-4o-2024-08-06,Qwen/Qwen2.5-72B-Instruct --prices prices.json
+    python code/token_counter.py --fill_missing
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import tiktoken
+from prettytable import PrettyTable
+
+from cache_utils import CACHE_DIR, atomic_write_json, load_json, text_hash
+from question_generation_utils import flatten_wrong_answers
+
+
+# encoding of the stored full_context_tokens / Short_context_tokens counts (see conv_pipeline.py)
+STORED_COUNT_ENCODING = "cl100k_base"
+CONTEXT_KEYS = [("full_context", "full_context_tokens"), ("short_context", "Short_context_tokens")]
+
+# context windows (prompt + completion) from the model cards; an endpoint may serve less (--context_limit)
+CONTEXT_LIMITS = {
+    "gpt-4o-2024-08-06": 128000,
+    "o1-2024-12-17": 200000,
+    "o3-2025-04-16": 200000,
+    "o3-mini-2025-01-31": 200000,
+    "Qwen/Qwen2.5-72B-Instruct": 32768,
+    "Qwen/QwQ-32B": 131072,
+    "deepseek-ai/DeepSeek-V3-0324": 163840,
+    "meta-llama/Llama-3.3-70B-Instruct": 131072,
+}
+
+# OpenAI chat format: every message adds 3 tokens, and the reply is primed with 3 more
+TIKTOKEN_MESSAGE_OVERHEAD = 3
+TIKTOKEN_REPLY_OVERHEAD = 3
+
+
+def tokenizer_for(llm_name: str) -> str:
+    """
+    Tokenizer spec of a model.
+
+    Returns:
+        str: "tiktoken:<encoding>" or "hf:<repository>"
+    """
+    if "/" in llm_name:
+        return f"hf:{llm_name}"
+    try:
+        return f"tiktoken:{tiktoken.encoding_for_model(llm_name).name}"
+    except KeyError:
+        raise ValueError(f"No known tokenizer for '{llm_name}'; pass --tokenizer {llm_name}=<spec>")
+
+
+class TokenCounter:
+    def __init__(self, tokenizer: str, cache_dir: Optional[str] = CACHE_DIR, batch_size: int = 256,
+                 num_threads: Optional[int] = None):
+        """
+        Args:
+            tokenizer (str): Tokenizer spec ("tiktoken:<encoding>" or "hf:<repository>")
+            cache_dir (str): Root cache directory (None: no persistent cache)
+            batch_size (int): Texts per tokenizer batch
+            num_threads (int): Tokenizer threads (default: all cores)
+        """
+        self.backend, _, self.name = tokenizer.partition(":")
+        if self.backend not in ("tiktoken", "hf") or not self.name:
+            raise ValueError(f"Unknown tokenizer spec '{tokenizer}', expected tiktoken:<encoding> or hf:<repository>")
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.num_threads = num_threads or os.cpu_count()
+        self.path = None
+        if cache_dir is not None:
+            self.path = os.path.join(cache_dir, "token_counts", re.sub(r"[^\w.@-]", "_", tokenizer) + ".json")
+        self.counts: Dict[str, int] = load_json(self.path, {}) if self.path else {}
+        self._encoder = None
+        self._dirty = False
+
+    def _load(self):
+        """The tokenizer itself, loaded on first use (a fully cached run never loads it)."""
+        if self._encoder is None:
+            if self.backend == "tiktoken":
+                self._encoder = tiktoken.get_encoding(self.name)
+            else:
+                from transformers import AutoTokenizer
+                self._encoder = AutoTokenizer.from_pretrained(self.name)
+        return self._encoder
+
+    def _batch_lengths(self, texts: List[str]) -> List[int]:
+        encoder = self._load()
+        if self.backend == "tiktoken":
+            return [len(encoder.encode_ordinary(text)) for text in texts]
+        return [len(ids) for ids in encoder(texts, add_special_tokens=False, return_attention_mask=False)["input_ids"]]
+
+    def count(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Token counts of a list of texts (each distinct uncached text is tokenized once).
+
+        Returns:
+            np.ndarray: int64 counts, in order
+        """
+        keys = [text_hash(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.counts and key not in missing:
+                missing[key] = text
+        if missing:
+            self._load()
+            items = list(missing.items())
+            batches = [items[start:start + self.batch_size] for start in range(0, len(items), self.batch_size)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                lengths = executor.map(self._batch_lengths, [[text for _, text in batch] for batch in batches])
+                for batch, batch_lengths in zip(batches, lengths):
+                    self.counts.update((key, length) for (key, _), length in zip(batch, batch_lengths))
+            self._dirty = True
+        return np.fromiter((self.counts[key] for key in keys), dtype=np.int64, count=len(keys))
+
+    def count_messages(self, prompts: Sequence[List[Dict[str, str]]]) -> np.ndarray:
+        """Prompt token counts of chat inputs ([{"role", "content"}, ...] each)."""
+        if self.backend == "hf":
+            encoder = self._load()
+            return self.count([encoder.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                               for messages in prompts])
+        content_counts = self.count([message["content"] for messages in prompts for message in messages])
+        n_messages = np.fromiter((len(messages) for messages in prompts), dtype=np.int64, count=len(prompts))
+        owners = np.repeat(np.arange(len(prompts)), n_messages)
+        totals = np.bincount(owners, weights=content_counts, minlength=len(prompts)).astype(np.int64)
+        return totals + TIKTOKEN_MESSAGE_OVERHEAD * n_messages + TIKTOKEN_REPLY_OVERHEAD
+
+    def save(self):
+        """Write the cache if counts were added since the last save (call once per run or file)."""
+        if self.path and self._dirty:
+            atomic_write_json(self.path, self.counts)
+            self._dirty = False
+
+
+def longest_first(counts: np.ndarray) -> List[int]:
+    """Indices ordered by descending token count (ties keep their order)."""
+    return np.argsort(-np.asarray(counts), kind="stable").tolist()
+
+
+def context_report(entries: List[Dict], counter: TokenCounter) -> Dict[str, Dict[str, float]]:
+    """min / mean / max token counts of full_context and short_context over a list of sets."""
+    report = {}
+    for key, _ in CONTEXT_KEYS:
+        texts = [entry[key] for entry in entries if isinstance(entry.get(key), str)]
+        counts = counter.count(texts)
+        if len(counts):
+            report[key] = {"n": len(counts), "min": int(counts.min()), "mean": float(counts.mean()),
+                           "max": int(counts.max())}
+    return report
+
+
+def dataset_prompts(entries: List[Dict], cot: bool) -> List[List[Dict[str, str]]]:
+    """
+    Every prompt `get_original_results.get_results` sends for a list of sets.
+
+    MCQ options are kept in dataset order, so the prompt texts (and their
+    cached counts) are stable; shuffling does not change their length.
+    """
+    # imported here: get_original_results imports this module for --longest_first
+    from get_original_results import get_set_inputs
+
+    def identity_mapping(question, question_type):
+        return list(range(1 + len(flatten_wrong_answers(question))))
+
+    prompts = []
+    for entry in entries:
+        prompts.extend(get_set_inputs(entry, cot, identity_mapping)[1])
+    return prompts
+
+
+def prompt_report(prompts: List[List[Dict[str, str]]], counter: TokenCounter, cot: bool,
+                  context_limit: Optional[int] = None, reserve_tokens: int = 8192, output_tokens: int = 0,
+                  prices: Optional[Sequence[float]] = None) -> Dict:
+    """
+    Token totals, cost estimate and context-length pre-check of a list of prompts.
+
+    Args:
+        prompts (list): Chat inputs
+        counter (TokenCounter): Counter of the target model's tokenizer
+        cot (bool): Chain-of-thought run; every prompt is sent twice, the second
+            time with the first response appended
+        context_limit (int): Context window of the model (None: no pre-check)
+        reserve_tokens (int): Completion tokens reserved per call (max_tokens)
+        output_tokens (int): Expected completion tokens per call, for the cost estimate
+        prices (sequence): (input, output) price per million tokens
+
+    Returns:
+        dict: {"n_prompts", "n_calls", "prompt_tokens": {"total", "mean", "max"},
+               "input_tokens", "output_tokens", "cost" (None without prices),
+               "over_limit": [prompt index, ...]}
+    """
+    counts = counter.count_messages(prompts)
+    calls = 2 if cot else 1
+    input_tokens = int(counts.sum()) * calls + output_tokens * (calls - 1) * len(prompts)
+    total_output = output_tokens * calls * len(prompts)
+    over_limit = []
+    if context_limit is not None:
+        # the second cot call also carries the first response
+        needed = counts + reserve_tokens * calls
+        over_limit = np.flatnonzero(needed > context_limit).tolist()
+    return {
+        "n_prompts": len(prompts),
+        "n_calls": calls * len(prompts),
+        "prompt_tokens": {"total": int(counts.sum()), "mean": float(counts.mean()) if len(counts) else 0.0,
+                          "max": int(counts.max()) if len(counts) else 0},
+        "input_tokens": input_tokens,
+        "output_tokens": total_output,
+        "cost": (input_tokens * prices[0] + total_output * prices[1]) / 1e6 if prices else None,
+        "over_limit": over_limit,
+    }
+
+
+def fill_missing_counts(files: List[str], counter: TokenCounter) -> int:
+    """
+    Add the stored-format context token counts to the sets that lack them.
+
+    Returns:
+        int: Number of counts added
+    """
+    n_added = 0
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        missing = [(entry, key, tokens_key) for entry in entries for key, tokens_key in CONTEXT_KEYS
+                   if tokens_key not in entry and isinstance(entry.get(key), str)]
+        if not missing:
+            continue
+        for (entry, _, tokens_key), count in zip(missing, counter.count([entry[key] for entry, key, _ in missing])):
+            entry[tokens_key] = int(count)
+        atomic_write_json(path, entries, indent=4)
+        counter.save()
+        n_added += len(missing)
+        print(f"{path}: added {len(missing)} token counts")
+    return n_added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count context and prompt tokens under each model's tokenizer")
+    parser.add_argument('--files', type=str, nargs="+", default=None, help="final_set files (default: all)")
+    parser.add_argument('--llms', type=str, default="Qwen/Qwen2.5-72B-Instruct,Qwen/QwQ-32B,deepseek-ai/DeepSeek-V3-0324,meta-llama/Llama-3.3-70B-Instruct,gpt-4o-2024-08-06")
+    parser.add_argument('--tokenizer', type=str, nargs="*", default=[],
+                        help="Tokenizer overrides, e.g. meta-llama/Llama-3.3-70B-Instruct=hf:/models/llama-3.3")
+    parser.add_argument('--cot', type=str, default="both", choices=["true", "false", "both"])
+    parser.add_argument('--context_limit', type=str, nargs="*", default=[],
+                        help="Context window overrides, e.g. Qwen/QwQ-32B=32768")
+    parser.add_argument('--reserve_tokens', type=int, default=8192, help="Completion tokens reserved per call")
+    parser.add_argument('--output_tokens', type=int, default=0, help="Expected completion tokens per call (for cost)")
+    parser.add_argument('--prices', type=str, default=None,
+                        help="JSON file {model: [input, output] price per million tokens}")
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--no_cache', action="store_true", help="Do not read or write the token count cache")
+    parser.add_argument('--fill_missing', action="store_true",
+                        help=f"Add missing full_context_tokens / Short_context_tokens ({STORED_COUNT_ENCODING}) and exit")
+    parser.add_argument('--output', type=str, default=None, help="Also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    from dataset_linter import set_files
+    files = args.files or set_files()
+    cache_dir = None if args.no_cache else CACHE_DIR
+
+    def make_counter(tokenizer):
+        return TokenCounter(tokenizer, cache_dir, args.batch_size, args.num_threads)
+
+    if args.fill_missing:
+        print(f"{fill_missing_counts(files, make_counter('tiktoken:' + STORED_COUNT_ENCODING))} token counts added")
+        return
+
+    overrides = dict(item.split("=", 1) for item in args.tokenizer)
+    limits = dict(CONTEXT_LIMITS, **{name: int(limit) for name, limit in
+                                     (item.split("=", 1) for item in args.context_limit)})
+    prices = load_json(args.prices, {}) if args.prices else {}
+    cot_list = {"true": [True], "false": [False], "both": [False, True]}[args.cot]
+
+    entries_by_file = {}
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            entries_by_file[path] = json.load(f)
+    all_entries = [entry for entries in entries_by_file.values() for entry in entries]
+    # prompts do not depend on the model, so they are built once
+    prompts = {(path, cot): dataset_prompts(entries, cot) for path, entries in entries_by_file.items() for cot in cot_list}
+
+    report = {}
+    table = PrettyTable(["model", "tokenizer", "file", "cot", "calls", "mean prompt", "max prompt",
+                         "input tokens", "cost", "over limit"])
+    for llm_name in [name.strip() for name in args.llms.split(",")]:
+        tokenizer = overrides.get(llm_name) or tokenizer_for(llm_name)
+        counter = make_counter(tokenizer)
+        report[llm_name] = {"tokenizer": tokenizer, "contexts": context_report(all_entries, counter), "prompts": {}}
+        for (path, cot), file_prompts in prompts.items():
+            result = prompt_report(file_prompts, counter, cot, limits.get(llm_name), args.reserve_tokens,
+                                   args.output_tokens, prices.get(llm_name))
+            report[llm_name]["prompts"][f"{os.path.basename(path)}:{'cot' if cot else 'no_cot'}"] = result
+            table.add_row([llm_name, tokenizer, os.path.basename(path), cot, result["n_calls"],
+                           f"{result['prompt_tokens']['mean']:.0f}", result["prompt_tokens"]["max"],
+                           result["input_tokens"], "-" if result["cost"] is None else f"${result['cost']:.2f}",
+                           len(result["over_limit"]) if llm_name in limits else "-"])
+        counter.save()
+    print(table)
+    for llm_name, result in report.items():
+        contexts = ", ".join(f"{key} {stats['min']}/{stats['mean']:.0f}/{stats['max']}"
+                             for key, stats in result["contexts"].items())
+        print(f"{llm_name} ({result['tokenizer']}) min/mean/max: {contexts}")
+    if args.output:
+        atomic_write_json(args.output, report, indent=2)
+
+
+if __name__ == "__main__":
+    main()